@@ -0,0 +1,270 @@
+"""
+Offline benchmark / load test for the EnWise backend.
+
+Runs main.app in-process with `client` swapped for FakeGeminiClient, so it needs
+no network and no API key.
+
+    python benchmark.py load --concurrency 32 --requests 200 --latency 0.5
+    python benchmark.py load --endpoints chat chat-stream --rate-limit 0.2
+    python benchmark.py load --same-input          # exercise cache / coalescing
+    python benchmark.py pdf --pages 10 50 200 500  # PDF extraction micro-benchmark
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import statistics
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def make_pdf(pages, words_per_page=350, seed=0):
+    """Synthetic textbook-like PDF with a running header and page numbers"""
+    import fitz  # PyMuPDF
+
+    vocabulary = ("energy force motion entropy cell protein enzyme equation integral derivative "
+                  "matrix vector theorem proof reaction molecule atom electron circuit voltage "
+                  "current graph tree algorithm complexity market demand supply history").split()
+    doc = fitz.open()
+    for page_number in range(pages):
+        words = [vocabulary[(seed + page_number * 7 + i * 13) % len(vocabulary)] for i in range(words_per_page)]
+        body = " ".join(words)
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 40, 550, 60), "Introductory Science Textbook", fontsize=9)
+        page.insert_textbox(fitz.Rect(50, 70, 550, 780), body, fontsize=9)
+        page.insert_textbox(fitz.Rect(280, 790, 320, 810), str(page_number + 1), fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+# --- LOAD TEST ---
+
+def load_app(args):
+    """Import main with an isolated data dir and the fake client installed"""
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-fake-key")
+    os.environ["ENWISE_DATA_DIR"] = tempfile.mkdtemp(prefix="enwise-bench-")
+    os.environ["MODEL_COOLDOWN_SECONDS"] = str(args.cooldown)
+    os.environ["PDF_EXTRACT_WORKERS"] = str(args.pdf_workers)
+    os.environ["MODEL_RPM"] = str(args.model_rpm)
+    import logging
+    logging.disable(logging.WARNING if args.quiet else logging.NOTSET)
+    import main
+    from fake_gemini import FakeGeminiClient
+
+    main.client = FakeGeminiClient(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_ratio=args.rate_limit,
+        response_chars=args.response_chars,
+        num_questions=args.num_questions,
+        seed=42,
+    )
+    return main
+
+
+def endpoint_requests(pdf_bytes, same_input, sync_packs=50):
+    """name -> factory(i) returning kwargs for httpx's client.request"""
+    from pack_store import make_pack_id
+    from result_cache import content_hash
+
+    def variant(i):
+        return "shared" if same_input else str(i)
+
+    # Packs the "offline-pack" requests publish (when run first), sent with a stale version
+    doc_hash = content_hash(pdf_bytes)
+    pack_ids = [make_pack_id(doc_hash, "Physics", f"Entropy {variant(k)}") for k in range(sync_packs)]
+
+    def pdf_form(i, **fields):
+        return {
+            "method": "POST",
+            "files": {"file": ("notes.pdf", pdf_bytes, "application/pdf")},
+            "data": {"no_cache": "false", **fields},
+        }
+
+    return {
+        "health": lambda i: {"method": "GET", "url": "/health"},
+        "chat": lambda i: {"method": "POST", "url": "/chat",
+                           "json": {"message": f"Explain entropy simply ({variant(i)})", "subject": "Physics"}},
+        "chat-stream": lambda i: {"method": "POST", "url": "/chat/stream",
+                                  "json": {"message": f"Explain entropy simply ({variant(i)})", "subject": "Physics"}},
+        "offline-pack": lambda i: {"url": "/generate-offline-pack",
+                                   **pdf_form(i, subject="Physics", chapter=f"Entropy {variant(i)}")},
+        "offline-packs": lambda i: {"url": "/generate-offline-packs", "method": "POST",
+                                    "files": [("files", ("notes.pdf", pdf_bytes, "application/pdf"))],
+                                    "data": {"subject": "Physics", "chapters": json.dumps(
+                                        [{"title": f"Part {k} {variant(i)}", "pages": [1 + k, 2 + k]}
+                                         for k in range(3)])}},
+        "pyq-quiz": lambda i: {"url": "/generate-pyq-quiz",
+                               **pdf_form(i, subject=f"Physics {variant(i)}", num_questions="5")},
+        "plan": lambda i: {"method": "POST", "url": "/generate-14-day-plan",
+                           "json": {"subject": f"Physics {variant(i)}", "syllabus_text": "Unit 1 Mechanics\nUnit 2 Heat",
+                                    "timetable_text": "Mon 5-7pm free\nTue 6-8pm free", "days": 14}},
+        "documents": lambda i: {"url": "/documents", "method": "POST",
+                                "files": {"file": ("notes.pdf", pdf_bytes, "application/pdf")}},
+        "quiz": lambda i: {"method": "POST", "url": "/generate-quiz",
+                           "json": {"topic": f"Entropy {variant(i)}", "difficulty": "medium", "num_questions": 5}},
+        "packs-sync": lambda i: {"method": "POST", "url": "/offline-packs/sync",
+                                 "json": {"packs": {pack_id: "stale" for pack_id in pack_ids}}},
+        "chat-session": lambda i: {"method": "POST", "url": "/chat/sessions"},
+    }
+
+
+async def drive(client, factory, total, concurrency):
+    latencies = []
+    statuses = {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total:
+            i = next_index
+            next_index += 1
+            request = factory(i)
+            started = time.perf_counter()
+            try:
+                response = await client.request(**request)
+                await response.aread()
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+        "statuses": statuses,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def run_load(args):
+    import httpx
+
+    main = load_app(args)
+    pdf_bytes = make_pdf(args.pdf_pages)
+    requests = endpoint_requests(pdf_bytes, args.same_input)
+    names = args.endpoints or list(requests)
+    unknown = [n for n in names if n not in requests]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {unknown}. Choose from {list(requests)}")
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name in names:
+            calls_before = main.client.calls
+            result = await drive(client, requests[name], args.requests, args.concurrency)
+            result["llm_calls"] = main.client.calls - calls_before
+            results[name] = result
+            print(f"{name:14s} {result['throughput_rps']:8.2f} req/s  "
+                  f"p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  "
+                  f"p99 {result['p99_ms']:8.1f} ms  llm calls {result['llm_calls']:5d}  "
+                  f"rss {result['peak_rss_mb']:.0f} MB  {result['statuses']}")
+    main.pdf_index.shutdown()
+    return results
+
+
+# --- PDF EXTRACTION MICRO-BENCHMARK ---
+
+async def run_pdf(args):
+    from pdf_extract import PdfTextIndex, _extract_page_range
+    from result_cache import content_hash
+
+    results = {}
+    for pages in args.pages:
+        data = make_pdf(pages, seed=pages)
+        doc_hash = content_hash(data)
+        row = {"pages": pages, "bytes": len(data)}
+
+        started = time.perf_counter()
+        _, full, _, _ = _extract_page_range(data, 0, None, None)
+        row["full_extract_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        row["chars"] = sum(len(t) for t in full.values())
+
+        started = time.perf_counter()
+        _extract_page_range(data, 0, None, args.budget)
+        row["budget_extract_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        index = PdfTextIndex(max_workers=args.pdf_workers)
+        started = time.perf_counter()
+        await asyncio.gather(*[index.get_text(data, f"{doc_hash}-{i}", max_chars=args.budget)
+                               for i in range(args.parallel)])
+        row[f"pool_x{args.parallel}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        started = time.perf_counter()
+        await index.get_text(data, f"{doc_hash}-0", max_chars=args.budget)
+        row["indexed_repeat_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        index.shutdown()
+
+        row["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        results[str(pages)] = row
+        print(json.dumps(row))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline EnWise backend benchmarks")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--pdf-workers", type=int, default=2, help="PDF_EXTRACT_WORKERS (0 = threads)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="Drive the FastAPI endpoints at a given concurrency")
+    load.add_argument("--endpoints", nargs="*", help="Subset of endpoints (default: all)")
+    load.add_argument("--requests", type=int, default=100, help="Requests per endpoint")
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--latency", type=float, default=0.5, help="Fake Gemini mean latency (s)")
+    load.add_argument("--jitter", type=float, default=0.2, help="Latency jitter as a fraction")
+    load.add_argument("--rate-limit", type=float, default=0.0, help="Probability of an injected 429")
+    load.add_argument("--cooldown", type=float, default=5.0, help="MODEL_COOLDOWN_SECONDS for the run")
+    load.add_argument("--model-rpm", type=float, default=100000,
+                      help="MODEL_RPM for the quota scheduler (default: effectively unlimited)")
+    load.add_argument("--response-chars", type=int, default=1500, help="Size of fake chat answers")
+    load.add_argument("--num-questions", type=int, default=5, help="Questions in fake quiz answers")
+    load.add_argument("--pdf-pages", type=int, default=30, help="Pages in the uploaded test PDF")
+    load.add_argument("--same-input", action="store_true",
+                      help="Send identical inputs (measures cache hits and coalescing)")
+    load.add_argument("--quiet", action="store_true", help="Silence per-request logging")
+
+    pdf = sub.add_parser("pdf", help="PDF extraction micro-benchmark over generated PDFs")
+    pdf.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200])
+    pdf.add_argument("--budget", type=int, default=6000, help="Character budget for budgeted extraction")
+    pdf.add_argument("--parallel", type=int, default=8, help="Concurrent extractions through the pool")
+
+    args = parser.parse_args()
+    runner = run_load if args.command == "load" else run_pdf
+    results = asyncio.run(runner(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import re
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+from shared_state import connect
+
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+SUMMARY_LEASE_SECONDS = 120  # A compaction claimed by a worker that died is freed after this
+
+
+def is_valid_session_id(session_id: str) -> bool:
+    return bool(session_id) and bool(_SESSION_ID_RE.match(session_id))
+
+
+class ChatSession:
+    __slots__ = ("session_id", "summary", "turns", "compacted", "summarizing", "created", "updated")
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.summary = ""  # Rolling summary of turns that were compacted away
+        self.turns = []  # Recent (role, text) pairs, oldest first
+        self.compacted = 0  # Turns folded into the summary so far (position of turns[0] in the conversation)
+        self.summarizing = False
+        self.created = self.updated = time.time()
+
+
+class ChatSessionStore:
+    """
+    Server-side tutor conversations, bounded by count (LRU) and idle time (TTL).
+
+    Each session keeps its recent turns verbatim plus a rolling summary of the
+    older ones. start_compaction() hands out the turns beyond `recent_turns`
+    so the caller can fold them into the summary (apply_summary), which keeps
+    the prompt size per turn flat however long the conversation runs. Only
+    one compaction per session runs at a time.
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 6 * 3600, recent_turns: int = 6):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.recent_turns = recent_turns
+        self._sessions = OrderedDict()
+        self.stats = {"created": 0, "expired": 0, "evicted": 0, "compactions": 0}
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def _purge_expired(self, now):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.updated <= self.ttl_seconds:
+                break
+            del self._sessions[oldest.session_id]
+            self.stats["expired"] += 1
+
+    def get(self, session_id: str, create: bool = True):
+        """Session by id (marked most recently used); unknown ids start a new one"""
+        if not is_valid_session_id(session_id):
+            raise ValueError(f"Invalid session_id: {session_id!r}")
+        now = time.time()
+        self._purge_expired(now)
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            return session
+        if not create:
+            return None
+        session = self._sessions[session_id] = ChatSession(session_id)
+        self.stats["created"] += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.stats["evicted"] += 1
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def add_exchange(self, session: ChatSession, question: str, answer: str):
+        session.turns.append(("student", question))
+        session.turns.append(("tutor", answer))
+        session.updated = time.time()
+
+    def turns_to_compact(self, session: ChatSession):
+        """Oldest turns beyond the verbatim window (empty if nothing to compact)"""
+        excess = len(session.turns) - self.recent_turns
+        return list(session.turns[:excess]) if excess > 0 else []
+
+    def start_compaction(self, session: ChatSession):
+        """Claim the session's next compaction: (offset, turns), or None if nothing to do or one is running"""
+        turns = self.turns_to_compact(session)
+        if not turns or session.summarizing:
+            return None
+        session.summarizing = True
+        return session.compacted, turns
+
+    def apply_summary(self, session: ChatSession, summary: str, offset: int, count: int):
+        """Replace the `count` turns claimed at `offset` by the new rolling summary"""
+        if session.compacted == offset:
+            session.summary = summary
+            del session.turns[:count]
+            session.compacted += count
+            self.stats["compactions"] += 1
+        session.summarizing = False
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def summary(self):
+        return {"active": len(self._sessions), **self.stats}
+
+
+class SharedChatSessionStore(ChatSessionStore):
+    """
+    ChatSessionStore kept in SQLite, for when several worker processes serve
+    the same students: every get() reads the session as last saved by any of
+    them. Same limits (count, idle time) and compaction as the in-memory store;
+    the compaction claim lives in the row, so two workers finishing turns of
+    one session together don't both summarize (and drop) the same turns.
+    """
+
+    def __init__(self, db_path: str, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._db = connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chat_sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " turns TEXT NOT NULL,"
+            " compacted INTEGER NOT NULL DEFAULT 0,"
+            " summarizing_until REAL NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(chat_sessions)")}
+        for column, kind in (("compacted", "INTEGER"), ("summarizing_until", "REAL")):
+            if column not in columns:  # Table from before compaction claims
+                self._db.execute(f"ALTER TABLE chat_sessions ADD COLUMN {column} {kind} NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions(updated)")
+        self._db.commit()
+
+    def _load(self, session_id):
+        row = self._db.execute(
+            "SELECT summary, turns, compacted, summarizing_until, created, updated FROM chat_sessions"
+            " WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        session = ChatSession(session_id)
+        session.summary, turns, session.compacted, summarizing_until, session.created, session.updated = row
+        session.turns = [tuple(turn) for turn in json.loads(turns)]
+        session.summarizing = summarizing_until > time.time()
+        return session
+
+    def _save(self, session):
+        """Write the conversation (the compaction claim is only changed by its own statements)"""
+        self._db.execute(
+            "INSERT INTO chat_sessions (session_id, summary, turns, compacted, created, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(session_id) DO UPDATE SET"
+            " summary = excluded.summary, turns = excluded.turns, compacted = excluded.compacted,"
+            " updated = excluded.updated",
+            (session.session_id, session.summary, json.dumps(session.turns, ensure_ascii=False),
+             session.compacted, session.created, session.updated),
+        )
+
+    @staticmethod
+    def _copy(source, session):
+        session.summary, session.turns = source.summary, source.turns
+        session.compacted, session.summarizing = source.compacted, source.summarizing
+
+    def get(self, session_id: str, create: bool = True):
+        if not is_valid_session_id(session_id):
+            raise ValueError(f"Invalid session_id: {session_id!r}")
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM chat_sessions WHERE updated < ?", (now - self.ttl_seconds,))
+            self.stats["expired"] += cursor.rowcount
+            session = self._load(session_id)
+            if session is None and create:
+                session = ChatSession(session_id)
+                self._save(session)
+                self.stats["created"] += 1
+                cursor = self._db.execute(
+                    "DELETE FROM chat_sessions WHERE session_id IN (SELECT session_id FROM chat_sessions"
+                    " ORDER BY updated DESC LIMIT -1 OFFSET ?)", (self.max_sessions,)
+                )
+                self.stats["evicted"] += cursor.rowcount
+            self._db.commit()
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def add_exchange(self, session: ChatSession, question: str, answer: str):
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")  # Read-modify-write against the other workers
+            self._copy(self._load(session.session_id) or session, session)  # Others may have added turns
+            super().add_exchange(session, question, answer)
+            self._save(session)
+
+    def start_compaction(self, session: ChatSession):
+        turns = self.turns_to_compact(session)
+        if not turns:
+            return None
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE chat_sessions SET summarizing_until = ?"
+                " WHERE session_id = ? AND compacted = ? AND summarizing_until < ?",
+                (now + SUMMARY_LEASE_SECONDS, session.session_id, session.compacted, now),
+            )
+        if cursor.rowcount == 0:
+            return None  # Another worker is summarizing (or already compacted these turns)
+        session.summarizing = True
+        return session.compacted, turns
+
+    def apply_summary(self, session: ChatSession, summary: str, offset: int, count: int):
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            latest = self._load(session.session_id)
+            if latest is None or latest.compacted != offset:
+                return  # Deleted, expired or compacted by someone else meanwhile: this claim is stale
+            super().apply_summary(latest, summary, offset, count)
+            self._save(latest)
+            self._db.execute("UPDATE chat_sessions SET summarizing_until = 0 WHERE session_id = ?",
+                             (session.session_id,))
+        self._copy(latest, session)
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()
+        return count
+
+    def summary(self):
+        return {"active": len(self), **self.stats}
+
+
+def history_for_prompt(session: ChatSession, max_chars: int) -> str:
+    """Rolling summary plus as many recent turns (newest kept first) as fit in max_chars"""
+    parts = []
+    used = 0
+    for role, text in reversed(session.turns):
+        line = f"{'Student' if role == 'student' else 'Tutor'}: {text}"
+        if used + len(line) > max_chars:
+            if not parts:
+                parts.append(line[-max_chars:])  # Always keep (the end of) the last turn
+            break
+        parts.append(line)
+        used += len(line)
+    history = "\n".join(reversed(parts))
+    if session.summary:
+        history = f"Summary of earlier conversation: {session.summary}\n{history}"
+    return history
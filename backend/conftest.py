@@ -0,0 +1,8 @@
+"""
+pytest setup for the backend tests.
+
+    cd backend && python -m pytest -q
+"""
+# Manual scripts from before the test suite (they need a running server or
+# exit on import), not pytest modules
+collect_ignore = ["test_backend.py", "test_env.py", "test_upload.py"]
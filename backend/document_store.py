@@ -0,0 +1,149 @@
+import os
+import re
+import json
+import shutil
+import time
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+_DOC_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_valid_doc_id(doc_id: str) -> bool:
+    return bool(doc_id) and bool(_DOC_ID_RE.match(doc_id))
+
+
+class DocumentStore:
+    """
+    Uploaded PDFs on local disk, addressed by content hash (doc_id).
+
+    Layout under root_dir/<first two hex chars>/:
+        <doc_id>.pdf         raw upload
+        <doc_id>.json        metadata (filename, size, page count, created)
+        <doc_id>.pages.json  extracted text, one string per page
+
+    The modification time of the .pdf is the document's last use (touch()).
+    Documents unused for `ttl_seconds` are removed by prune(), which put_file
+    runs at most every `prune_interval` seconds.
+    """
+
+    def __init__(self, root_dir: str, ttl_seconds: float = 30 * 24 * 3600, prune_interval: float = 3600.0):
+        self.root_dir = root_dir
+        self.ttl_seconds = ttl_seconds
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self.stats = {"pruned": 0}
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, doc_id, suffix):
+        if not is_valid_doc_id(doc_id):
+            raise ValueError(f"Invalid doc_id: {doc_id!r}")
+        return os.path.join(self.root_dir, doc_id[:2], doc_id + suffix)
+
+    def _write(self, path, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # Atomic, so readers never see half a file
+
+    def exists(self, doc_id: str) -> bool:
+        return is_valid_doc_id(doc_id) and os.path.exists(self._path(doc_id, ".pdf"))
+
+    def pdf_path(self, doc_id: str):
+        """Path of the stored PDF, or None if the document is unknown"""
+        return self._path(doc_id, ".pdf") if self.exists(doc_id) else None
+
+    def touch(self, doc_id: str):
+        """Mark the document as used now, so prune() keeps it"""
+        try:
+            os.utime(self._path(doc_id, ".pdf"))
+        except FileNotFoundError:
+            pass
+
+    def delete(self, doc_id: str):
+        for suffix in (".pdf", ".json", ".pages.json"):
+            try:
+                os.remove(self._path(doc_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def prune(self) -> int:
+        """Blocking: remove documents unused for ttl_seconds; returns how many"""
+        self._last_prune = time.time()
+        cutoff = self._last_prune - self.ttl_seconds
+        removed = 0
+        for shard in os.scandir(self.root_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                doc_id = entry.name[:-len(".pdf")]
+                if not (entry.name.endswith(".pdf") and is_valid_doc_id(doc_id)):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        self.delete(doc_id)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            self.stats["pruned"] += removed
+            logger.info(f"🧹 Document store removed {removed} unused documents")
+        return removed
+
+    def put_file(self, doc_id: str, source_path: str, filename: str = None) -> dict:
+        """Store the PDF at source_path (no-op if already stored) and return its metadata"""
+        if time.time() - self._last_prune > self.prune_interval:
+            self.prune()
+        meta = self.meta(doc_id)
+        if meta is not None:
+            self.touch(doc_id)
+            return meta
+        path = self._path(doc_id, ".pdf")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+        return self._write_meta(doc_id, filename, os.path.getsize(path))
+
+    def _write_meta(self, doc_id, filename, size):
+        meta = {
+            "doc_id": doc_id,
+            "filename": filename,
+            "size": size,
+            "pages": None,
+            "created": time.time(),
+        }
+        self._write(self._path(doc_id, ".json"), json.dumps(meta).encode("utf-8"))
+        logger.info(f"💾 Stored document {doc_id[:12]} ({size} bytes)")
+        return meta
+
+    def meta(self, doc_id: str):
+        if not self.exists(doc_id):
+            return None
+        try:
+            with open(self._path(doc_id, ".json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_pages(self, doc_id: str, pages):
+        self._write(self._path(doc_id, ".pages.json"), json.dumps(pages, ensure_ascii=False).encode("utf-8"))
+        meta = self.meta(doc_id)
+        if meta is not None:
+            meta["pages"] = len(pages)
+            self._write(self._path(doc_id, ".json"), json.dumps(meta).encode("utf-8"))
+
+    def load_pages(self, doc_id: str):
+        """Extracted per-page text, or None if it hasn't been saved"""
+        if not self.exists(doc_id):
+            return None
+        try:
+            with open(self._path(doc_id, ".pages.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
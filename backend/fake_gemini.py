@@ -0,0 +1,131 @@
+"""
+Offline stand-in for google.genai.Client, used by benchmark.py.
+
+Supports the calls main.py makes:
+    await client.aio.models.generate_content(model=..., contents=...)
+    await client.aio.models.generate_content_stream(model=..., contents=...)
+    client.models.generate_content(model=..., contents=...)
+with configurable latency, 429 injection and response size.
+"""
+import json
+import random
+import hashlib
+import asyncio
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeQuotaError(Exception):
+    pass
+
+
+def fake_quiz_json(num_questions=5, explanation_chars=80, seed=""):
+    """A quiz/PYQ/syllabus-topics-shaped JSON payload the endpoints can parse"""
+    quiz = [
+        {
+            # Distinct per prompt and index, like real questions (the question bank de-duplicates)
+            "q": f"Sample question {i + 1} on {hashlib.sha256(f'{seed}:{i}'.encode()).hexdigest()[:16]}?",
+            "options": ["Option A", "Option B", "Option C", "Option D"],
+            "a": "Option A",
+            "explanation": "x" * explanation_chars,
+        }
+        for i in range(num_questions)
+    ]
+    return json.dumps({
+        "summary": ["Key Concept 1", "Key Concept 2"],
+        "topics_found": ["Topic 1", "Topic 2"],
+        "difficulty": "Medium",
+        "quiz": quiz,
+        "topics": [{"name": f"Topic {t + 1}", "weight": 1 + t % 3, "subtopics": ["Part 1", "Part 2"]}
+                   for t in range(6)],
+    })
+
+
+class _FakeModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def generate_content(self, model, contents, config=None):
+        return await self._owner._respond(model, contents)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        return await self._owner._open_stream(model, contents)
+
+
+class _FakeSyncModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def generate_content(self, model, contents, config=None):
+        return asyncio.run(self._owner._respond(model, contents))
+
+
+class FakeGeminiClient:
+    """
+    latency:          mean seconds per call
+    jitter:           +/- fraction of latency applied uniformly
+    rate_limit_ratio: probability a call raises a 429 RESOURCE_EXHAUSTED error
+    exhausted_models: models that always raise 429
+    response_chars:   approximate size of chat (non-JSON) answers
+    num_questions:    questions in JSON answers
+    model_latency:    optional {model: seconds} overrides
+    """
+
+    def __init__(self, latency=0.5, jitter=0.2, rate_limit_ratio=0.0, exhausted_models=(),
+                 response_chars=1500, num_questions=5, model_latency=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.exhausted_models = set(exhausted_models)
+        self.response_chars = response_chars
+        self.num_questions = num_questions
+        self.model_latency = dict(model_latency or {})
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.quota_errors = 0
+        self.prompt_chars = 0
+        self.aio = type("Aio", (), {})()
+        self.aio.models = _FakeModels(self)
+        self.models = _FakeSyncModels(self)
+
+    def _delay(self, model):
+        base = self.model_latency.get(model, self.latency)
+        return max(base * (1 + self._random.uniform(-self.jitter, self.jitter)), 0.0)
+
+    def _maybe_fail(self, model):
+        if model in self.exhausted_models or self._random.random() < self.rate_limit_ratio:
+            self.quota_errors += 1
+            raise FakeQuotaError(
+                "429 RESOURCE_EXHAUSTED. {'error': {'code': 429, 'message': 'Quota exceeded', "
+                "'status': 'RESOURCE_EXHAUSTED', 'details': [{'retryDelay': '5s'}]}}"
+            )
+
+    def _text_for(self, contents):
+        prompt = contents if isinstance(contents, str) else str(contents)
+        if "JSON" in prompt or "json" in prompt:
+            return fake_quiz_json(self.num_questions, seed=prompt)
+        return ("This is a fake tutor answer. " * (self.response_chars // 29 + 1))[:self.response_chars]
+
+    async def _respond(self, model, contents):
+        self.calls += 1
+        self.prompt_chars += len(contents) if isinstance(contents, str) else 0
+        await asyncio.sleep(self._delay(model))
+        self._maybe_fail(model)
+        return FakeResponse(self._text_for(contents))
+
+    async def _open_stream(self, model, contents):
+        self.calls += 1
+        self.prompt_chars += len(contents) if isinstance(contents, str) else 0
+        delay = self._delay(model)
+        await asyncio.sleep(delay * 0.1)  # Time to first token
+        self._maybe_fail(model)
+        return self._stream_chunks(self._text_for(contents), delay * 0.9)
+
+    async def _stream_chunks(self, text, total_delay, chunk_chars=60):
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+        for chunk in chunks:
+            await asyncio.sleep(total_delay / len(chunks))
+            yield FakeResponse(chunk)
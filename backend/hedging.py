@@ -0,0 +1,38 @@
+from collections import deque
+
+
+class HedgeBudget:
+    """
+    Caps backup (hedge) requests at a fraction of recent Gemini calls, so
+    hedging trims tail latency without eating a meaningful share of quota.
+
+    Every primary call is recorded; try_spend() only allows a hedge while
+    hedges stay at or below `fraction` of the last `window` calls.
+    """
+
+    def __init__(self, fraction: float = 0.1, window: int = 200):
+        self.fraction = fraction
+        self._recent = deque(maxlen=window)  # True = hedge, False = primary
+        self.stats = {"primary": 0, "hedged": 0, "hedge_wins": 0, "denied": 0}
+
+    def record_primary(self):
+        self._recent.append(False)
+        self.stats["primary"] += 1
+
+    def try_spend(self) -> bool:
+        hedges = sum(self._recent)
+        if hedges + 1 > self.fraction * len(self._recent):
+            self.stats["denied"] += 1
+            return False
+        self._recent.append(True)
+        self.stats["hedged"] += 1
+        return True
+
+    def refund(self):
+        """Undo the last try_spend() (the hedge could not be sent after all)"""
+        if self._recent and self._recent[-1]:
+            self._recent.pop()
+            self.stats["hedged"] -= 1
+
+    def record_win(self):
+        self.stats["hedge_wins"] += 1
@@ -0,0 +1,295 @@
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+
+from shared_state import connect
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+class JobStore:
+    """
+    Jobs and their results in a SQLite file, so they survive a restart and
+    can be shared by several worker processes. A running job holds a lease
+    (its `updated` time, renewed while it runs); a job whose lease ran out
+    was abandoned by a dead process and may be claimed again.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._db = connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " stage TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " result TEXT,"
+            " error TEXT,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created)")
+        self._db.commit()
+
+    def create(self, kind: str, params: dict) -> dict:
+        now = time.time()
+        job = {"job_id": uuid.uuid4().hex, "kind": kind, "params": params, "status": QUEUED,
+               "stage": None, "attempts": 0, "result": None, "error": None, "created": now, "updated": now}
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (job_id, kind, params, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (job["job_id"], kind, json.dumps(params, ensure_ascii=False), QUEUED, now, now),
+            )
+            self._db.commit()
+        return job
+
+    def update(self, job_id: str, **fields):
+        fields["updated"] = time.time()
+        for name in ("result", "error"):
+            if name in fields and fields[name] is not None:
+                fields[name] = json.dumps(fields[name], ensure_ascii=False)
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT job_id, kind, params, status, stage, attempts, result, error, created, updated"
+                " FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, params, status, stage, attempts, result, error, created, updated = row
+        return {"job_id": job_id, "kind": kind, "params": json.loads(params), "status": status,
+                "stage": stage, "attempts": attempts,
+                "result": json.loads(result) if result else None,
+                "error": json.loads(error) if error else None,
+                "created": created, "updated": updated}
+
+    def claim(self, job_id: str, lease_seconds: float):
+        """Mark a queued (or abandoned) job running for this process; the job, or None if someone else has it"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, stage = 'started', attempts = attempts + 1, updated = ?"
+                " WHERE job_id = ? AND (status = ? OR (status = ? AND updated < ?))",
+                (RUNNING, now, job_id, QUEUED, RUNNING, now - lease_seconds),
+            )
+            self._db.commit()
+        return self.get(job_id) if cursor.rowcount else None
+
+    def renew(self, job_ids):
+        with self._lock:
+            self._db.executemany("UPDATE jobs SET updated = ? WHERE job_id = ? AND status = ?",
+                                 [(time.time(), job_id, RUNNING) for job_id in job_ids])
+            self._db.commit()
+
+    def release(self, job_ids):
+        """Put running jobs back in the queue (their process is shutting down)"""
+        with self._lock:
+            self._db.executemany("UPDATE jobs SET status = ?, stage = 'interrupted', updated = ?"
+                                 " WHERE job_id = ? AND status = ?",
+                                 [(QUEUED, time.time(), job_id, RUNNING) for job_id in job_ids])
+            self._db.commit()
+
+    def abandoned(self, lease_seconds: float):
+        """Ids of running jobs whose lease ran out"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id FROM jobs WHERE status = ? AND updated < ? ORDER BY created",
+                (RUNNING, time.time() - lease_seconds),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def unfinished(self):
+        """Ids of queued or interrupted jobs, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs last updated more than older_than seconds ago"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (DONE, FAILED, time.time() - older_than),
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+
+class JobRunner:
+    """
+    Runs stored jobs on a fixed number of asyncio workers.
+
+    handlers maps a job kind to `async fn(params, progress) -> result`, where
+    progress(stage_name) reports how far the job got. error_mapper
+    turns an exception into (status_code, detail, retry_after or None); jobs
+    failing with 429 are re-queued after retry_after, up to max_attempts.
+    Progress is pushed to subscribers as (event, data) pairs: "stage" while
+    running, then "done" or "error". Jobs are claimed in the store before
+    they run, so several processes can share one store; each also picks up
+    jobs abandoned by a process that died (see JobStore).
+    """
+
+    def __init__(self, store: JobStore, handlers: dict, error_mapper, workers: int = 2,
+                 max_attempts: int = 3, retention_seconds: float = 7 * 24 * 3600,
+                 lease_seconds: float = 60.0):
+        self.store = store
+        self.handlers = handlers
+        self.error_mapper = error_mapper
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self._queue = None
+        self._tasks = []
+        self._running = set()
+        self._subscribers = {}  # job_id -> set of asyncio.Queue
+        self.stats = {"submitted": 0, "resumed": 0, "done": 0, "failed": 0, "retried": 0}
+
+    def ensure_started(self):
+        """Start the workers (once) and re-queue jobs left unfinished by a previous run"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        purged = self.store.purge(self.retention_seconds)
+        resumed = self.store.unfinished()
+        for job_id in resumed:
+            self._queue.put_nowait(job_id)
+        self.stats["resumed"] += len(resumed)
+        if resumed or purged:
+            logger.info(f"🗂️ Jobs: resumed {len(resumed)}, purged {purged} old")
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._keep_leases()))
+
+    async def shutdown(self):
+        interrupted = list(self._running)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        # Back to the queue, for whichever process starts (or adopts them) next
+        self.store.release(interrupted)
+
+    def submit(self, kind: str, params: dict) -> dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.ensure_started()
+        job = self.store.create(kind, params)
+        self._queue.put_nowait(job["job_id"])
+        self.stats["submitted"] += 1
+        return job
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # --- progress ---
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def _publish(self, job_id, event, data):
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait((event, data))
+
+    def stage_listener(self, job_id):
+        """Callback for metrics.stage(): records and publishes the stage a job is in"""
+        def listener(name):
+            self.store.update(job_id, stage=name)
+            self._publish(job_id, "stage", {"stage": name})
+        return listener
+
+    # --- workers ---
+
+    async def _keep_leases(self):
+        """Renew the leases of our running jobs and adopt jobs abandoned by dead processes"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                self.store.renew(list(self._running))
+                for job_id in self.store.abandoned(self.lease_seconds):
+                    if job_id not in self._running:
+                        self._queue.put_nowait(job_id)
+            except Exception as e:
+                logger.error(f"Job lease upkeep failed: {e}")
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} crashed the runner: {e}")
+
+    async def _run(self, job_id):
+        job = self.store.claim(job_id, self.lease_seconds)
+        if job is None:
+            return  # Finished, or taken by another worker process
+        attempts = job["attempts"]
+        self._running.add(job_id)
+        try:
+            await self._attempt(job, attempts)
+        finally:
+            self._running.discard(job_id)
+
+    async def _attempt(self, job, attempts):
+        job_id = job["job_id"]
+        self._publish(job_id, "stage", {"stage": "started", "attempt": attempts})
+        logger.info(f"🏃 Job {job_id[:8]} ({job['kind']}) attempt {attempts}")
+        try:
+            result = await self.handlers[job["kind"]](job["params"], self.stage_listener(job_id))
+        except asyncio.CancelledError:
+            raise  # Shutting down: shutdown() puts the job back in the queue
+        except Exception as e:
+            status_code, detail, retry_after = self.error_mapper(e)
+            if status_code == 429 and attempts < self.max_attempts:
+                delay = retry_after or 5.0
+                self.store.update(job_id, status=QUEUED, stage=f"waiting {delay:.0f}s for quota")
+                self._publish(job_id, "stage", {"stage": "waiting for quota", "retry_after": delay})
+                self.stats["retried"] += 1
+                asyncio.get_running_loop().call_later(delay, self._requeue, job_id)
+                return
+            error = {"status_code": status_code, "detail": detail}
+            self.store.update(job_id, status=FAILED, stage=None, error=error)
+            self._publish(job_id, "error", error)
+            self.stats["failed"] += 1
+            logger.error(f"❌ Job {job_id[:8]} failed: {detail}")
+            return
+        self.store.update(job_id, status=DONE, stage=None, result=result)
+        self._publish(job_id, "done", {"result": result})
+        self.stats["done"] += 1
+        logger.info(f"✅ Job {job_id[:8]} done")
+
+    def _requeue(self, job_id):
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
@@ -0,0 +1,174 @@
+"""
+CPU-only quiz generator, the last tier when no Gemini model has quota left.
+
+Builds multiple choice questions straight from the PDF text:
+- keyphrases (words and two-word phrases) are ranked by TF-IDF over sentences
+- the sentences richest in keyphrases become questions: "X is ..." sentences
+  as definition questions, the others as fill-in-the-blank (cloze) questions
+- distractors are keyphrases that co-occur with the answer elsewhere in the
+  text, so they come from the same topic
+
+Everything after sentence splitting is NumPy over (sentence, term) index
+arrays, so a 100-page document takes a fraction of a second.
+
+    pack = local_quiz(text, num_questions=5, query="thermodynamics entropy")
+"""
+import re
+
+import numpy as np
+
+from retrieval import STOPWORDS
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z\-]*[A-Za-z]")
+_DEFINITION_RE = re.compile(
+    r"^(?:the |an? )?(?P<term>[A-Za-z][\w\- ]{2,40}?)\s+"
+    r"(?:is defined as|is called|refers to|is|are|means)\s+(?P<rest>.{20,})$",
+    re.IGNORECASE,
+)
+MIN_SENTENCE_CHARS = 40
+MAX_SENTENCE_CHARS = 300
+MAX_SENTENCES = 20000
+MIN_TERM_CHARS = 4
+NUM_OPTIONS = 4
+BLANK = "_____"
+
+
+def split_sentences(text: str):
+    """Sentences of a usable length for questions, whitespace-normalised"""
+    text = re.sub(r"\s+", " ", text or "")
+    return [s.strip() for s in _SENTENCE_RE.split(text)
+            if MIN_SENTENCE_CHARS <= len(s.strip()) <= MAX_SENTENCE_CHARS][:MAX_SENTENCES]
+
+
+def _terms(sentence):
+    """(key, surface form) of the candidate keyphrases in a sentence: content words and word pairs"""
+    words = _WORD_RE.findall(sentence)
+    keys = [w.lower() for w in words]
+    content = [k not in STOPWORDS and len(k) >= MIN_TERM_CHARS for k in keys]
+    terms = [(k, w) for k, w, ok in zip(keys, words, content) if ok]
+    terms += [(f"{keys[i]} {keys[i + 1]}", f"{words[i]} {words[i + 1]}")
+              for i in range(len(words) - 1) if content[i] and content[i + 1]]
+    return terms
+
+
+class _Index:
+    """Sentence x term incidence as parallel index arrays, with TF-IDF keyphrase scores"""
+
+    def __init__(self, sentences):
+        vocab = {}
+        surface = []
+        rows, cols = [], []
+        for i, sentence in enumerate(sentences):
+            for key, form in _terms(sentence):
+                j = vocab.get(key)
+                if j is None:
+                    j = vocab[key] = len(surface)
+                    surface.append(form)
+                rows.append(i)
+                cols.append(j)
+        self.vocab = vocab
+        self.keys = list(vocab)
+        self.surface = surface
+        n_sentences, n_terms = len(sentences), len(surface)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        tf = np.bincount(cols, minlength=n_terms).astype(float)
+        pairs = np.unique(rows * max(n_terms, 1) + cols)  # Distinct (sentence, term)
+        self.rows, self.cols = pairs // max(n_terms, 1), pairs % max(n_terms, 1)
+        df = np.bincount(self.cols, minlength=n_terms).astype(float)
+        idf = np.log((n_sentences + 1) / (df + 1)) + 1
+        # Keyphrases recur but are not everywhere; two-word phrases get a bonus
+        useful = (df >= 2) & (df <= max(2, 0.2 * n_sentences))
+        words_per_term = np.array([key.count(" ") + 1 for key in self.keys], dtype=float)
+        self.score = np.where(useful, np.log1p(tf) * idf * (1 + 0.5 * (words_per_term - 1)), 0.0)
+        self.idf = idf
+        self.words_per_term = words_per_term
+
+    def sentence_scores(self, lengths, boost_terms=()):
+        """Keyphrase weight per sentence, multiplied by 1 + the number of query terms in it"""
+        scores = np.bincount(self.rows, weights=self.score[self.cols], minlength=len(lengths))
+        boost = [self.vocab[t] for t in boost_terms if t in self.vocab]
+        if boost:
+            scores *= 1 + np.bincount(self.rows[np.isin(self.cols, boost)], minlength=len(lengths))
+        return scores / np.sqrt(np.maximum(lengths, 1))
+
+    def terms_in(self, sentence_index):
+        return self.cols[self.rows == sentence_index]
+
+    def distractors(self, answer, exclude, count):
+        """Keyphrases co-occurring with the answer (any keyphrase if too few), of the same length in words"""
+        with_answer = np.isin(self.rows, self.rows[self.cols == answer])
+        co = np.bincount(self.cols[with_answer], minlength=len(self.keys)).astype(float)
+        rank = (co + 0.1) * self.idf
+        rank[(self.score <= 0) | (self.words_per_term != self.words_per_term[answer])] = 0
+        rank[list(exclude)] = 0
+        picked = []
+        for j in np.argsort(-rank, kind="stable"):
+            if rank[j] <= 0 or len(picked) == count:
+                break
+            key = self.keys[j]
+            if any(key in self.keys[p] or self.keys[p] in key for p in picked + [answer]):
+                continue
+            picked.append(int(j))
+        return picked
+
+
+def _question(index, sentences, i, answer, rng):
+    sentence = sentences[i]
+    form = index.surface[answer]
+    definition = _DEFINITION_RE.match(sentence)
+    if definition and definition.group("term").lower().strip() == index.keys[answer]:
+        question = f"Which term is described as: \"{definition.group('rest').rstrip('.')}\"?"
+    else:
+        cloze = re.sub(re.escape(form), BLANK, sentence, count=1, flags=re.IGNORECASE)
+        question = f"Fill in the blank: {cloze}"
+    exclude = set(index.terms_in(i).tolist())
+    distractors = index.distractors(answer, exclude, NUM_OPTIONS - 1)
+    if len(distractors) < NUM_OPTIONS - 1:
+        return None
+    options = [form] + [index.surface[j] for j in distractors]
+    rng.shuffle(options)
+    return {
+        "q": question,
+        "options": options,
+        "a": form,
+        "explanation": f"From your notes: \"{sentence}\"",
+    }
+
+
+def local_quiz(text: str, num_questions: int = 5, query: str = "", seed: int = 0) -> dict:
+    """
+    {"summary": [...], "quiz": [...]} in the offline pack shape, built from
+    the text alone. The quiz may be shorter than num_questions (or empty)
+    when the text has too few usable sentences.
+    """
+    sentences = split_sentences(text)
+    if not sentences:
+        return {"summary": [], "quiz": []}
+    index = _Index(sentences)
+    lengths = np.array([len(s) for s in sentences], dtype=float)
+    scores = index.sentence_scores(lengths, [w.lower() for w in _WORD_RE.findall(query or "")])
+    rng = np.random.default_rng(seed)
+
+    quiz = []
+    used_terms = set()
+    for i in np.argsort(-scores, kind="stable"):
+        if len(quiz) == num_questions or scores[i] <= 0:
+            break
+        candidates = [j for j in index.terms_in(i).tolist() if index.score[j] > 0 and j not in used_terms]
+        if not candidates:
+            continue
+        # A sentence defining one of its keyphrases asks for that term
+        definition = _DEFINITION_RE.match(sentences[i])
+        defined = index.vocab.get(definition.group("term").lower().strip()) if definition else None
+        answer = defined if defined in candidates else max(candidates, key=lambda j: index.score[j])
+        question = _question(index, sentences, int(i), answer, rng)
+        if question is not None:
+            quiz.append(question)
+            used_terms.add(answer)
+
+    top_terms = np.argsort(-index.score, kind="stable")[:5]
+    summary = [index.surface[j] for j in top_terms if index.score[j] > 0]
+    return {"summary": summary, "quiz": quiz}
@@ -1,16 +1,53 @@
 import os
 import json
-import fitz  # PyMuPDF
-from google import genai
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+import gzip
+import time
+IMPORT_STARTED = time.perf_counter()  # Cold-start timing, see /ready
+import asyncio
+import math
+import inspect
+import threading
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from typing import List
+from typing import Dict, List, Optional
 import logging
+import contextlib
+import sqlite3
+from collections import Counter
+from datetime import date
+
+from result_cache import ResultCache, content_hash, make_cache_key
+from pdf_extract import PdfTextIndex
+from retrieval import ContextSelector, tokenize
+from document_store import DocumentStore, is_valid_doc_id
+from single_flight import SingleFlight, request_key
+from model_router import ModelRouter, AllModelsCoolingDown, CHAT, GENERATION, is_quota_error
+from metrics import (registry, stage, record_model_call, RequestMetricsMiddleware, TraceIdFilter,
+                     endpoint_var, stage_listener_var, STRUCTURED_OUTPUTS)
+from profiler import SamplingProfiler
+from hedging import HedgeBudget
+from uploads import UploadSpool, UploadRejected, UploadLimitMiddleware, SpoolFile, spooling_route
+from jobs import JobStore, JobRunner, FINISHED, DONE, FAILED
+from shared_state import SharedState
+from question_bank import QuestionBank
+from pack_store import PackStore, make_pack_id, brotli  # brotli is None when not installed
+from chat_sessions import ChatSessionStore, SharedChatSessionStore, history_for_prompt, is_valid_session_id
+from schemas import OfflinePack, PyqQuiz, SyllabusTopics, TopicQuiz, StructuredOutputError, parse_structured
+import planner
+from scheduler import (QuotaScheduler, Overloaded, ClientIdMiddleware, PRIORITY_INTERACTIVE, PRIORITY_BULK,
+                       client_id_var)
 
 # --- SETUP LOGGING ---
-logging.basicConfig(level=logging.INFO)
+# LOG_TRACE_IDS=1 tags every log line with the request's trace id (X-Request-ID)
+if os.getenv("LOG_TRACE_IDS", "0") == "1":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:[%(trace_id)s] %(message)s")
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+else:
+    logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- INITIALIZATION ---
@@ -19,11 +56,11 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 load_dotenv(dotenv_path=os.path.join(SCRIPT_DIR, ".env.local"))
 API_KEY = os.getenv("GEMINI_API_KEY")
 
-if not API_KEY:
-    logger.warning("⚠️ GEMINI_API_KEY not found! Set it in .env.local")
-    raise ValueError("GEMINI_API_KEY is required. Please set it in .env.local file")
-
-logger.info(f"✅ API Key loaded successfully (starts with: {API_KEY[:10]}...)")
+if API_KEY:
+    logger.info(f"✅ API Key loaded successfully (starts with: {API_KEY[:10]}...)")
+else:
+    # Degraded mode: cached results, the question bank and local quizzes still work
+    logger.warning("⚠️ GEMINI_API_KEY not found! Set it in .env.local. Starting without AI generation.")
 
 app = FastAPI(title="Enwise AI Backend")
 
@@ -34,172 +71,236 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "X-Cache", "Retry-After", "Location", "ETag", "X-Pack-ID"],
+)
+# Per-request trace ids and latency histograms (see /metrics)
+app.add_middleware(RequestMetricsMiddleware)
+# Caller identity (IP, plus X-Client-ID as a sub-key) for fair sharing of the Gemini quota.
+# Behind a reverse proxy, list it in TRUSTED_PROXIES (comma-separated addresses or
+# networks) so each client is keyed on its forwarded IP instead of the proxy's.
+app.add_middleware(ClientIdMiddleware, trusted_proxies=os.getenv("TRUSTED_PROXIES", "").split(","))
+
+# --- GEMINI CLIENT ---
+# google.genai is most of the import time, so the client is created by the warm-up
+# task started at startup (see STARTUP) or on first use, never at import.
+client = None
+client_error = None  # Why the client could not be created
+client_lock = threading.Lock()
+
+class GeminiUnavailable(HTTPException):
+    """No Gemini client on this server: no API key, or the SDK failed to load"""
+
+    def __init__(self, reason: str):
+        super().__init__(status_code=503, detail=f"AI generation is not available on this server: {reason}")
+
+def get_client():
+    """The Gemini client, created on first call (blocking: import + setup)"""
+    global client, client_error
+    if client is not None:
+        return client
+    if not API_KEY:
+        raise GeminiUnavailable("GEMINI_API_KEY is not set.")
+    with client_lock:
+        if client is None:
+            try:
+                from google import genai
+                client = genai.Client(api_key=API_KEY)
+                client_error = None
+                logger.info("✅ Gemini Client initialized successfully")
+            except Exception as e:
+                client_error = str(e)
+                logger.error(f"❌ Failed to initialize Gemini Client: {e}")
+                raise GeminiUnavailable("the Gemini client failed to start.")
+    return client
+
+async def ensure_client():
+    if client is None:
+        await asyncio.to_thread(get_client)
+
+def ai_status() -> str:
+    if client is not None:
+        return "ready"
+    if not API_KEY:
+        return "missing_key"
+    return f"error: {client_error}" if client_error else "not_loaded"
+
+# --- RESULT CACHE ---
+# Identical uploads (same bytes + same parameters) reuse the previous generation.
+# Bump PROMPT_VERSION whenever a prompt template changes so old results are not served.
+PROMPT_VERSION = "4"
+DATA_DIR = os.getenv("ENWISE_DATA_DIR", os.path.join(SCRIPT_DIR, "data"))
+result_cache = ResultCache(
+    db_path=os.getenv("RESULT_CACHE_PATH", os.path.join(DATA_DIR, "result_cache.sqlite3")),
+    max_memory_entries=int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", "256")),
+    max_disk_entries=int(os.getenv("RESULT_CACHE_DISK_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+)
+
+@app.on_event("shutdown")
+def flush_result_cache():
+    result_cache.flush()
+
+# --- WORKER PROCESSES ---
+# serve.py runs WORKERS processes of this app. They then share the Gemini quota
+# buckets, model cooldowns and chat sessions through SQLite files in DATA_DIR; the
+# result cache, jobs and question bank are SQLite files already.
+WORKERS = int(os.getenv("WORKERS", "1"))
+SHARED_STATE = WORKERS > 1 or os.getenv("SHARED_STATE", "0") == "1"
+shared_state = SharedState(os.getenv("SHARED_STATE_PATH", os.path.join(DATA_DIR, "shared_state.sqlite3"))) \
+    if SHARED_STATE else None
+
+# --- PDF EXTRACTION ---
+# Text is extracted in worker processes and only up to the budget a prompt can use.
+# PDF_EXTRACT_WORKERS=0 runs extraction in the default thread pool instead.
+# Extracted pages are compacted (running headers/footers, page numbers, hyphenation,
+# TOC pages, repeated paragraphs) so the prompt budgets hold more of the chapter.
+pdf_index = PdfTextIndex(
+    max_workers=int(os.getenv("PDF_EXTRACT_WORKERS", "2")),
+    max_documents=int(os.getenv("PDF_INDEX_DOCUMENTS", "32")),
+    compact=os.getenv("PDF_COMPACTION", "1") == "1",
+    dedupe_paragraphs=os.getenv("PDF_DEDUPE_PARAGRAPHS", "1") == "1",
+)
+
+@app.on_event("shutdown")
+def shutdown_pdf_workers():
+    pdf_index.shutdown()
+
+# --- DOCUMENT STORE ---
+# PDFs uploaded once to /documents and referenced afterwards by doc_id (content hash).
+# Documents (including the ones stored for ?job=true uploads) expire after
+# DOCUMENT_TTL_DAYS without use.
+document_store = DocumentStore(
+    os.getenv("DOCUMENT_STORE_DIR", os.path.join(DATA_DIR, "documents")),
+    ttl_seconds=float(os.getenv("DOCUMENT_TTL_DAYS", "30")) * 24 * 3600,
 )
 
-# Initialize the Client with Gemini 2.5 capabilities
-try:
-    client = genai.Client(api_key=API_KEY)
-    logger.info("✅ Gemini Client initialized successfully")
-except Exception as e:
-    logger.error(f"❌ Failed to initialize Gemini Client: {e}")
-    raise
+# --- UPLOADS ---
+# PDFs are written to the spool directory while the multipart body is parsed
+# (never held in memory whole, never copied) and opened by path for extraction.
+# Bodies over the limit of their route are refused before they are read when
+# they announce a Content-Length, otherwise as soon as they pass it.
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+MAX_REQUEST_BYTES = int(float(os.getenv("MAX_REQUEST_MB", "200")) * 1024 * 1024)
+FORM_OVERHEAD_BYTES = 64 * 1024  # Multipart headers and form fields next to a single PDF
+SINGLE_UPLOAD_ROUTES = ("/generate-offline-pack", "/generate-pyq-quiz", "/documents")
+upload_spool = UploadSpool(os.getenv("UPLOAD_SPOOL_DIR", os.path.join(DATA_DIR, "uploads")), MAX_UPLOAD_BYTES)
+app.router.route_class = spooling_route(upload_spool)  # Routes are declared below
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_REQUEST_BYTES,
+                   route_limits={path: MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES for path in SINGLE_UPLOAD_ROUTES})
+
+# --- CONTEXT SELECTION ---
+# Prompts get the chunks that best match the chapter name / question (BM25)
+# instead of the first N characters of the document.
+RETRIEVAL_SOURCE_CHARS = int(os.getenv("RETRIEVAL_SOURCE_CHARS", "300000"))
+CHAT_CONTEXT_CHARS = int(os.getenv("CHAT_CONTEXT_CHARS", "1000"))
+context_selector = ContextSelector()
 
 # --- DATA MODELS ---
 class MindMapRequest(BaseModel):
     subject: str
     syllabus_text: str
     timetable_text: str
-    days: int = 14
+    days: int = Field(14, ge=1, le=90)
+    start_date: Optional[str] = None  # ISO date of day 1, default today
+
+class ReplanRequest(BaseModel):
+    plan: dict  # As returned by /generate-14-day-plan
+    from_day: int = Field(ge=1)
+    missed_days: List[int] = []
+    days: Optional[int] = Field(None, ge=1, le=90)
+    start_date: Optional[str] = None  # ISO date of from_day, default today
 
 class ChatRequest(BaseModel):
     message: str
     subject: str = ""
     language: str = "auto"  # auto-detect or specify: english, hindi, spanish, etc.
     context: str = ""  # Additional context like uploaded notes
+    doc_id: str = ""  # Stored document (from /documents) to use as context
+    session_id: str = ""  # Server-side conversation (from /chat/sessions); empty = stateless
+
+class QuizRequest(BaseModel):
+    topic: str = Field(min_length=1, max_length=200)
+    difficulty: str = "medium"  # easy, medium or hard (beginner/intermediate/advanced also accepted)
+    num_questions: int = Field(5, ge=1, le=20)
+    no_cache: bool = False
+
+class PackSyncRequest(BaseModel):
+    packs: Dict[str, str] = {}  # pack_id -> version the client has
 
 # --- HELPER FUNCTIONS ---
-def extract_text_from_pdf(file_bytes):
-    try:
-        doc = fitz.open(stream=file_bytes, filetype="pdf")
-        text = "".join([page.get_text() for page in doc])
-        doc.close()
-        return text
-    except Exception as e:
-        logger.error(f"PDF Extraction Error: {e}")
-        return ""
+async def extract_text_from_pdf(source, doc_hash, max_chars=None, start_page=0, end_page=None):
+    """Text of the PDF (or a page range of it) up to max_chars characters ("" if it can't be read)"""
+    return await pdf_index.get_text(source, doc_hash, max_chars=max_chars,
+                                    start_page=start_page, end_page=end_page)
 
-def clean_json_response(response_text):
-    """Extracts JSON from markdown-wrapped AI responses"""
-    text = response_text.strip()
-    if "```json" in text:
-        text = text.split("```json")[1].split("```")[0]
-    elif "```" in text:
-        text = text.split("```")[1].split("```")[0]
-    
-    start = text.find('{')
-    end = text.rfind('}')
-    if start != -1 and end != -1:
-        text = text[start:end+1]
-    return text.strip()
+async def relevant_text_from_pdf(source, doc_hash, query, max_chars, start_page=0, end_page=None):
+    """The max_chars of the PDF that best match the query ("" if it can't be read)"""
+    with stage("pdf_extract"):
+        text = await extract_text_from_pdf(source, doc_hash, max_chars=RETRIEVAL_SOURCE_CHARS,
+                                           start_page=start_page, end_page=end_page)
+    if not text:
+        return ""
+    doc_key = f"{doc_hash}:{start_page}:{end_page}"
+    with stage("context_select"):
+        return await asyncio.to_thread(context_selector.select, doc_key, text, query, max_chars)
 
-# List of models to try (each has separate quota)
-FALLBACK_MODELS = [
-    "gemini-2.5-pro",
-    "gemini-2.0-flash-exp",
-    "gemini-2.5-flash-lite",
-    "gemini-exp-1206",
-    "gemini-2.0-flash",
-    "gemini-2.0-flash-lite", 
-    "gemini-2.5-flash",
-]
+async def open_stored_document(doc_id: str):
+    """Path of a stored PDF, with its saved page text loaded into the extraction index"""
+    if not is_valid_doc_id(doc_id) or not document_store.exists(doc_id):
+        raise HTTPException(status_code=404, detail="Unknown doc_id. Upload the PDF to /documents first.")
+    document_store.touch(doc_id)
+    if pdf_index.page_count(doc_id) is None:
+        pages = await asyncio.to_thread(document_store.load_pages, doc_id)
+        if pages is not None:
+            pdf_index.seed(doc_id, pages)
+    return document_store.pdf_path(doc_id)
 
-async def generate_with_fallback(prompt: str):
-    """Try multiple models until one works (each has separate rate limits)"""
-    last_error = None
-    for model in FALLBACK_MODELS:
+async def spool_upload(file: UploadFile):
+    """(path, doc_hash) of the upload copied to disk; release with upload_spool.release(doc_hash)"""
+    with stage("upload_read"):
         try:
-            logger.info(f"🔄 Trying model: {model}")
-            response = client.models.generate_content(
-                model=model,
-                contents=prompt
-            )
-            logger.info(f"✅ Success with model: {model}")
-            return response.text
-        except Exception as e:
-            error_msg = str(e)
-            logger.warning(f"⚠️ {model} failed: {error_msg[:100]}")
-            last_error = e
-            if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg:
-                continue  # Try next model
+            if isinstance(file.file, SpoolFile):  # Parsed into the spool already
+                tmp_path, doc_hash, size = await asyncio.to_thread(upload_spool.take, file.file)
             else:
-                raise  # Re-raise non-quota errors
-    
-    # All models exhausted
-    raise last_error
-
-# --- ENDPOINTS ---
-
-@app.get("/health")
-async def health():
-    return {"status": "healthy", "models": FALLBACK_MODELS}
-
-@app.post("/generate-offline-pack")
-async def generate_offline_pack(
-    file: UploadFile = File(...), 
-    subject: str = Form(...), 
-    chapter: str = Form(...)
-):
-    logger.info(f"📥 Quiz Request: {subject} - {chapter}")
-    content = await file.read()
-    text = extract_text_from_pdf(content)
-
-    if not text:
-        raise HTTPException(status_code=400, detail="Could not read PDF text.")
+                tmp_path, doc_hash, size = await asyncio.to_thread(upload_spool.copy_to_disk, file.file)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return upload_spool.acquire(tmp_path, doc_hash), doc_hash
 
+@contextlib.asynccontextmanager
+async def pdf_source(file: Optional[UploadFile], doc_id: Optional[str]):
+    """(source path, doc_hash) for either an uploaded file or a stored doc_id"""
+    if doc_id:
+        yield await open_stored_document(doc_id), doc_id
+        return
+    if file is None:
+        raise HTTPException(status_code=400, detail="Send a PDF file or a doc_id.")
+    path, doc_hash = await spool_upload(file)
     try:
-        prompt = f"""
-        Act as an expert tutor for {subject}. 
-        Material for {chapter}: {text[:6000]}
-        Generate a 5-question PREREQUISITE quiz testing ONLY foundational knowledge.
-        Return ONLY a JSON object: {{"summary": ["Key Concept 1"], "quiz": [{{"q": "Quest?", "options": ["A","B","C","D"], "a": "A"}}]}}
-        """
-        
-        # Use fallback system to try multiple models
-        response_text = await generate_with_fallback(prompt)
-        return json.loads(clean_json_response(response_text))
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"AI Quiz Error: {e}")
-        
-        # Handle rate limiting specifically
-        if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg or "quota" in error_msg.lower():
-            raise HTTPException(
-                status_code=429, 
-                detail="API rate limit reached. Free tier allows 20 requests/day. Please wait a minute and try again."
-            )
-        raise HTTPException(status_code=500, detail=f"Generation Failed: {error_msg}")
+        yield path, doc_hash
+    finally:
+        upload_spool.release(doc_hash)
 
-@app.post("/generate-14-day-plan")
-async def generate_14_day_plan(request: MindMapRequest):
-    logger.info(f"📥 Generating 14-Day Roadmap for: {request.subject}")
-    try:
-        prompt = f"""
-        Subject: {request.subject}
-        Syllabus: {request.syllabus_text[:4000]}
-        Timetable: {request.timetable_text[:3000]}
-        
-        Create a 14-day study roadmap. Map syllabus topics to the free slots in the timetable.
-        Return ONLY a JSON object: 
-        {{
-            "root": "{request.subject} Plan", 
-            "days": [{{
-                "day": 1, 
-                "topic": "Topic Name", 
-                "subtopics": ["Part 1", "Part 2"],
-                "duration": "2 hours"
-            }}]
-        }}
-        """
-        response_text = await generate_with_fallback(prompt)
-        return json.loads(clean_json_response(response_text))
-    except Exception as e:
-        logger.error(f"AI Roadmap Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+async def relevant_chat_context(request: ChatRequest) -> str:
+    """Parts of the chat context (and stored document) that best match the student's question"""
+    context = request.context
+    doc_key = None
+    if request.doc_id:
+        path = await open_stored_document(request.doc_id)
+        doc_text = await extract_text_from_pdf(path, request.doc_id, max_chars=RETRIEVAL_SOURCE_CHARS)
+        context = f"{context}\n{doc_text}" if context else doc_text
+        doc_key = f"{request.doc_id}:{content_hash(request.context.encode('utf-8'))}"
+    if len(context) <= CHAT_CONTEXT_CHARS:
+        return context
+    doc_key = doc_key or content_hash(context.encode("utf-8"))
+    with stage("context_select"):
+        return await asyncio.to_thread(
+            context_selector.select, doc_key, context, request.message, CHAT_CONTEXT_CHARS, 300
+        )
 
-@app.post("/chat")
-async def ai_tutor_chat(request: ChatRequest):
-    """
-    Flexible AI Tutor that can:
-    - Explain any educational topic
-    - Respond in multiple languages
-    - Solve numerical problems step-by-step
-    - Provide real-life analogies
-    """
-    logger.info(f"💬 Chat Request: {request.message[:50]}...")
-    
-    try:
-        # Build the system prompt for a flexible educational AI
-        system_prompt = f"""You are EnWise AI Tutor - an extremely flexible, knowledgeable, and friendly educational assistant.
+# Static tutor instructions, sent as the system instruction so every chat call
+# shares the same prefix (eligible for Gemini's implicit prompt caching)
+TUTOR_SYSTEM_PROMPT = """You are EnWise AI Tutor - an extremely flexible, knowledgeable, and friendly educational assistant.
 
 YOUR CAPABILITIES:
 1. **Multilingual**: Detect the language of the user's question and respond in the SAME language. If they ask in Hindi, reply in Hindi. If Spanish, reply in Spanish. If they explicitly request a language (e.g., "explain in French"), use that language.
@@ -223,10 +324,6 @@ YOUR CAPABILITIES:
    - Clarify doubts patiently
    - Encourage the student
 
-CURRENT CONTEXT:
-- Subject being studied: {request.subject if request.subject else 'General'}
-- Additional context: {request.context[:1000] if request.context else 'None provided'}
-
 RESPONSE STYLE:
 - Be warm, encouraging, and patient
 - Use emojis sparingly for friendliness
@@ -236,49 +333,590 @@ RESPONSE STYLE:
 
 Remember: You are here to make learning enjoyable and accessible!"""
 
-        # Create the full prompt
-        full_prompt = f"{system_prompt}\n\nStudent's Question: {request.message}"
-        
-        response_text = await generate_with_fallback(full_prompt)
-        
-        return {
-            "response": response_text,
-            "detected_language": "auto",
-            "subject": request.subject
-        }
-        
+CHAT_CONFIG = {"system_instruction": TUTOR_SYSTEM_PROMPT}
+
+def build_chat_prompt(request: ChatRequest, context: str = None, history: str = "") -> str:
+    """Per-turn part of the tutor prompt (shared by /chat and /chat/stream)"""
+    if context is None:
+        context = request.context[:CHAT_CONTEXT_CHARS]
+    prompt = f"""CURRENT CONTEXT:
+- Subject being studied: {request.subject if request.subject else 'General'}
+- Additional context: {context if context else 'None provided'}"""
+    if history:
+        prompt += f"\n\nCONVERSATION SO FAR:\n{history}"
+    return f"{prompt}\n\nStudent's Question: {request.message}"
+
+# List of models to try (each has separate quota)
+FALLBACK_MODELS = [
+    "gemini-2.5-pro",
+    "gemini-2.0-flash-exp",
+    "gemini-2.5-flash-lite",
+    "gemini-exp-1206",
+    "gemini-2.0-flash",
+    "gemini-2.0-flash-lite", 
+    "gemini-2.5-flash",
+]
+
+# Concurrent identical requests attach to one pending generation
+in_flight = SingleFlight()
+
+# Tracks cooldowns and latency per model so exhausted models are skipped
+model_router = ModelRouter(
+    FALLBACK_MODELS,
+    base_cooldown=float(os.getenv("MODEL_COOLDOWN_SECONDS", "60")),
+    max_cooldown=float(os.getenv("MODEL_MAX_COOLDOWN_SECONDS", "3600")),
+    shared=shared_state,
+)
+
+# --- LLM CONCURRENCY ---
+# Calls go through the async client so a slow model never blocks the event loop.
+# The semaphore caps how many Gemini calls are in flight across all requests.
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "16"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))
+DISCONNECT_POLL_INTERVAL = 0.5
+llm_slots = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+
+# --- QUOTA SCHEDULER ---
+# Every Gemini call first waits for room in its model's RPM/TPM token buckets.
+# Chat is served before bulk generation, clients share capacity fairly, and a
+# request that would queue longer than its max wait gets 429 + Retry-After.
+# MODEL_LIMITS overrides per model, e.g. {"gemini-2.5-flash": {"rpm": 10, "tpm": 250000}}
+quota_scheduler = QuotaScheduler(
+    json.loads(os.getenv("MODEL_LIMITS", "{}")),
+    default_rpm=float(os.getenv("MODEL_RPM", "15")),
+    default_tpm=float(os.getenv("MODEL_TPM", "1000000")),
+    bucket_factory=shared_state.bucket if shared_state else None,
+)
+MAX_QUEUE_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.getenv("MAX_QUEUE_WAIT_CHAT", "10")),
+    PRIORITY_BULK: float(os.getenv("MAX_QUEUE_WAIT_GENERATION", "30")),
+}
+EXPECTED_OUTPUT_TOKENS = 1000
+
+def quota_request(prompt: str, endpoint_class: str):
+    """(estimated tokens, priority) of a Gemini call for the scheduler"""
+    priority = PRIORITY_INTERACTIVE if endpoint_class == CHAT else PRIORITY_BULK
+    return len(prompt) // 4 + EXPECTED_OUTPUT_TOKENS, priority
+
+async def acquire_model(candidates, prompt: str, endpoint_class: str) -> str:
+    """Wait for quota on one of `candidates` and return the model to call"""
+    tokens, priority = quota_request(prompt, endpoint_class)
+    with stage("quota_wait"):
+        return await quota_scheduler.acquire(candidates, tokens, priority, max_wait=MAX_QUEUE_WAIT[priority])
+
+def next_candidates(endpoint_class: str, tried: set):
+    """Healthy models not tried yet for this request (empty if none are left)"""
+    try:
+        return [m for m in model_router.candidates(endpoint_class) if m not in tried]
+    except AllModelsCoolingDown:
+        return []
+
+def rate_limit_error(e) -> Optional[HTTPException]:
+    """429 with a Retry-After header for shed or quota-exhausted work, else None"""
+    if isinstance(e, (Overloaded, AllModelsCoolingDown)):
+        retry_after = e.retry_after
+    elif is_quota_error(e):
+        retry_after = max(model_router.retry_after(), 1.0)
+    else:
+        return None
+    return HTTPException(
+        status_code=429,
+        detail=f"AI is busy right now. Please try again in {math.ceil(retry_after)} seconds.",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+async def call_model(model: str, prompt: str, config=None):
+    """Single Gemini call, bounded by the in-flight limit and the per-call timeout"""
+    with stage("llm_queue"):
+        await llm_slots.acquire()
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(
+            client.aio.models.generate_content(model=model, contents=prompt, config=config),
+            timeout=LLM_CALL_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        record_model_call(model, "timeout", time.perf_counter() - started, len(prompt))
+        raise
+    except asyncio.CancelledError:
+        record_model_call(model, "cancelled", time.perf_counter() - started, len(prompt))
+        raise
     except Exception as e:
-        logger.error(f"Chat Error: {e}")
-        raise HTTPException(status_code=500, detail=f"AI Error: {str(e)}")
+        outcome = "quota" if is_quota_error(e) else "error"
+        record_model_call(model, outcome, time.perf_counter() - started, len(prompt))
+        raise
+    finally:
+        llm_slots.release()
+    record_model_call(model, "ok", time.perf_counter() - started, len(prompt), len(response.text or ""))
+    return response.text
 
-@app.post("/generate-pyq-quiz")
-async def generate_pyq_quiz(
-    file: UploadFile = File(...), 
-    subject: str = Form(...),
-    num_questions: int = Form(5)
-):
+async def try_model(model: str, prompt: str, endpoint_class: str, config=None):
+    """One model attempt with router bookkeeping; timeouts surface as TimeoutError"""
+    try:
+        logger.info(f"🔄 Trying model: {model}")
+        started = time.perf_counter()
+        response_text = await call_model(model, prompt, config)
+        model_router.record_success(model, time.perf_counter() - started, endpoint_class)
+        logger.info(f"✅ Success with model: {model}")
+        return response_text
+    except asyncio.TimeoutError:
+        model_router.record_failure(model)
+        logger.warning(f"⏱️ {model} timed out after {LLM_CALL_TIMEOUT}s")
+        raise TimeoutError(f"{model} timed out after {LLM_CALL_TIMEOUT}s")
+    except Exception as e:
+        logger.warning(f"⚠️ {model} failed: {str(e)[:100]}")
+        if is_quota_error(e):
+            cooldown = model_router.record_quota_error(model, e)
+            logger.info(f"🧊 {model} cooling down for {cooldown:.0f}s")
+        else:
+            model_router.record_failure(model)
+        raise
+
+# --- HEDGED REQUESTS ---
+# On the endpoints in HEDGE_ENDPOINTS, if the chosen model hasn't answered within
+# the HEDGE_PERCENTILE of its recent latency, a backup call goes to the next
+# healthy model and the first answer wins. Backups are capped at HEDGE_BUDGET
+# of recent calls and only fire if the quota scheduler has room right away.
+HEDGE_ENDPOINTS = {p.strip() for p in os.getenv("HEDGE_ENDPOINTS", "/chat").split(",") if p.strip()}
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "90"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "5"))
+hedge_budget = HedgeBudget(fraction=float(os.getenv("HEDGE_BUDGET", "0.1")))
+
+async def hedged_call(primary: str, prompt: str, endpoint_class: str, tried: set, config=None):
+    """try_model on `primary`, plus one backup model if it runs past its usual latency"""
+    hedge_budget.record_primary()
+    tasks = [asyncio.ensure_future(try_model(primary, prompt, endpoint_class, config))]
+    delay = model_router.latency_percentile(primary, endpoint_class, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    try:
+        if delay is None:
+            return await tasks[0]  # No latency history yet
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return tasks[0].result()
+
+        # Budget first: a hedge the budget denies must not take RPM/TPM quota
+        backups = next_candidates(endpoint_class, tried)
+        if not backups or not hedge_budget.try_spend():
+            return await tasks[0]
+        tokens, priority = quota_request(prompt, endpoint_class)
+        backup = quota_scheduler.try_acquire(backups, tokens, priority)
+        if backup is None:
+            hedge_budget.refund()
+            return await tasks[0]
+        tried.add(backup)
+        logger.info(f"🪁 {primary} slower than p{HEDGE_PERCENTILE:.0f} ({delay:.2f}s), hedging with {backup}")
+        tasks.append(asyncio.ensure_future(try_model(backup, prompt, endpoint_class, config)))
+
+        # First non-empty answer wins; if both fail, the primary's error is raised
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result():
+                    if task is tasks[1]:
+                        hedge_budget.record_win()
+                    return task.result()
+        return tasks[0].result()
+    finally:
+        for task in tasks:
+            task.cancel()  # The loser, or both if our caller went away
+            if task.done() and not task.cancelled():
+                task.exception()  # Mark a losing failure as handled
+
+async def generate_with_fallback(prompt: str, endpoint_class: str = GENERATION, config=None):
+    """Try healthy models, fastest first, until one works (each has separate rate limits)"""
+    hedge = endpoint_var.get() in HEDGE_ENDPOINTS
+    await ensure_client()
+    with stage("llm"):
+        last_error = None
+        tried = set()
+        while True:
+            candidates = next_candidates(endpoint_class, tried)
+            if not candidates:
+                break
+            model = await acquire_model(candidates, prompt, endpoint_class)
+            tried.add(model)
+            try:
+                if hedge:
+                    return await hedged_call(model, prompt, endpoint_class, tried, config)
+                return await try_model(model, prompt, endpoint_class, config)
+            except TimeoutError as e:
+                last_error = e
+                continue  # Try next model
+            except Exception as e:
+                last_error = e
+                if is_quota_error(e):
+                    continue  # Try next model
+                raise  # Re-raise non-quota errors
+    
+        # All models exhausted
+        raise last_error or AllModelsCoolingDown(max(model_router.retry_after(), 1.0))
+
+# --- STRUCTURED OUTPUT ---
+# JSON endpoints ask Gemini for schema-constrained JSON, validate it against the
+# models in schemas.py and repair small defects locally. Only an answer beyond
+# repair is generated again (at most STRUCTURED_RETRIES times).
+STRUCTURED_RETRIES = max(int(os.getenv("STRUCTURED_RETRIES", "1")), 0)
+# Set GEMINI_RESPONSE_SCHEMA=0 to send only the JSON mime type (no schema)
+SEND_RESPONSE_SCHEMA = os.getenv("GEMINI_RESPONSE_SCHEMA", "1") == "1"
+
+async def generate_structured(prompt: str, schema, endpoint_class: str = GENERATION) -> dict:
+    """generate_with_fallback for JSON answers, returns the validated dict"""
+    config = {"response_mime_type": "application/json"}
+    if SEND_RESPONSE_SCHEMA:
+        config["response_schema"] = schema
+    last_error = None
+    for attempt in range(STRUCTURED_RETRIES + 1):
+        response_text = await generate_with_fallback(prompt, endpoint_class, config)
+        try:
+            with stage("json_parse"):
+                result, repaired = parse_structured(response_text or "", schema)
+        except StructuredOutputError as e:
+            STRUCTURED_OUTPUTS.inc(schema=schema.__name__, outcome="invalid")
+            logger.warning(f"🧩 {e} (attempt {attempt + 1}/{STRUCTURED_RETRIES + 1})")
+            last_error = e
+            continue
+        STRUCTURED_OUTPUTS.inc(schema=schema.__name__, outcome="repaired" if repaired else "valid")
+        if repaired:
+            logger.info(f"🩹 Repaired {schema.__name__} JSON locally")
+        return result
+    raise last_error or StructuredOutputError(f"No valid {schema.__name__} answer (STRUCTURED_RETRIES={STRUCTURED_RETRIES})")
+
+async def stream_with_fallback(prompt: str, endpoint_class: str = CHAT, config=None):
     """
-    Analyze PYQ papers and generate practice questions based on the patterns
+    Streaming variant of generate_with_fallback, yields (model, text_chunk).
+    Models are only switched before the first chunk arrives; once a model has
+    started answering, its errors are raised to the caller.
     """
-    logger.info(f"📚 PYQ Quiz Request: {subject} - {file.filename}")
-    content = await file.read()
-    text = extract_text_from_pdf(content)
+    await ensure_client()
+    last_error = None
+    tried = set()
+    while True:
+        candidates = next_candidates(endpoint_class, tried)
+        if not candidates:
+            break
+        model = await acquire_model(candidates, prompt, endpoint_class)
+        tried.add(model)
+        async with llm_slots:
+            started = time.perf_counter()
+            try:
+                logger.info(f"🔄 Streaming from model: {model}")
+                stream = client.aio.models.generate_content_stream(model=model, contents=prompt, config=config)
+                if inspect.isawaitable(stream):  # newer SDKs return the iterator from a coroutine
+                    stream = await asyncio.wait_for(stream, timeout=LLM_CALL_TIMEOUT)
+                chunks = stream.__aiter__()
+                first_chunk = await asyncio.wait_for(chunks.__anext__(), timeout=LLM_CALL_TIMEOUT)
+            except StopAsyncIteration:
+                first_chunk = None  # Model answered with an empty stream
+            except asyncio.TimeoutError:
+                record_model_call(model, "timeout", time.perf_counter() - started, len(prompt))
+                model_router.record_failure(model)
+                logger.warning(f"⏱️ {model} sent nothing for {LLM_CALL_TIMEOUT}s")
+                last_error = TimeoutError(f"{model} timed out after {LLM_CALL_TIMEOUT}s")
+                continue  # Try next model
+            except Exception as e:
+                error_msg = str(e)
+                logger.warning(f"⚠️ {model} failed: {error_msg[:100]}")
+                last_error = e
+                outcome = "quota" if is_quota_error(e) else "error"
+                record_model_call(model, outcome, time.perf_counter() - started, len(prompt))
+                if outcome == "quota":
+                    cooldown = model_router.record_quota_error(model, e)
+                    logger.info(f"🧊 {model} cooling down for {cooldown:.0f}s")
+                    continue  # Try next model
+                model_router.record_failure(model)
+                raise
+
+            streamed_chars = 0
+            chunk = first_chunk
+            try:
+                while chunk is not None:
+                    if chunk.text:
+                        streamed_chars += len(chunk.text)
+                        yield model, chunk.text
+                    try:
+                        # Per chunk: a stream stalling mid-answer must not keep its llm_slots slot
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=LLM_CALL_TIMEOUT)
+                    except StopAsyncIteration:
+                        chunk = None
+            except asyncio.TimeoutError:
+                record_model_call(model, "timeout", time.perf_counter() - started, len(prompt), streamed_chars)
+                model_router.record_failure(model)
+                logger.warning(f"⏱️ {model} stalled mid-stream for {LLM_CALL_TIMEOUT}s")
+                raise TimeoutError(f"{model} stalled after {streamed_chars} characters")
+            except Exception as e:
+                logger.warning(f"⚠️ {model} failed mid-stream: {str(e)[:100]}")
+                outcome = "quota" if is_quota_error(e) else "error"
+                record_model_call(model, outcome, time.perf_counter() - started, len(prompt), streamed_chars)
+                if outcome == "quota":
+                    model_router.record_quota_error(model, e)
+                else:
+                    model_router.record_failure(model)
+                raise
+            record_model_call(model, "ok", time.perf_counter() - started, len(prompt), streamed_chars)
+            model_router.record_success(model, time.perf_counter() - started, endpoint_class)
+            logger.info(f"✅ Streamed with model: {model}")
+            return
+
+    raise last_error or AllModelsCoolingDown(max(model_router.retry_after(), 1.0))
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def cancel_on_disconnect(http_request: Request, coro):
+    """Run a generation, cancelling it if the client goes away before it finishes"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info("🔌 Client disconnected, cancelling generation")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+# --- CHAT SESSIONS ---
+# With a session_id the server keeps the conversation: recent turns verbatim,
+# older ones folded into a rolling summary in the background, so the prompt
+# per turn stays around CHAT_HISTORY_CHARS however long the session runs.
+CHAT_HISTORY_CHARS = int(os.getenv("CHAT_HISTORY_CHARS", "3000"))
+CHAT_SUMMARY_CHARS = int(os.getenv("CHAT_SUMMARY_CHARS", "1200"))
+chat_session_limits = dict(
+    max_sessions=int(os.getenv("CHAT_SESSIONS_MAX", "1000")),
+    ttl_seconds=float(os.getenv("CHAT_SESSION_TTL_SECONDS", str(6 * 3600))),
+    recent_turns=int(os.getenv("CHAT_RECENT_TURNS", "6")),
+)
+chat_sessions = SharedChatSessionStore(
+    os.getenv("CHAT_SESSION_DB_PATH", os.path.join(DATA_DIR, "chat_sessions.sqlite3")), **chat_session_limits
+) if SHARED_STATE else ChatSessionStore(**chat_session_limits)
+background_tasks = set()
+
+def chat_session_for(request: ChatRequest):
+    """The request's session (created on first use), or None for stateless chat"""
+    if not request.session_id:
+        return None
+    if not is_valid_session_id(request.session_id):
+        raise HTTPException(status_code=400, detail="Invalid session_id.")
+    return chat_sessions.get(request.session_id)
+
+async def summarize_turns(session, offset, turns):
+    """Fold `turns` (claimed at `offset`) into the session's rolling summary (LLM, or local trim if that fails)"""
+    endpoint_var.set("chat-summary")  # This task's own context: no hedging, separate stage labels
+    transcript = "\n".join(f"{role.title()}: {text}" for role, text in turns)
+    prompt = f"""
+    Update the running summary of a tutoring conversation.
+    Current summary: {session.summary or 'None'}
+    New turns:
+    {transcript[:6000]}
+    Write one compact paragraph (under {CHAT_SUMMARY_CHARS // 6} words) keeping the topics covered,
+    what the student struggled with, and any facts or numbers they gave. Plain text only.
+    """
+    try:
+        summary = (await generate_with_fallback(prompt)).strip()
+    except Exception as e:
+        logger.warning(f"⚠️ Chat summary failed, trimming locally: {e}")
+        summary = f"{session.summary} " + " ".join(f"{role}: {text[:200]}" for role, text in turns)
+    chat_sessions.apply_summary(session, summary[-CHAT_SUMMARY_CHARS:].strip(), offset, len(turns))
+
+def remember_exchange(session, question: str, answer: str):
+    """Record a finished turn and start compacting old turns if the window is full"""
+    chat_sessions.add_exchange(session, question, answer)
+    claim = chat_sessions.start_compaction(session)
+    if claim:
+        task = asyncio.ensure_future(summarize_turns(session, *claim))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+# --- QUESTION BANK ---
+# Every validated quiz is kept in a SQLite question bank (near-duplicates skipped).
+# from_bank=true on the quiz endpoints serves questions this client has not seen
+# yet from the bank and only asks Gemini for the questions still missing.
+question_bank = QuestionBank(
+    os.getenv("QUESTION_BANK_PATH", os.path.join(DATA_DIR, "question_bank.sqlite3")),
+    duplicate_threshold=float(os.getenv("QUESTION_BANK_DUPLICATE_THRESHOLD", "0.7")),
+)
+PYQ_QUERY_TERMS = 12  # Most frequent terms of a paper used to find similar bank questions
+
+def bank_questions(questions, subject, chapter="", kind="quiz", topics=(), summary=None):
+    """Add generated questions to the bank; returns their bank ids ([] if the bank failed)"""
+    try:
+        with stage("question_bank"):
+            if summary:
+                question_bank.set_summary(subject, chapter, summary)
+            return question_bank.add(questions, subject, chapter=chapter, kind=kind, topics=topics)
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ Question bank write failed: {e}")
+        return []
+
+def bank_status(from_bank, total):
+    """X-Cache value for a quiz assembled (partly) from the bank"""
+    return "BANK" if from_bank == total else ("PARTIAL" if from_bank else "MISS")
+
+# --- LOCAL QUIZ FALLBACK ---
+# With no model quota left (or the request shed by the scheduler, or no API key), an
+# offline pack is built on the CPU from the PDF text instead of failing, and marked as such.
+LOCAL_QUIZ_FALLBACK = os.getenv("LOCAL_QUIZ_FALLBACK", "1") == "1"
+LOCAL_QUIZ_SOURCE_CHARS = int(os.getenv("LOCAL_QUIZ_SOURCE_CHARS", "120000"))
+LOCAL_QUIZ_NOTICE = "The AI is out of quota right now, so these questions were made directly from your notes."
+
+async def local_offline_pack(error, source, doc_hash, subject, chapter, pages=None, num_questions=5):
+    """Offline pack generated locally after `error` left us without quota; re-raises it otherwise"""
+    if not LOCAL_QUIZ_FALLBACK or (rate_limit_error(error) is None and not isinstance(error, GeminiUnavailable)):
+        raise error
+    from local_quiz import local_quiz  # NumPy: loaded by the warm-up, or here on first use
+    start_page, end_page = (0, None) if pages is None else (pages[0] - 1, pages[1])
+    text = await relevant_text_from_pdf(source, doc_hash, f"{subject} {chapter}", LOCAL_QUIZ_SOURCE_CHARS,
+                                        start_page=start_page, end_page=end_page)
+    with stage("local_quiz"):
+        result = await asyncio.to_thread(local_quiz, text, num_questions, f"{subject} {chapter}")
+    if not result["quiz"]:
+        raise error
+    logger.warning(f"🧩 No quota: served a local quiz for {subject} - {chapter}")
+    return {**result, "generated_by": "local", "notice": LOCAL_QUIZ_NOTICE}
+
+# --- OFFLINE PACKS ---
+# Chapters prepared concurrently by one /generate-offline-packs request
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+async def offline_pack_generation(source, doc_hash, subject, chapter, pages=None, num_questions=5, avoid=(),
+                                  llm_gate=None):
+    """One offline pack generation, added to the question bank. Returns (result, bank ids)."""
+    start_page, end_page = (0, None) if pages is None else (pages[0] - 1, pages[1])
+    text = await relevant_text_from_pdf(source, doc_hash, f"{subject} {chapter}", 6000,
+                                        start_page=start_page, end_page=end_page)
 
     if not text:
         raise HTTPException(status_code=400, detail="Could not read PDF text.")
 
+    prompt = f"""
+        Act as an expert tutor for {subject}. 
+        Material for {chapter}: {text}
+        Generate a {num_questions}-question PREREQUISITE quiz testing ONLY foundational knowledge.
+        Return ONLY a JSON object: {{"summary": ["Key Concept 1"], "quiz": [{{"q": "Quest?", "options": ["A","B","C","D"], "a": "A"}}]}}
+        """
+    if avoid:
+        prompt += "Do not repeat these questions: " + " | ".join(avoid) + "\n"
+
+    # Use fallback system to try multiple models
+    async with (llm_gate or contextlib.nullcontext()):
+        result = await generate_structured(prompt, OfflinePack)
+    bank_ids = bank_questions(result["quiz"], subject, chapter, kind="prerequisite", summary=result["summary"])
+    return result, bank_ids
+
+async def offline_pack_for(source, doc_hash, subject, chapter, pages=None, no_cache=False, llm_gate=None):
+    """
+    Cached, coalesced offline pack for one chapter of a PDF (bytes or stored
+    path). `pages` is an optional inclusive 1-based (first, last) range.
+    Returns (result, cache_status).
+    """
+    params = {"subject": subject, "chapter": chapter}
+    if pages is not None:
+        params["pages"] = list(pages)
+    cache_key = make_cache_key("offline-pack", doc_hash, PROMPT_VERSION, **params)
+    if not no_cache:
+        with stage("cache_lookup"):
+            cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"⚡ Cache hit: {subject} - {chapter}")
+            return cached, "HIT"
+
+    async def produce():
+        result, _ = await offline_pack_generation(source, doc_hash, subject, chapter, pages=pages, llm_gate=llm_gate)
+        result_cache.set(cache_key, result)
+        return result
+
+    # Students uploading the same notes at the same time share one generation
     try:
-        prompt = f"""
+        result = await in_flight.run(cache_key, produce)
+    except Exception as e:
+        return await local_offline_pack(e, source, doc_hash, subject, chapter, pages), "LOCAL"
+    return result, "BYPASS" if no_cache else "MISS"
+
+async def fill_from_model(quiz, rows, num_questions, client, generate):
+    """
+    Top up a quiz drawn from the bank with generated questions. `generate(missing,
+    avoid)` returns (questions, bank ids); generated near-duplicates of the drawn
+    questions are dropped. If the model fails, the bank questions are served alone.
+    """
+    drawn = {row["id"] for row in rows}
+    try:
+        questions, bank_ids = await generate(num_questions - len(quiz), [q["q"] for q in quiz])
+    except Exception as e:
+        if not quiz:
+            raise
+        logger.warning(f"⚠️ Serving {len(quiz)} bank questions only, generation failed: {e}")
+        return
+    question_bank.mark_served(client, bank_ids)
+    for question, bank_id in zip(questions, bank_ids or [None] * len(questions)):
+        if len(quiz) >= num_questions:
+            break
+        if bank_id not in drawn:
+            quiz.append(question)
+
+async def offline_pack_from_bank(source, doc_hash, subject, chapter, num_questions=5):
+    """
+    Offline pack from bank questions for the chapter that this client has not
+    seen; Gemini only writes the rest. Returns (result, cache_status).
+    """
+    client = client_id_var.get()
+    with stage("question_bank"):
+        rows = question_bank.draw(subject, num_questions, client, kind="prerequisite",
+                                  chapter=chapter, terms=tokenize(chapter))
+        summary = question_bank.summary_for(subject, chapter)
+    result = {"summary": summary or [], "quiz": [row["question"] for row in rows]}
+    if len(rows) < num_questions:
+        async def generate(missing, avoid):
+            generated, bank_ids = await offline_pack_generation(source, doc_hash, subject, chapter,
+                                                                num_questions=missing, avoid=avoid)
+            result["summary"] = result["summary"] or generated["summary"]
+            return generated["quiz"], bank_ids
+        try:
+            await fill_from_model(result["quiz"], rows, num_questions, client, generate)
+        except Exception as e:
+            return await local_offline_pack(e, source, doc_hash, subject, chapter, num_questions=num_questions), "LOCAL"
+    logger.info(f"🏦 Bank: {len(rows)}/{num_questions} questions for {subject} - {chapter}")
+    return result, bank_status(len(rows), num_questions)
+
+def offline_pack_error(e) -> HTTPException:
+    """Map a generation failure to the HTTP error the quiz pages expect"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, Overloaded):
+        return rate_limit_error(e)
+    error_msg = str(e)
+    # Handle rate limiting specifically
+    if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg or "quota" in error_msg.lower():
+        retry_after = math.ceil(max(model_router.retry_after(), 1.0))
+        return HTTPException(
+            status_code=429, 
+            detail="API rate limit reached. Free tier allows 20 requests/day. Please wait a minute and try again.",
+            headers={"Retry-After": str(retry_after)},
+        )
+    return HTTPException(status_code=500, detail=f"Generation Failed: {error_msg}")
+
+async def pyq_quiz_generation(source, doc_hash, subject, num_questions, avoid=(), text=None):
+    """One PYQ practice quiz generation, added to the question bank. Returns (result, bank ids)."""
+    if text is None:
+        text = await relevant_text_from_pdf(source, doc_hash, subject, 8000)
+
+    if not text:
+        raise HTTPException(status_code=400, detail="Could not read PDF text.")
+
+    prompt = f"""
         You are analyzing a Previous Year Question paper for {subject}.
-        
-        PYQ Content: {text[:8000]}
-        
+    
+        PYQ Content: {text}
+    
         Based on the patterns, topics, and difficulty level in this PYQ paper:
         1. Identify the key topics that appear frequently
         2. Generate {num_questions} NEW practice questions similar to the PYQ style
         3. Include a mix of conceptual and numerical questions if applicable
         4. Make questions exam-ready with proper difficulty
-        
+    
         Return ONLY a valid JSON object in this exact format:
         {{
             "topics_found": ["Topic 1", "Topic 2", "Topic 3"],
@@ -293,17 +931,938 @@ async def generate_pyq_quiz(
             ]
         }}
         """
+    if avoid:
+        prompt += "Do not repeat these questions: " + " | ".join(avoid) + "\n"
+
+    result = await generate_structured(prompt, PyqQuiz)
+    bank_ids = bank_questions(result["quiz"], subject, kind="pyq", topics=result["topics_found"])
+    return result, bank_ids
+
+async def pyq_quiz_for(source, doc_hash, subject, num_questions, no_cache=False):
+    """Cached, coalesced PYQ practice quiz for a PDF. Returns (result, cache_status)."""
+    cache_key = make_cache_key("pyq-quiz", doc_hash, PROMPT_VERSION,
+                               subject=subject, num_questions=num_questions)
+    if not no_cache:
+        with stage("cache_lookup"):
+            cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"⚡ Cache hit: PYQ {subject}")
+            return cached, "HIT"
+
+    async def produce():
+        result, _ = await pyq_quiz_generation(source, doc_hash, subject, num_questions)
+        result_cache.set(cache_key, result)
+        return result
+
+    result = await in_flight.run(cache_key, produce)
+    return result, "BYPASS" if no_cache else "MISS"
+
+async def pyq_quiz_from_bank(source, doc_hash, subject, num_questions):
+    """
+    PYQ practice quiz from bank questions matching the paper's most frequent
+    terms that this client has not seen; Gemini only writes the rest.
+    Returns (result, cache_status).
+    """
+    text = await relevant_text_from_pdf(source, doc_hash, subject, 8000)
+    if not text:
+        raise HTTPException(status_code=400, detail="Could not read PDF text.")
+    client = client_id_var.get()
+    terms = [term for term, _ in Counter(tokenize(text)).most_common(PYQ_QUERY_TERMS)]
+    with stage("question_bank"):
+        rows = question_bank.draw(subject, num_questions, client, kind="pyq", terms=terms)
+    result = {
+        "topics_found": list(dict.fromkeys(topic for row in rows for topic in row["topics"])),
+        "difficulty": "Medium",
+        "quiz": [row["question"] for row in rows],
+    }
+    if len(rows) < num_questions:
+        async def generate(missing, avoid):
+            generated, bank_ids = await pyq_quiz_generation(source, doc_hash, subject, missing, avoid=avoid, text=text)
+            result["difficulty"] = generated["difficulty"]
+            result["topics_found"] = list(dict.fromkeys(result["topics_found"] + generated["topics_found"]))
+            return generated["quiz"], bank_ids
+        await fill_from_model(result["quiz"], rows, num_questions, client, generate)
+    logger.info(f"🏦 Bank: {len(rows)}/{num_questions} PYQ questions for {subject}")
+    return result, bank_status(len(rows), num_questions)
+
+async def syllabus_topics(subject, syllabus_text):
+    """
+    Weighted topic list for a syllabus: cached per syllabus, extracted by one
+    small model call, or parsed locally if the model is unavailable.
+    Returns (topics, source) with source "cache", "ai" or "local".
+    """
+    cache_key = make_cache_key("syllabus-topics", content_hash(syllabus_text.encode()), PROMPT_VERSION,
+                               subject=subject)
+    with stage("cache_lookup"):
+        cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached["topics"], "cache"
+
+    prompt = f"""
+    Subject: {subject}
+    Syllabus: {syllabus_text[:4000]}
+
+    List the study topics in this syllabus in order. Give each a weight from 1 to 5
+    for how much study time it needs relative to the others.
+    Return ONLY a JSON object:
+    {{"topics": [{{"name": "Topic Name", "weight": 2, "subtopics": ["Part 1", "Part 2"]}}]}}
+    """
+    async def produce():
+        result = await generate_structured(prompt, SyllabusTopics)
+        result_cache.set(cache_key, result)
+        return result
+
+    try:
+        result = await in_flight.run(cache_key, produce)
+        return result["topics"], "ai"
+    except Exception as e:
+        topics = planner.topics_from_syllabus(syllabus_text)
+        if not topics:
+            raise
+        logger.warning(f"⚠️ Topic extraction failed, using local syllabus parse: {e}")
+        return topics, "local"
+
+def parse_start_date(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date must be an ISO date (YYYY-MM-DD).")
+
+async def study_plan_for(subject, syllabus_text, timetable_text, days=14, start_date=None):
+    """
+    Study plan over `days` days. The model only extracts topics from the
+    syllabus; slots, durations and revision spacing are worked out locally.
+    """
+    topics, source = await syllabus_topics(subject, syllabus_text)
+    with stage("schedule"):
+        slots = planner.parse_timetable(timetable_text)
+        plan = planner.build_plan(subject, topics, slots, days, parse_start_date(start_date))
+    plan["topics_source"] = source
+    return plan
+
+# --- TOPIC QUIZZES ---
+# /generate-quiz needs no upload, so the same few exam topics are asked for over and
+# over: results are cached by normalised (topic, difficulty, size) and can be
+# generated ahead of time with prewarm.py.
+DIFFICULTIES = {"easy": "easy", "beginner": "easy", "medium": "medium", "intermediate": "medium",
+                "moderate": "medium", "hard": "hard", "advanced": "hard", "difficult": "hard"}
+
+def normalize_topic(topic: str) -> str:
+    """Cache identity of a topic: case, spacing and surrounding punctuation don't matter"""
+    return " ".join(topic.lower().split()).strip(" .,:;!?-\"'")
+
+def normalize_difficulty(difficulty: str) -> str:
+    level = DIFFICULTIES.get(normalize_topic(difficulty or "medium"))
+    if level is None:
+        raise HTTPException(status_code=400, detail="difficulty must be easy, medium or hard.")
+    return level
+
+def topic_quiz_key(topic: str, difficulty: str, num_questions: int = 5) -> str:
+    return make_cache_key("topic-quiz", "", PROMPT_VERSION, topic=normalize_topic(topic),
+                          difficulty=normalize_difficulty(difficulty), num_questions=num_questions)
+
+async def topic_quiz_for(topic, difficulty="medium", num_questions=5, no_cache=False):
+    """Cached, coalesced quiz on a topic (no source document). Returns (result, cache_status)."""
+    level = normalize_difficulty(difficulty)
+    cache_key = topic_quiz_key(topic, level, num_questions)
+    if not no_cache:
+        with stage("cache_lookup"):
+            cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"⚡ Cache hit: topic quiz {topic} ({level})")
+            return cached, "HIT"
+
+    prompt = f"""
+        Act as an expert tutor. Write {num_questions} {level} multiple choice questions about: {topic.strip()}
+        Each question has four options, exactly one correct.
+        Return ONLY a JSON object:
+        {{"quiz": [{{"q": "Question?", "options": ["A", "B", "C", "D"], "a": "A", "explanation": "Why A is correct"}}]}}
+        """
+
+    async def produce():
+        generated = await generate_structured(prompt, TopicQuiz)
+        result = {"topic": topic.strip(), "difficulty": level, "questions": generated["quiz"]}
+        result_cache.set(cache_key, result)
+        return result
+
+    result = await in_flight.run(cache_key, produce)
+    return result, "BYPASS" if no_cache else "MISS"
+
+# --- PACK DELIVERY ---
+# Every offline pack served is also stored under a stable pack_id with a content
+# version (its ETag), serialised and compressed once. GET /offline-packs/{pack_id}
+# answers If-None-Match with 304 and /offline-packs/sync returns only the packs
+# whose version differs from the client's copy: re-syncing costs no generation.
+pack_store = PackStore(
+    os.getenv("PACK_STORE_PATH", os.path.join(DATA_DIR, "offline_packs.sqlite3")), PROMPT_VERSION,
+    max_packs=int(os.getenv("PACK_STORE_MAX_PACKS", "5000")),
+    ttl_seconds=float(os.getenv("PACK_STORE_TTL_SECONDS", str(30 * 24 * 3600))),
+)
+PACK_SYNC_MAX_PACKS = 1000
+COMPRESS_MIN_BYTES = 512  # Smaller sync answers are sent as they are
+pack_delivery = Counter()
+
+def publish_pack(result, doc_hash, subject, chapter, pages=None, from_bank=False):
+    """Store a served pack in the pack store; returns its entry (None if the store failed)"""
+    # Bank packs differ per client, so each client gets its own pack for the chapter
+    variant = client_id_var.get() if from_bank else ""
+    try:
+        with stage("pack_store"):
+            return pack_store.put(make_pack_id(doc_hash, subject, chapter, pages, variant), subject, chapter, result)
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ Pack store write failed: {e}")
+        return None
+
+def pack_fields(entry) -> dict:
+    return {"pack_id": entry["pack_id"], "version": entry["version"]} if entry else {}
+
+def preferred_encoding(request: Request, brotli_available: bool):
+    """"br", "gzip" or None, from the request's Accept-Encoding"""
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    if brotli_available and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+def not_modified(request: Request, etag: str) -> bool:
+    """If-None-Match matches the current ETag (weak comparison, as the header requires)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
+
+def pack_response(request: Request, entry, headers=None, conditional=False) -> Response:
+    """The stored pack body, pre-compressed if the client accepts it; 304 if the client has it"""
+    headers = {"ETag": entry["etag"], "X-Pack-ID": entry["pack_id"], "Cache-Control": "private, no-cache",
+               "Vary": "Accept-Encoding", **(headers or {})}
+    if conditional and not_modified(request, entry["etag"]):
+        pack_delivery["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    encoding = preferred_encoding(request, entry["br"] is not None)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    pack_delivery["full"] += 1
+    return Response(entry[encoding] if encoding else entry["body"], media_type="application/json", headers=headers)
+
+def compressed_json_response(request: Request, body: bytes) -> Response:
+    encoding = preferred_encoding(request, brotli is not None) if len(body) >= COMPRESS_MIN_BYTES else None
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-store"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        body = brotli.compress(body) if encoding == "br" else gzip.compress(body, 6)
+    return Response(body, media_type="application/json", headers=headers)
+
+# --- JOBS ---
+# ?job=true on the generation endpoints returns a job_id at once (202). Jobs run
+# on JOB_WORKERS background workers, results are kept in SQLite, progress is
+# available from /jobs/{job_id} and /jobs/{job_id}/events, and jobs that were
+# queued or running when the server stopped are picked up again on start.
+# Uploaded PDFs are saved to the document store so a resumed job can find them.
+job_store = JobStore(os.getenv("JOB_DB_PATH", os.path.join(DATA_DIR, "jobs.sqlite3")))
+
+async def offline_pack_job(doc_id, subject, chapter, no_cache=False, from_bank=False):
+    source = await open_stored_document(doc_id)
+    if from_bank:
+        result, _ = await offline_pack_from_bank(source, doc_id, subject, chapter)
+    else:
+        result, _ = await offline_pack_for(source, doc_id, subject, chapter, no_cache=no_cache)
+    return {**result, **pack_fields(publish_pack(result, doc_id, subject, chapter, from_bank=from_bank))}
+
+async def pyq_quiz_job(doc_id, subject, num_questions, no_cache=False, from_bank=False):
+    source = await open_stored_document(doc_id)
+    if from_bank:
+        result, _ = await pyq_quiz_from_bank(source, doc_id, subject, num_questions)
+    else:
+        result, _ = await pyq_quiz_for(source, doc_id, subject, num_questions, no_cache=no_cache)
+    return result
+
+def job_handler(kind, fn):
+    async def handler(params, progress):
+        # Worker task context: stage() reports progress, the submitter keeps fair share
+        stage_listener_var.set(progress)
+        endpoint_var.set(f"job:{kind}")
+        client_id_var.set(params.get("client") or "anonymous")
+        return await fn(**{k: v for k, v in params.items() if k != "client"})
+    return handler
+
+def job_error(e):
+    """(status_code, detail, retry_after) for a failed job"""
+    error = e if isinstance(e, HTTPException) else (rate_limit_error(e) or offline_pack_error(e))
+    headers = error.headers or {}
+    return error.status_code, error.detail, float(headers["Retry-After"]) if "Retry-After" in headers else None
+
+job_runner = JobRunner(
+    job_store,
+    {
+        "offline-pack": job_handler("offline-pack", offline_pack_job),
+        "pyq-quiz": job_handler("pyq-quiz", pyq_quiz_job),
+        "study-plan": job_handler("study-plan", study_plan_for),
+    },
+    job_error,
+    workers=int(os.getenv("JOB_WORKERS", "2")),
+    max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+    retention_seconds=float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600))),
+    lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+)
+# A job may run in another worker process: its event stream then polls the store
+JOB_EVENTS_POLL_SECONDS = 1.0 if SHARED_STATE else 15.0
+JOB_EVENTS_KEEPALIVE_SECONDS = 15.0
+
+def stored_job_event(job_id, last_stage):
+    """(event, data) for progress recorded in the store since last_stage, or None"""
+    job = job_store.get(job_id)
+    if job is None:
+        return "error", {"status_code": 404, "detail": "Job was purged."}
+    if job["status"] == DONE:
+        return "done", {"result": job["result"]}
+    if job["status"] == FAILED:
+        return "error", job["error"]
+    if job["stage"] and job["stage"] != last_stage:
+        return "stage", {"stage": job["stage"]}
+    return None
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_runner.ensure_started()
+
+# --- STARTUP ---
+# The app serves as soon as it is imported; heavy imports (google.genai, NumPy,
+# PyMuPDF in the extraction processes) are warmed up in the background. /health is
+# liveness, /ready answers 503 until the warm-up is done (STARTUP_WARM_UP=0 skips
+# it: everything then loads on first use and /ready is immediately 200).
+STARTUP_WARM_UP = os.getenv("STARTUP_WARM_UP", "1") == "1"
+startup_state = {"ready": False, "serving_after": None, "ready_after": None, "warm_up_error": None}
+
+def warm_up():
+    """Runs in a thread: load what the first requests would otherwise wait for"""
+    if API_KEY:
+        try:
+            get_client()
+        except GeminiUnavailable:
+            pass  # Reported by /ready as the AI status
+    import local_quiz  # noqa: F401 (NumPy)
+    pdf_index.warm_up()
+
+@app.on_event("startup")
+async def start_warm_up():
+    startup_state["serving_after"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+    logger.info(f"🚀 Serving after {startup_state['serving_after']}s")
+
+    def done(task):
+        startup_state["ready"] = True
+        startup_state["ready_after"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+        if not task.cancelled() and task.exception():
+            startup_state["warm_up_error"] = str(task.exception())
+            logger.error(f"❌ Warm-up failed: {task.exception()}")
+        logger.info(f"✅ Ready after {startup_state['ready_after']}s (AI: {ai_status()})")
+
+    if not STARTUP_WARM_UP:
+        startup_state["ready"] = True
+        return
+    task = asyncio.ensure_future(asyncio.to_thread(warm_up))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    task.add_done_callback(done)
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_runner.shutdown()
+
+async def persist_for_job(file: Optional[UploadFile], doc_id: Optional[str]) -> str:
+    """doc_id of the job's PDF, storing an upload so the job survives a restart"""
+    if doc_id:
+        await open_stored_document(doc_id)
+        return doc_id
+    if file is None:
+        raise HTTPException(status_code=400, detail="Send a PDF file or a doc_id.")
+    path, doc_hash = await spool_upload(file)
+    try:
+        await asyncio.to_thread(document_store.put_file, doc_hash, path, file.filename)
+    finally:
+        upload_spool.release(doc_hash)
+    return doc_hash
+
+def public_job(job) -> dict:
+    return {
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "created": job["created"],
+        "updated": job["updated"],
+        "status_url": f"/jobs/{job['job_id']}",
+        "events_url": f"/jobs/{job['job_id']}/events",
+    }
+
+def submit_job(kind: str, response: Response, **params) -> dict:
+    job = job_runner.submit(kind, {**params, "client": client_id_var.get()})
+    logger.info(f"🗂️ Queued {kind} job {job['job_id'][:8]}")
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job['job_id']}"
+    return public_job(job)
+
+# --- ENDPOINTS ---
+
+@app.get("/ready")
+async def ready(response: Response):
+    """
+    Readiness, separate from /health (liveness): 503 while warming up. A server
+    without a usable Gemini client is ready in "degraded" mode (cached, bank and
+    local results only).
+    """
+    if not startup_state["ready"]:
+        response.status_code = 503
+    return {
+        "ready": startup_state["ready"],
+        "mode": "full" if ai_status() in ("ready", "not_loaded") else "degraded",
+        "ai": ai_status(),
+        **{k: v for k, v in startup_state.items() if k != "ready"},
+    }
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "healthy",
+        "ai": ai_status(),
+        "models": FALLBACK_MODELS,
+        "router": model_router.snapshot(),
+        "cache": result_cache.summary(),
+        "coalescing": in_flight.stats,
+        "scheduler": quota_scheduler.snapshot(),
+        "hedging": {"endpoints": sorted(HEDGE_ENDPOINTS), **hedge_budget.stats},
+        "chat_sessions": chat_sessions.summary(),
+        "jobs": {"queued": job_runner.queued, **job_runner.stats},
+        "question_bank": question_bank.summary(),
+        "pdf_text": pdf_index.summary(),
+        "packs": {**pack_store.summary(), **pack_delivery},
+        "worker": {"pid": os.getpid(), "workers": WORKERS, "shared_state": SHARED_STATE},
+    }
+
+def runtime_metrics():
+    """Gauges read from the cache, router and coalescing state at scrape time"""
+    router_state = model_router.snapshot()
+    return [
+        ("enwise_llm_calls_in_flight", "Gemini calls currently holding a concurrency slot", "gauge",
+         [({}, MAX_CONCURRENT_LLM_CALLS - llm_slots._value)]),
+        ("enwise_model_available", "1 if the model is not on quota cooldown", "gauge",
+         [({"model": m}, int(st["available"])) for m, st in router_state.items()]),
+        ("enwise_model_cooldown_seconds", "Remaining quota cooldown per model", "gauge",
+         [({"model": m}, st["cooldown_remaining"]) for m, st in router_state.items()]),
+        ("enwise_result_cache_events_total", "Result cache lookups and writes", "counter",
+         [({"event": k}, v) for k, v in result_cache.stats.items()]),
+        ("enwise_coalesced_requests_total", "Requests that started (leader) or joined (follower) a generation", "counter",
+         [({"role": "leader"}, in_flight.stats["leaders"]), ({"role": "follower"}, in_flight.stats["followers"])]),
+        ("enwise_scheduler_queued", "Requests waiting for Gemini quota", "gauge",
+         [({}, quota_scheduler.stats["queued_now"])]),
+        ("enwise_scheduler_requests_total", "Quota scheduler decisions (granted, shed, timed_out)", "counter",
+         [({"decision": k}, quota_scheduler.stats[k]) for k in ("granted", "shed", "timed_out")]),
+        ("enwise_jobs_queued", "Background jobs waiting for a worker", "gauge", [({}, job_runner.queued)]),
+        ("enwise_jobs_total", "Background job events", "counter",
+         [({"event": k}, v) for k, v in job_runner.stats.items()]),
+        ("enwise_chat_sessions", "Active server-side chat sessions", "gauge", [({}, len(chat_sessions))]),
+        ("enwise_question_bank_events_total", "Question bank events (added, duplicates, drawn)", "counter",
+         [({"event": k}, v) for k, v in question_bank.stats.items()]),
+        ("enwise_pdf_text_chars_total", "PDF text characters extracted (raw) and kept after compaction", "counter",
+         [({"stage": "raw"}, pdf_index.stats["chars_in"]), ({"stage": "kept"}, pdf_index.stats["chars_out"])]),
+        ("enwise_pdf_compaction_removed_total", "What PDF text compaction removed", "counter",
+         [({"kind": k}, pdf_index.stats[k]) for k in
+          ("header_footer_lines", "page_numbers", "hyphenations", "pages_dropped", "duplicate_paragraphs")]),
+        ("enwise_pack_responses_total", "Offline pack deliveries (full, not_modified, sync_changed, sync_unchanged)",
+         "counter", [({"result": k}, pack_delivery[k]) for k in ("full", "not_modified", "sync_changed", "sync_unchanged")]),
+        ("enwise_hedged_requests_total", "Hedging decisions (hedged, hedge_wins, denied by budget)", "counter",
+         [({"event": k}, hedge_budget.stats[k]) for k in ("hedged", "hedge_wins", "denied")]),
+    ]
+
+registry.add_collector(runtime_metrics)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, stage and per-model metrics"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+# Sampling profiler, switched on and off at runtime. Only exposed with ENABLE_PROFILER=1.
+profiler = SamplingProfiler()
+
+if os.getenv("ENABLE_PROFILER", "0") == "1":
+    @app.post("/debug/profiler/start")
+    async def start_profiler(interval: float = 0.01):
+        # Handlers run on the event loop thread, which is the one worth sampling
+        started = profiler.start(interval, target_thread_id=threading.get_ident())
+        return {"started": started, **profiler.report(top=0)}
+
+    @app.post("/debug/profiler/stop")
+    async def stop_profiler(top: int = 30):
+        profiler.stop()
+        return profiler.report(top)
+
+    @app.get("/debug/profiler")
+    async def profiler_report(top: int = 30, format: str = "json"):
+        if format == "collapsed":
+            return PlainTextResponse(profiler.collapsed())
+        return profiler.report(top)
+
+@app.post("/documents")
+async def upload_document(file: UploadFile = File(...)):
+    """
+    Upload a PDF once and get a stable doc_id (its content hash). The raw file and
+    its per-page text are kept on disk, so generation endpoints and /chat can take
+    the doc_id instead of the file.
+    """
+    path, doc_id = await spool_upload(file)
+    try:
+        meta = document_store.meta(doc_id)
+        if meta is None or meta.get("pages") is None:
+            try:
+                pages = await pdf_index.get_pages(path, doc_id)  # Whole document, once
+            except Exception as e:
+                logger.error(f"PDF Extraction Error: {e}")
+                pages = []
+            if not "".join(pages).strip():
+                raise HTTPException(status_code=400, detail="Could not read PDF text.")
+            await asyncio.to_thread(document_store.put_file, doc_id, path, file.filename)
+            await asyncio.to_thread(document_store.save_pages, doc_id, pages)
+            meta = document_store.meta(doc_id)
+    finally:
+        upload_spool.release(doc_id)
+    logger.info(f"📄 Document ready: {file.filename} -> {doc_id[:12]} ({meta['pages']} pages)")
+    return meta
+
+@app.get("/documents/{doc_id}")
+async def get_document(doc_id: str):
+    meta = document_store.meta(doc_id) if is_valid_doc_id(doc_id) else None
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Unknown doc_id.")
+    return meta
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job_id.")
+    return public_job(job)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-Sent Events for a job: a "status" event with the current state,
+    then "stage" events as it progresses and a final "done" or "error".
+    """
+    if job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job_id.")
+    job_runner.ensure_started()
+
+    async def events():
+        updates = job_runner.subscribe(job_id)
+        try:
+            job = job_store.get(job_id)  # Read after subscribing so no update is missed
+            yield sse_event("status", public_job(job))
+            if job["status"] in FINISHED:
+                return
+            last_stage, idle = job["stage"], 0.0
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(updates.get(), timeout=JOB_EVENTS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    update = stored_job_event(job_id, last_stage) if SHARED_STATE else None
+                    if update is None:
+                        idle += JOB_EVENTS_POLL_SECONDS
+                        if idle >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                            yield ": keep-alive\n\n"
+                            idle = 0.0
+                        continue
+                    event, data = update
+                idle = 0.0
+                if event == "stage":
+                    last_stage = data["stage"]
+                yield sse_event(event, data)
+                if event in ("done", "error"):
+                    return
+        finally:
+            job_runner.unsubscribe(job_id, updates)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/generate-offline-pack")
+async def generate_offline_pack(
+    http_request: Request,
+    response: Response,
+    file: Optional[UploadFile] = File(None), 
+    subject: str = Form(...), 
+    chapter: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
+    from_bank: bool = Form(False),
+    job: bool = False
+):
+    logger.info(f"📥 Quiz Request: {subject} - {chapter}")
+    if job:
+        doc_id = await persist_for_job(file, doc_id)
+        return submit_job("offline-pack", response, doc_id=doc_id, subject=subject,
+                          chapter=chapter, no_cache=no_cache, from_bank=from_bank)
+    async with pdf_source(file, doc_id) as (source, doc_hash):
+        try:
+            if from_bank:
+                work = offline_pack_from_bank(source, doc_hash, subject, chapter)
+            else:
+                work = offline_pack_for(source, doc_hash, subject, chapter, no_cache=no_cache)
+            result, cache_status = await cancel_on_disconnect(http_request, work)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"AI Quiz Error: {e}")
+            raise offline_pack_error(e)
+    entry = publish_pack(result, doc_hash, subject, chapter, from_bank=from_bank)
+    if entry is None:
+        response.headers["X-Cache"] = cache_status
+        return result
+    return pack_response(http_request, entry, {"X-Cache": cache_status})
+
+def batch_chapter_spec(spec, file_count: int):
+    """(file index, pages) of one /generate-offline-packs chapter; HTTPException 400 if malformed"""
+    if not isinstance(spec, dict):
+        raise HTTPException(status_code=400, detail="Each chapter must be a JSON object")
+    file_index = spec.get("file", 0)
+    if type(file_index) is not int or not 0 <= file_index < file_count:
+        raise HTTPException(status_code=400, detail=f"file must be an index below {file_count}, got {file_index!r}")
+    pages = spec.get("pages")
+    if pages is None:
+        return file_index, None
+    if (not isinstance(pages, list) or len(pages) != 2 or any(type(page) is not int for page in pages)
+            or pages[0] < 1 or pages[1] < pages[0]):
+        raise HTTPException(status_code=400, detail=f"pages must be [first, last], 1-based, got {pages!r}")
+    return file_index, (pages[0], pages[1])
+
+@app.post("/generate-offline-packs")
+async def generate_offline_packs(
+    files: Optional[List[UploadFile]] = File(None),
+    subject: str = Form(...),
+    chapters: Optional[str] = Form(None),
+    doc_ids: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
+):
+    """
+    Batch version of /generate-offline-pack.
+
+    `chapters` is an optional JSON list, one entry per pack:
+        [{"title": "Chapter 1", "file": 0, "pages": [1, 12]}, ...]
+    `file` indexes into the uploaded files followed by the stored documents
+    listed in `doc_ids` (a JSON list), default 0. `pages` is an inclusive
+    1-based page range (default: whole file). Without `chapters` every file
+    becomes one pack titled by its filename.
+
+    Responds with NDJSON: one line per chapter as soon as it finishes
+    ({"index", "chapter", "status": "ok", "result", "cache"} or
+    {"index", "chapter", "status": "error", "status_code", "detail"}),
+    then a final {"done": true, ...} summary line.
+    """
+    uploads = []
+    spooled = []  # Upload hashes to release once the response is finished
+    try:
+        for upload in files or []:
+            path, doc_hash = await spool_upload(upload)
+            spooled.append(doc_hash)
+            uploads.append((upload.filename, path, doc_hash))
+        try:
+            stored_ids = json.loads(doc_ids) if doc_ids else []
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid doc_ids: {e}")
+        for doc_id in stored_ids:
+            path = await open_stored_document(doc_id)
+            uploads.append(((document_store.meta(doc_id) or {}).get("filename"), path, doc_id))
+        if not uploads:
+            raise HTTPException(status_code=400, detail="Send PDF files or doc_ids.")
+
+        if chapters:
+            try:
+                specs = json.loads(chapters)
+                if not isinstance(specs, list):
+                    raise ValueError("chapters must be a JSON list")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid chapters: {e}")
+        else:
+            specs = [{"title": os.path.splitext(name or f"File {i + 1}")[0], "file": i}
+                     for i, (name, _, _) in enumerate(uploads)]
+    except BaseException:
+        for doc_hash in spooled:
+            upload_spool.release(doc_hash)
+        raise
+
+    logger.info(f"📦 Batch Quiz Request: {subject} - {len(specs)} chapters from {len(uploads)} files")
+    llm_gate = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+    async def build(index, spec):
+        title = str((spec.get("title") if isinstance(spec, dict) else None) or f"Chapter {index + 1}")
+        try:
+            file_index, pages = batch_chapter_spec(spec, len(uploads))  # A client error, not a failed generation
+            _, source, doc_hash = uploads[file_index]
+            result, cache_status = await offline_pack_for(source, doc_hash, subject, title, pages=pages,
+                                                          no_cache=no_cache, llm_gate=llm_gate)
+            entry = publish_pack(result, doc_hash, subject, title, pages=pages)
+            return {"index": index, "chapter": title, "status": "ok", "cache": cache_status,
+                    "result": {**result, **pack_fields(entry)}}
+        except Exception as e:
+            error = e if isinstance(e, HTTPException) else offline_pack_error(e)
+            logger.error(f"Batch chapter '{title}' failed: {e}")
+            item = {"index": index, "chapter": title, "status": "error",
+                    "status_code": error.status_code, "detail": error.detail}
+            if error.headers and "Retry-After" in error.headers:
+                item["retry_after"] = int(error.headers["Retry-After"])
+            return item
+
+    async def lines():
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(build(i, spec)) for i, spec in enumerate(specs)]
+        succeeded = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                item = await finished
+                succeeded += item["status"] == "ok"
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()  # Client went away: stop the remaining chapters
+            for doc_hash in spooled:
+                upload_spool.release(doc_hash)
+        yield json.dumps({
+            "done": True,
+            "total": len(specs),
+            "succeeded": succeeded,
+            "failed": len(specs) - succeeded,
+            "total_time": round(time.perf_counter() - started, 3),
+        }) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/offline-packs/{pack_id}")
+async def get_offline_pack(pack_id: str, request: Request):
+    """A pack served before, by the pack_id in its body; send If-None-Match: <ETag> to get 304 if unchanged"""
+    entry = pack_store.get(pack_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown pack_id.")
+    return pack_response(request, entry, conditional=True)
+
+@app.post("/offline-packs/sync")
+async def sync_offline_packs(request: PackSyncRequest, http_request: Request):
+    """
+    Delta sync of the packs a client keeps offline. Send {"packs": {pack_id:
+    version}} with the version from each stored pack; the answer holds only
+    the packs that changed since, in full:
+        {"changed": [pack, ...], "missing": [pack_id, ...], "unchanged": n}
+    `missing` packs are unknown here (e.g. expired) and must be generated again.
+    """
+    if len(request.packs) > PACK_SYNC_MAX_PACKS:
+        raise HTTPException(status_code=400, detail=f"At most {PACK_SYNC_MAX_PACKS} packs per sync.")
+    changed, missing, unchanged = pack_store.changed(request.packs)
+    pack_delivery["sync_changed"] += len(changed)
+    pack_delivery["sync_unchanged"] += unchanged
+    # Stored bodies are already JSON: splice them in rather than parse and re-serialise
+    body = b'{"changed":[' + b",".join(changed) + b'],"missing":' + json.dumps(missing).encode() \
+        + b',"unchanged":' + str(unchanged).encode() + b"}"
+    return compressed_json_response(http_request, body)
+
+@app.post("/generate-14-day-plan")
+async def generate_14_day_plan(request: MindMapRequest, http_request: Request, response: Response, job: bool = False):
+    logger.info(f"📥 Generating {request.days}-day plan for: {request.subject}")
+    if job:
+        return submit_job("study-plan", response, **request.model_dump())
+    try:
+        return await cancel_on_disconnect(http_request, study_plan_for(**request.model_dump()))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"AI Roadmap Error: {e}")
+        raise rate_limit_error(e) or HTTPException(status_code=500, detail=str(e))
+
+@app.post("/replan-study-plan")
+async def replan_study_plan(request: ReplanRequest):
+    """Re-schedule a plan after missed days. Runs locally, no model call."""
+    if not request.plan.get("days"):
+        raise HTTPException(status_code=400, detail="plan has no days.")
+    try:
+        return planner.replan(request.plan, request.from_day, request.missed_days,
+                              request.days, parse_start_date(request.start_date))
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid plan: {e}")
+
+@app.post("/chat")
+async def ai_tutor_chat(request: ChatRequest, http_request: Request):
+    """
+    Flexible AI Tutor that can:
+    - Explain any educational topic
+    - Respond in multiple languages
+    - Solve numerical problems step-by-step
+    - Provide real-life analogies
+    """
+    logger.info(f"💬 Chat Request: {request.message[:50]}...")
+    
+    try:
+        session = chat_session_for(request)
+        history = history_for_prompt(session, CHAT_HISTORY_CHARS) if session else ""
+        full_prompt = build_chat_prompt(request, await relevant_chat_context(request), history)
         
-        response_text = await generate_with_fallback(prompt)
+        key = request_key("chat", request.message, request.subject, request.context, history,
+                          language=request.language, doc_id=request.doc_id, session_id=request.session_id)
+        response_text = await cancel_on_disconnect(
+            http_request, in_flight.run(key, lambda: generate_with_fallback(full_prompt, CHAT, CHAT_CONFIG))
+        )
+        if session:
+            remember_exchange(session, request.message, response_text)
         
-        result = json.loads(clean_json_response(response_text))
+        result = {
+            "response": response_text,
+            "detected_language": "auto",
+            "subject": request.subject
+        }
+        if session:
+            result["session_id"] = session.session_id
         return result
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Chat Error: {e}")
+        raise rate_limit_error(e) or HTTPException(status_code=500, detail=f"AI Error: {str(e)}")
+
+@app.post("/chat/sessions")
+async def create_chat_session():
+    """Start a server-side conversation; pass the session_id to /chat or /chat/stream"""
+    session = chat_sessions.get(chat_sessions.new_id())
+    return {"session_id": session.session_id, "ttl_seconds": chat_sessions.ttl_seconds}
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    if not chat_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown session_id.")
+    return {"deleted": session_id}
+
+@app.post("/chat/stream")
+async def ai_tutor_chat_stream(request: ChatRequest):
+    """
+    Same tutor as /chat, streamed as Server-Sent Events:
+    - "token" events with {"text": ...} as the model produces them
+    - one final "done" event with the model used and timings
+    - or an "error" event if generation fails
+    """
+    logger.info(f"💬 Chat Stream Request: {request.message[:50]}...")
+    session = chat_session_for(request)
+    history = history_for_prompt(session, CHAT_HISTORY_CHARS) if session else ""
+    full_prompt = build_chat_prompt(request, await relevant_chat_context(request), history)
+
+    async def events():
+        started = time.perf_counter()
+        first_token_at = None
+        model_used = None
+        answer = []
+        try:
+            async for model, text in stream_with_fallback(full_prompt, CHAT, CHAT_CONFIG):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                model_used = model
+                answer.append(text)
+                yield sse_event("token", {"text": text})
+        except Exception as e:
+            logger.error(f"Chat Stream Error: {e}")
+            busy = rate_limit_error(e)
+            if busy is not None:
+                yield sse_event("error", {"detail": busy.detail, "model": model_used,
+                                          "retry_after": int(busy.headers["Retry-After"])})
+            else:
+                yield sse_event("error", {"detail": f"AI Error: {str(e)}", "model": model_used})
+            return
+
+        if session:
+            remember_exchange(session, request.message, "".join(answer))
+        yield sse_event("done", {
+            "model": model_used,
+            "subject": request.subject,
+            "detected_language": "auto",
+            "session_id": session.session_id if session else None,
+            "chars": sum(len(text) for text in answer),
+            "time_to_first_token": round(first_token_at - started, 3) if first_token_at else None,
+            "total_time": round(time.perf_counter() - started, 3),
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/generate-pyq-quiz")
+async def generate_pyq_quiz(
+    http_request: Request,
+    response: Response,
+    file: Optional[UploadFile] = File(None), 
+    subject: str = Form(...),
+    num_questions: int = Form(5),
+    doc_id: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
+    from_bank: bool = Form(False),
+    job: bool = False
+):
+    """
+    Analyze PYQ papers and generate practice questions based on the patterns
+    """
+    logger.info(f"📚 PYQ Quiz Request: {subject} - {file.filename if file else doc_id}")
+    if job:
+        doc_id = await persist_for_job(file, doc_id)
+        return submit_job("pyq-quiz", response, doc_id=doc_id, subject=subject,
+                          num_questions=num_questions, no_cache=no_cache, from_bank=from_bank)
+    async with pdf_source(file, doc_id) as (source, doc_hash):
+        try:
+            if from_bank:
+                work = pyq_quiz_from_bank(source, doc_hash, subject, num_questions)
+            else:
+                work = pyq_quiz_for(source, doc_hash, subject, num_questions, no_cache=no_cache)
+            result, cache_status = await cancel_on_disconnect(http_request, work)
+            response.headers["X-Cache"] = cache_status
+            return result
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"PYQ Quiz Error: {e}")
+            raise rate_limit_error(e) or HTTPException(status_code=500, detail=f"PYQ Generation Failed: {str(e)}")
+
+@app.post("/generate-quiz")
+async def generate_quiz(request: QuizRequest, http_request: Request, response: Response):
+    """Quiz on a topic, no upload needed: {"topic", "difficulty", "questions": [{"q", "options", "a", "explanation"}]}"""
+    logger.info(f"📝 Topic Quiz Request: {request.topic} ({request.difficulty})")
+    try:
+        result, cache_status = await cancel_on_disconnect(
+            http_request, topic_quiz_for(request.topic, request.difficulty, request.num_questions, request.no_cache))
+        response.headers["X-Cache"] = cache_status
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"PYQ Quiz Error: {e}")
-        raise HTTPException(status_code=500, detail=f"PYQ Generation Failed: {str(e)}")
+        logger.error(f"Topic Quiz Error: {e}")
+        raise rate_limit_error(e) or HTTPException(status_code=500, detail=f"Quiz Generation Failed: {str(e)}")
 
 if __name__ == "__main__":
-    import uvicorn
-    # Use 0.0.0.0 so teammate can connect over Wi-Fi
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if WORKERS > 1:
+        import serve
+        serve.main()
+    else:
+        import uvicorn
+        # Use 0.0.0.0 so teammate can connect over Wi-Fi
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
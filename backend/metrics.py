@@ -0,0 +1,230 @@
+"""
+Minimal in-process metrics with Prometheus text exposition (no extra dependency).
+
+    REQUEST_SECONDS.observe(0.42, endpoint="/chat", status="200")
+    with stage("pdf_extract"):
+        ...
+    registry.render()  # text for GET /metrics
+"""
+import time
+import uuid
+import logging
+import threading
+import contextlib
+import contextvars
+from bisect import bisect_left
+
+# Set per request by the HTTP middleware
+trace_id_var = contextvars.ContextVar("trace_id", default="-")
+endpoint_var = contextvars.ContextVar("endpoint", default="-")
+# Optional callback(stage_name), e.g. to report background job progress
+stage_listener_var = contextvars.ContextVar("stage_listener", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+SIZE_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = _format_labels(self.labelnames, key, f'le="{_format_number(float(bound))}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf} {series[-1]}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_number(float(series[-2]))}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """collector() -> list of (name, help, type, [(labels dict, value)]) read at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, help_text, kind, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    names = tuple(labels)
+                    values = tuple(labels[n] for n in names)
+                    lines.append(f"{name}{_format_labels(names, values)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "enwise_http_request_seconds", "HTTP request latency by endpoint and status", ("endpoint", "method", "status")))
+STAGE_SECONDS = registry.register(Histogram(
+    "enwise_stage_seconds", "Time spent per request stage", ("endpoint", "stage")))
+MODEL_CALLS = registry.register(Counter(
+    "enwise_model_calls_total", "Gemini calls by model and outcome (ok, quota, timeout, error)", ("model", "outcome")))
+MODEL_SECONDS = registry.register(Histogram(
+    "enwise_model_call_seconds", "Gemini call latency by model and outcome", ("model", "outcome")))
+PROMPT_CHARS = registry.register(Histogram(
+    "enwise_model_prompt_chars", "Prompt size sent to Gemini (characters)", ("model",), SIZE_BUCKETS))
+RESPONSE_CHARS = registry.register(Histogram(
+    "enwise_model_response_chars", "Response size returned by Gemini (characters)", ("model",), SIZE_BUCKETS))
+STRUCTURED_OUTPUTS = registry.register(Counter(
+    "enwise_structured_outputs_total", "JSON answers by schema and outcome (valid, repaired, invalid)",
+    ("schema", "outcome")))
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current request"""
+    listener = stage_listener_var.get()
+    if listener is not None:
+        listener(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint_var.get(), stage=name)
+
+
+def record_model_call(model, outcome, seconds, prompt_chars=None, response_chars=None):
+    MODEL_CALLS.inc(model=model, outcome=outcome)
+    MODEL_SECONDS.observe(seconds, model=model, outcome=outcome)
+    if prompt_chars is not None:
+        PROMPT_CHARS.observe(prompt_chars, model=model)
+    if response_chars is not None:
+        RESPONSE_CHARS.observe(response_chars, model=model)
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds %(trace_id)s to log records"""
+
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware: assigns a trace id (X-Request-ID, echoed back), records
+    the request latency histogram including streamed bodies, and exposes the
+    request path to stage() through endpoint_var.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = dict(scope.get("headers") or []).get(b"x-request-id", b"").decode("latin-1")[:64]
+        trace_id = trace_id or new_trace_id()
+        trace_id_var.set(trace_id)
+        endpoint_var.set(scope.get("path", "-"))
+        status = 500
+
+        async def send_with_trace_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers") or []) + [(b"x-request-id", trace_id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                endpoint=_route_label(scope),
+                method=scope.get("method", ""),
+                status=status,
+            )
+
+
+def _route_label(scope) -> str:
+    """Route template (e.g. /documents/{doc_id}) so labels stay low-cardinality"""
+    route = scope.get("route")
+    if getattr(route, "path", None):
+        return route.path
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", None) or "unmatched"
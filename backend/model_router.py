@@ -0,0 +1,178 @@
+import re
+import time
+import statistics
+from collections import deque
+
+# Endpoint classes used to keep latency statistics apart: a chat answer and a
+# 5-question quiz from 8000 characters of notes take very different times.
+CHAT = "chat"
+GENERATION = "generation"
+
+_RETRY_DELAY_RE = re.compile(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s")
+
+
+def is_quota_error(error) -> bool:
+    error_msg = str(error)
+    return "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg
+
+
+class AllModelsCoolingDown(Exception):
+    """Raised when every model is known to be rate-limited"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"429 RESOURCE_EXHAUSTED: all models cooling down, retry in {retry_after:.0f}s")
+
+
+class _ModelState:
+    def __init__(self, window: int):
+        self.cooldown_until = 0.0
+        self.quota_strikes = 0
+        self.latencies = {}  # endpoint class -> deque of seconds
+        self.outcomes = deque(maxlen=window)  # True = success
+        self.window = window
+        self.calls = 0
+        self.quota_errors = 0
+
+    def latency_samples(self, endpoint_class):
+        if endpoint_class not in self.latencies:
+            self.latencies[endpoint_class] = deque(maxlen=self.window)
+        return self.latencies[endpoint_class]
+
+
+class ModelRouter:
+    """
+    Remembers which Gemini models are rate-limited and how fast the others are,
+    so a request goes straight to the best healthy model instead of walking
+    FALLBACK_MODELS and paying a failed round trip per exhausted entry.
+
+    - 429/RESOURCE_EXHAUSTED puts a model on cooldown (honours retryDelay,
+      doubles on repeated strikes, daily-quota errors use the maximum)
+    - rolling latency is tracked per endpoint class, success rate per model
+    - candidates() orders healthy models fastest first; models with no
+      samples yet borrow the best known latency so they still get tried
+
+    With a shared_state.SharedState, cooldowns and strikes are shared with
+    the other worker processes; latency and success rates stay per process.
+    """
+
+    def __init__(self, models, base_cooldown: float = 60.0, max_cooldown: float = 3600.0,
+                 window: int = 20, min_success_rate: float = 0.5, shared=None):
+        self.models = list(models)
+        self.shared = shared
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.min_success_rate = min_success_rate
+        self._state = {model: _ModelState(window) for model in self.models}
+
+    def _cooldown_for(self, state, error_msg):
+        if "PerDay" in error_msg or "per day" in error_msg.lower():
+            return self.max_cooldown
+        match = _RETRY_DELAY_RE.search(error_msg)
+        if match:
+            return min(float(match.group(1)), self.max_cooldown)
+        return min(self.base_cooldown * (2 ** (state.quota_strikes - 1)), self.max_cooldown)
+
+    def _sync_cooldowns(self):
+        """Adopt the cooldowns other worker processes recorded (or cleared)"""
+        if self.shared is None:
+            return
+        now = time.monotonic()
+        cooldowns = self.shared.cooldowns()
+        for model in self.models:
+            state = self._state[model]
+            remaining, strikes = cooldowns.get(model, (0.0, 0))
+            state.cooldown_until = now + remaining if remaining > 0 else 0.0
+            state.quota_strikes = strikes
+
+    def record_success(self, model, latency, endpoint_class=GENERATION):
+        state = self._state[model]
+        if self.shared is not None and (state.quota_strikes or state.cooldown_until):
+            self.shared.clear_cooldown(model)
+        state.calls += 1
+        state.quota_strikes = 0
+        state.cooldown_until = 0.0
+        state.outcomes.append(True)
+        state.latency_samples(endpoint_class).append(latency)
+
+    def record_quota_error(self, model, error=None):
+        self._sync_cooldowns()
+        state = self._state[model]
+        state.calls += 1
+        state.quota_errors += 1
+        state.quota_strikes += 1
+        cooldown = self._cooldown_for(state, str(error or ""))
+        state.cooldown_until = time.monotonic() + cooldown
+        if self.shared is not None:
+            self.shared.set_cooldown(model, cooldown, state.quota_strikes)
+        return cooldown
+
+    def record_failure(self, model):
+        state = self._state[model]
+        state.calls += 1
+        state.outcomes.append(False)
+
+    def is_available(self, model, now=None) -> bool:
+        return self._state[model].cooldown_until <= (now or time.monotonic())
+
+    def success_rate(self, model):
+        outcomes = self._state[model].outcomes
+        return sum(outcomes) / len(outcomes) if outcomes else None
+
+    def latency(self, model, endpoint_class=GENERATION):
+        samples = self._state[model].latencies.get(endpoint_class)
+        return statistics.median(samples) if samples else None
+
+    def latency_percentile(self, model, endpoint_class=GENERATION, pct: float = 90, min_samples: int = 5):
+        """pct-th percentile of recent latency, or None with fewer than min_samples"""
+        samples = self._state[model].latencies.get(endpoint_class)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+    def retry_after(self) -> float:
+        """Seconds until the first model comes off cooldown (0 if one is available now)"""
+        self._sync_cooldowns()
+        now = time.monotonic()
+        return max(min(self._state[m].cooldown_until for m in self.models) - now, 0.0)
+
+    def candidates(self, endpoint_class=GENERATION):
+        """Healthy models, best first. Raises AllModelsCoolingDown if none are usable."""
+        self._sync_cooldowns()
+        now = time.monotonic()
+        healthy = [m for m in self.models if self.is_available(m, now)]
+        if not healthy:
+            raise AllModelsCoolingDown(max(self.retry_after(), 1.0))
+
+        known = [self.latency(m, endpoint_class) for m in healthy]
+        known = [l for l in known if l is not None]
+        default_latency = min(known) if known else 0.0
+
+        def score(model):
+            rate = self.success_rate(model)
+            unreliable = rate is not None and rate < self.min_success_rate
+            latency = self.latency(model, endpoint_class)
+            return (unreliable, default_latency if latency is None else latency, self.models.index(model))
+
+        return sorted(healthy, key=score)
+
+    def snapshot(self):
+        self._sync_cooldowns()
+        now = time.monotonic()
+        models = {}
+        for model in self.models:
+            state = self._state[model]
+            rate = self.success_rate(model)
+            models[model] = {
+                "available": self.is_available(model, now),
+                "cooldown_remaining": round(max(state.cooldown_until - now, 0.0), 1),
+                "calls": state.calls,
+                "quota_errors": state.quota_errors,
+                "success_rate": None if rate is None else round(rate, 3),
+                "latency_p50": {
+                    cls: round(statistics.median(samples), 3)
+                    for cls, samples in state.latencies.items() if samples
+                },
+            }
+        return models
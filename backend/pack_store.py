@@ -0,0 +1,173 @@
+"""
+Offline packs as addressable resources: each generated pack is kept under a
+stable pack id (document + subject + chapter) with a strong version derived
+from its content and the prompt version, and with its JSON body already
+serialised and compressed, so re-fetching or re-syncing a pack costs no
+generation and no per-request compression.
+
+The store is bounded like the result cache: packs nobody fetched or synced
+for `ttl_seconds` expire, and beyond `max_packs` the least recently used
+ones are evicted (a sync then reports them as missing).
+
+    entry = store.put(make_pack_id(doc_hash, "Physics", "Optics"), "Physics", "Optics", result)
+    entry["etag"], entry["body"], entry["gzip"]
+    store.changed({pack_id: version_the_client_has, ...})
+"""
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from shared_state import connect
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+def make_pack_id(doc_hash: str, subject: str, chapter: str, pages=None, variant: str = "") -> str:
+    """Stable id of the pack for one chapter of a document (independent of the prompt version)"""
+    payload = json.dumps({"file": doc_hash, "subject": subject, "chapter": chapter,
+                          "pages": list(pages) if pages else None, "variant": variant},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def pack_version(pack: dict, prompt_version: str) -> str:
+    """Content hash of a pack, changing with the pack or the prompt templates"""
+    canonical = json.dumps(pack, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{prompt_version}\n{canonical}".encode("utf-8")).hexdigest()[:32]
+
+
+class PackStore:
+    def __init__(self, db_path: str, prompt_version: str, max_packs: int = 5000,
+                 ttl_seconds: float = 30 * 24 * 3600):
+        self.prompt_version = prompt_version
+        self.max_packs = max_packs
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.stats = {"writes": 0, "unchanged": 0, "evictions": 0}
+
+        self._db = connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS packs ("
+            " pack_id TEXT PRIMARY KEY,"
+            " version TEXT NOT NULL,"
+            " subject TEXT NOT NULL,"
+            " chapter TEXT NOT NULL,"
+            " body BLOB NOT NULL,"
+            " gzip BLOB NOT NULL,"
+            " br BLOB,"
+            " updated REAL NOT NULL,"
+            " accessed REAL NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(packs)")}
+        if "accessed" not in columns:  # Table from before eviction
+            self._db.execute("ALTER TABLE packs ADD COLUMN accessed REAL NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE packs SET accessed = updated")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_packs_accessed ON packs(accessed)")
+        self._db.commit()
+
+    @staticmethod
+    def _entry(row):
+        pack_id, version, body, gzipped, br, updated = row
+        return {"pack_id": pack_id, "version": version, "etag": f'"{version}"',
+                "body": body, "gzip": gzipped, "br": br, "updated": updated}
+
+    def put(self, pack_id: str, subject: str, chapter: str, pack: dict) -> dict:
+        """
+        Store the pack (a no-op if this exact version is stored already).
+        The stored body is the pack plus its "pack_id" and "version".
+        """
+        version = pack_version(pack, self.prompt_version)
+        with self._lock:
+            row = self._db.execute("SELECT pack_id, version, body, gzip, br, updated FROM packs WHERE pack_id = ?",
+                                   (pack_id,)).fetchone()
+        if row is not None and row[1] == version:
+            self.stats["unchanged"] += 1
+            self._touch([pack_id])
+            return self._entry(row)
+
+        body = json.dumps({**pack, "pack_id": pack_id, "version": version},
+                          ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        entry = (pack_id, version, body, gzip.compress(body, 9),
+                 brotli.compress(body) if brotli else None, time.time())
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO packs (pack_id, version, subject, chapter, body, gzip, br, updated, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (pack_id, version, subject, chapter, *entry[2:], entry[-1]),
+            )
+            self.stats["writes"] += 1
+            self._evict(entry[-1])
+            self._db.commit()
+        return self._entry(entry)
+
+    def _evict(self, now):
+        cur = self._db.execute("DELETE FROM packs WHERE accessed < ?", (now - self.ttl_seconds,))
+        removed = cur.rowcount
+        (count,) = self._db.execute("SELECT COUNT(*) FROM packs").fetchone()
+        if count > self.max_packs:
+            cur = self._db.execute(
+                "DELETE FROM packs WHERE pack_id IN (SELECT pack_id FROM packs ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_packs,),
+            )
+            removed += cur.rowcount
+        if removed:
+            self.stats["evictions"] += removed
+            logger.info(f"🧹 Pack store evicted {removed} packs")
+
+    def _touch(self, pack_ids):
+        """Mark packs as used now: fetched or synced packs are the ones kept"""
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(pack_ids), 500):  # SQLite host parameter limit
+                chunk = pack_ids[start:start + 500]
+                self._db.execute(f"UPDATE packs SET accessed = ? WHERE pack_id IN ({', '.join('?' * len(chunk))})",
+                                 (now, *chunk))
+            self._db.commit()
+
+    def get(self, pack_id: str):
+        """The stored pack, or None if unknown or expired (expired rows stay until the next put evicts them)"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT pack_id, version, body, gzip, br, updated FROM packs WHERE pack_id = ? AND accessed >= ?",
+                (pack_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+        if row is None:
+            return None
+        self._touch([pack_id])
+        return self._entry(row)
+
+    def changed(self, known: dict):
+        """
+        For a client's {pack_id: version} map: (bodies of the packs whose
+        version differs, ids we don't have, number unchanged).
+        """
+        ids = list(known)
+        rows = []
+        oldest = time.time() - self.ttl_seconds  # Expired packs count as missing
+        with self._lock:
+            for start in range(0, len(ids), 500):  # SQLite host parameter limit
+                chunk = ids[start:start + 500]
+                rows += self._db.execute(
+                    f"SELECT pack_id, version, body FROM packs WHERE pack_id IN ({', '.join('?' * len(chunk))})"
+                    " AND accessed >= ?",
+                    (*chunk, oldest),
+                ).fetchall()
+        found = {pack_id: (version, body) for pack_id, version, body in rows}
+        if found:
+            self._touch(list(found))
+        changed = [body for pack_id, (version, body) in found.items() if version != known[pack_id]]
+        missing = [pack_id for pack_id in ids if pack_id not in found]
+        return changed, missing, len(found) - len(changed)
+
+    def summary(self) -> dict:
+        with self._lock:
+            (packs,) = self._db.execute("SELECT COUNT(*) FROM packs").fetchone()
+        return {"packs": packs, "brotli": brotli is not None, **self.stats}
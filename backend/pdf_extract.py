@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from text_compaction import compact_pages
+
+logger = logging.getLogger(__name__)
+
+# Rough conversion used when callers think in tokens rather than characters
+CHARS_PER_TOKEN = 4
+
+
+def _extract_page_range(source, start_page, end_page, max_chars, compaction=None):
+    """
+    Runs in a worker process: open the PDF and read pages from start_page
+    until end_page or until max_chars characters have been collected.
+    With `compaction` ({"boilerplate": set, "dedupe_paragraphs": bool}) the
+    pages are compacted (see text_compaction) and max_chars counts compacted
+    characters. Returns (page_count, {page_number: text}, stats, boilerplate).
+    """
+    import fitz  # PyMuPDF
+
+    if isinstance(source, str):
+        doc = fitz.open(source)
+    else:
+        doc = fitz.open(stream=source, filetype="pdf")
+    try:
+        page_count = doc.page_count
+        stop = page_count if end_page is None else min(end_page, page_count)
+        pages = {}
+        collected = 0
+        stats, boilerplate = Counter(), None
+        page_number = start_page
+        while page_number < stop and (max_chars is None or collected < max_chars):
+            batch_start = page_number
+            batch = []
+            batch_chars = 0
+            for page_number in range(batch_start, stop):
+                text = doc.load_page(page_number).get_text()
+                batch.append(text)
+                batch_chars += len(text)
+                if max_chars is not None and collected + batch_chars >= max_chars:
+                    break
+            page_number = batch_start + len(batch)
+            if compaction is not None:
+                batch, batch_stats, boilerplate = compact_pages(
+                    batch, boilerplate or compaction["boilerplate"], compaction["dedupe_paragraphs"])
+                stats.update(batch_stats)
+            pages.update(enumerate(batch, batch_start))
+            collected += sum(len(text) for text in batch)
+        return page_count, pages, dict(stats), boilerplate
+    finally:
+        doc.close()
+
+
+def _load_fitz():
+    import fitz  # noqa: F401
+
+
+class PdfTextIndex:
+    """
+    Per-document page text index.
+
+    Pages are extracted lazily, only as far as the requested character budget
+    needs, in a process pool so fitz's CPU work stays off the event loop.
+    Extracted pages are kept per document hash, so a later request for more
+    text or another page range only parses the pages not seen yet.
+
+    With compact=True pages are stored compacted (headers, page numbers,
+    hyphenation, TOC pages... removed, see text_compaction); the headers found
+    so far are kept per document so later page ranges lose them too.
+    """
+
+    def __init__(self, max_workers: int = 2, max_documents: int = 32, compact: bool = True,
+                 dedupe_paragraphs: bool = True):
+        self.max_workers = max_workers
+        self.max_documents = max_documents
+        self.compact = compact
+        self.dedupe_paragraphs = dedupe_paragraphs
+        self.stats = Counter()  # Compaction totals: chars_in, chars_out, pages_dropped, ...
+        self._documents = OrderedDict()  # doc_hash -> {"page_count", "pages": {int: str}, "boilerplate": set}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self.max_workers <= 0:
+            return None  # Default thread pool
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def warm_up(self):
+        """Start the extraction processes and import PyMuPDF in them before the first PDF"""
+        executor = self._get_executor()
+        if executor is None:
+            _load_fitz()
+            return
+        for future in [executor.submit(_load_fitz) for _ in range(self.max_workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _entry(self, doc_hash):
+        entry = self._documents.get(doc_hash)
+        if entry is None:
+            entry = {"page_count": None, "pages": {}, "boilerplate": set()}
+            self._documents[doc_hash] = entry
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        else:
+            self._documents.move_to_end(doc_hash)
+        return entry
+
+    async def _run_extraction(self, entry, source, start_page, end_page, max_chars):
+        compaction = {"boilerplate": entry["boilerplate"], "dedupe_paragraphs": self.dedupe_paragraphs} \
+            if self.compact else None
+        loop = asyncio.get_running_loop()
+        page_count, pages, stats, boilerplate = await loop.run_in_executor(
+            self._get_executor(), _extract_page_range, source, start_page, end_page, max_chars, compaction
+        )
+        if stats:
+            entry["boilerplate"] |= boilerplate
+            self.stats.update(stats)
+            saved = stats["chars_in"] - stats["chars_out"]
+            logger.info(f"🧹 Compacted {stats['pages']} pages: {stats['chars_in']:,} -> {stats['chars_out']:,} chars"
+                        f" ({saved / max(stats['chars_in'], 1):.0%} saved)")
+        return page_count, pages
+
+    async def get_pages(self, source, doc_hash: str, max_chars: int = None, max_tokens: int = None,
+                        start_page: int = 0, end_page: int = None):
+        """
+        Page texts from start_page onward, stopping once max_chars (or
+        max_tokens * CHARS_PER_TOKEN) characters are available.
+        `source` is the PDF bytes or a path to the PDF on disk.
+        """
+        if max_chars is None and max_tokens is not None:
+            max_chars = max_tokens * CHARS_PER_TOKEN
+
+        entry = self._entry(doc_hash)
+        result = []
+        collected = 0
+        page_number = start_page
+        while True:
+            page_count = entry["page_count"]
+            stop = end_page if page_count is None else min(end_page or page_count, page_count)
+            if stop is not None and page_number >= stop:
+                break
+            if max_chars is not None and collected >= max_chars:
+                break
+
+            text = entry["pages"].get(page_number)
+            if text is None:
+                remaining = None if max_chars is None else max_chars - collected
+                page_count, pages = await self._run_extraction(entry, source, page_number, end_page, remaining)
+                entry["page_count"] = page_count
+                entry["pages"].update(pages)
+                if not pages:
+                    break
+                text = entry["pages"][page_number]
+
+            result.append(text)
+            collected += len(text)
+            page_number += 1
+        return result
+
+    async def get_text(self, source, doc_hash: str, **kwargs) -> str:
+        """Same as get_pages, joined into one string (empty string if the PDF can't be read)"""
+        try:
+            pages = await self.get_pages(source, doc_hash, **kwargs)
+        except Exception as e:
+            logger.error(f"PDF Extraction Error: {e}")
+            return ""
+        return "".join(pages)
+
+    def seed(self, doc_hash: str, pages):
+        """Load already-extracted page texts (e.g. from the document store)"""
+        entry = self._entry(doc_hash)
+        entry["page_count"] = len(pages)
+        entry["pages"] = dict(enumerate(pages))
+
+    def summary(self) -> dict:
+        chars_in = self.stats["chars_in"]
+        return {
+            "compaction": self.compact,
+            **self.stats,
+            "saved_ratio": round(1 - self.stats["chars_out"] / chars_in, 3) if chars_in else 0.0,
+        }
+
+    def page_count(self, doc_hash: str):
+        entry = self._documents.get(doc_hash)
+        return entry["page_count"] if entry else None
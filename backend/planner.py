@@ -0,0 +1,350 @@
+"""
+Local study-plan engine: free time slots are parsed from the timetable text,
+and weighted topics are assigned to days greedily with spaced revision.
+The only model call a plan needs is the topic extraction from the syllabus,
+which is cached, so re-planning after a missed day is free and instant.
+
+    slots = parse_timetable("Mon 5-7pm free\\nSat 10am-1pm free")
+    plan = build_plan("Physics", topics, slots, days=14)
+    plan = replan(plan, from_day=4, missed_days=[3])
+"""
+import re
+import datetime
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+_WEEKDAY_RE = re.compile(r"\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\b|\b(daily|everyday|every day|weekdays?|weekends?)\b",
+                         re.IGNORECASE)
+_RANGE_RE = re.compile(
+    r"(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)?\s*(?:-|–|to)\s*(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)?",
+    re.IGNORECASE,
+)
+_FREE_WORDS = ("free", "study", "available", "self", "revision", "open")
+
+DEFAULT_STUDY_WINDOW = (17 * 60, 21 * 60)  # Busy-only timetables: study between 5 and 9pm
+DEFAULT_DAILY_MINUTES = 120  # No usable timetable at all
+MINUTES_PER_WEIGHT = 45  # Learning time a weight-1 topic needs
+MIN_SESSION_MINUTES = 20
+REVIEW_MINUTES = 15
+REVIEW_OFFSETS = (1, 3, 7)  # Days after a topic is finished
+LEARNING_SHARE = 0.8  # Capacity kept for learning; the rest absorbs revision
+FULL_REVISION = "Full revision and practice test"
+MISSED_DAY = "Missed (rescheduled)"
+
+
+# --- TIMETABLE ---
+
+def _to_minutes(hour, minute, meridiem):
+    hour = int(hour) % 24
+    minute = int(minute or 0)
+    if meridiem:
+        meridiem = meridiem.lower()
+        if meridiem == "pm" and hour < 12:
+            hour += 12
+        elif meridiem == "am" and hour == 12:
+            hour = 0
+    return hour * 60 + minute
+
+
+def _parse_range(match):
+    h1, m1, mer1, h2, m2, mer2 = match.groups()
+    if not mer1 and not mer2 and int(h1) < 8 and int(h2) <= 12:
+        mer1 = mer2 = "pm"  # Bare "5-7": students mean the evening
+    end = _to_minutes(h2, m2, mer2)
+    if not mer1 and not mer2 and int(h2) < 12 and end <= _to_minutes(h1, m1, None):
+        end += 12 * 60  # Bare "12-2" or "11-1": the range ends after noon
+    start = _to_minutes(h1, m1, mer1 or mer2)  # "5-7pm" means 5pm to 7pm
+    if not mer1 and start >= end:
+        start = _to_minutes(h1, m1, None)  # "11-1pm" means 11am to 1pm
+    return (start, end) if end > start else None
+
+
+def _weekdays_in(line):
+    days = set()
+    for match in _WEEKDAY_RE.finditer(line):
+        word = (match.group(1) or match.group(2)).lower()
+        if match.group(1):
+            days.add(WEEKDAYS.index(word[:3]))
+        elif word.startswith("weekday"):
+            days.update(range(5))
+        elif word.startswith("weekend"):
+            days.update((5, 6))
+        else:
+            days.update(range(7))
+    return days
+
+
+def _merge(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract(window, busy):
+    free = [window]
+    for b_start, b_end in busy:
+        next_free = []
+        for f_start, f_end in free:
+            if b_end <= f_start or b_start >= f_end:
+                next_free.append((f_start, f_end))
+                continue
+            if b_start > f_start:
+                next_free.append((f_start, b_start))
+            if b_end < f_end:
+                next_free.append((b_end, f_end))
+        free = next_free
+    return free
+
+
+def parse_timetable(text: str) -> dict:
+    """
+    Free study slots per weekday (0 = Monday) as [(start_minute, end_minute)].
+
+    Lines with a free/study keyword (or nothing but days and times) are free
+    slots; other timed lines are commitments and are cut out of the default
+    evening window. Lines without a weekday apply to every day.
+    """
+    free = {d: [] for d in range(7)}
+    busy = {d: [] for d in range(7)}
+    for line in (text or "").splitlines():
+        ranges = [r for r in (_parse_range(m) for m in _RANGE_RE.finditer(line)) if r]
+        if not ranges:
+            continue
+        days = _weekdays_in(line) or set(range(7))
+        leftover = _RANGE_RE.sub(" ", _WEEKDAY_RE.sub(" ", line.lower()))
+        is_free = any(word in leftover for word in _FREE_WORDS) or not re.search(r"[a-z]{3,}", leftover)
+        for day in days:
+            (free if is_free else busy)[day].extend(ranges)
+
+    has_free = any(free.values())
+    has_busy = any(busy.values())
+    slots = {}
+    for day in range(7):
+        if has_free:
+            ranges = _merge(free[day])
+        elif has_busy:
+            ranges = _subtract(DEFAULT_STUDY_WINDOW, _merge(busy[day]))
+        else:
+            ranges = []
+        if has_free and busy[day]:
+            ranges = [r for window in ranges for r in _subtract(window, _merge(busy[day]))]
+        slots[day] = ranges
+    if not has_free and not has_busy:
+        start = DEFAULT_STUDY_WINDOW[0]
+        slots = {day: [(start, start + DEFAULT_DAILY_MINUTES)] for day in range(7)}
+    return slots
+
+
+def format_minutes(minutes: int) -> str:
+    hours, rest = divmod(int(round(minutes)), 60)
+    if hours and rest:
+        return f"{hours} hour{'s' if hours > 1 else ''} {rest} min"
+    if hours:
+        return f"{hours} hour{'s' if hours > 1 else ''}"
+    return f"{rest} min"
+
+
+def _format_slot(start, end):
+    return f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+
+
+def _parse_slot(text):
+    start, end = text.split("-")
+    (h1, m1), (h2, m2) = start.split(":"), end.split(":")
+    return int(h1) * 60 + int(m1), int(h2) * 60 + int(m2)
+
+
+# --- SYLLABUS (local fallback) ---
+
+_UNIT_PREFIX_RE = re.compile(r"^\s*(?:(?:unit|chapter|module|topic|part)\s*[\dIVXivx]*|\d+)\s*[.):\-]*\s*", re.IGNORECASE)
+
+
+def topics_from_syllabus(text: str, max_topics: int = 30):
+    """Topics straight from the syllabus lines, weighted by how much they list"""
+    topics = []
+    for line in (text or "").splitlines():
+        line = _UNIT_PREFIX_RE.sub("", line.strip(" \t-*•"))
+        if not line:
+            continue
+        name, _, rest = line.partition(":")
+        subtopics = [s.strip() for s in re.split(r"[,;]", rest) if s.strip()]
+        if not rest and "," in name:
+            name, *subtopics = [s.strip() for s in name.split(",") if s.strip()]
+        name = name.strip()
+        if name:
+            topics.append({"name": name, "weight": min(5, 1 + len(subtopics) // 2), "subtopics": subtopics})
+    return topics[:max_topics]
+
+
+# --- SCHEDULING ---
+
+def _capacities(slots, days, start_date):
+    """Minutes and slot labels for each plan day"""
+    result = []
+    for offset in range(days):
+        date = start_date + datetime.timedelta(days=offset)
+        ranges = slots.get(date.weekday(), [])
+        result.append({
+            "date": date.isoformat(),
+            "minutes": sum(end - start for start, end in ranges),
+            "slots": [_format_slot(start, end) for start, end in ranges],
+        })
+    return result
+
+
+def _schedule(work, capacities, first_day=1, final_revision=True):
+    """
+    Greedy assignment of [{"name", "subtopics", "minutes"}] (in order) to days.
+    Each day first takes the revision sessions due that day, then continues
+    with the current topic. A finished topic gets short reviews 1, 3 and 7 days
+    later (on the next day with time, if that one has none); the last day is
+    kept for full revision when the plan is long enough.
+    """
+    days = len(capacities)
+    learning_days = days - 1 if final_revision and days >= 4 else days
+    queue = [dict(item, remaining=item["minutes"], done=0) for item in work if item["minutes"] > 0]
+    reviews = {}  # day index -> [topic names]
+    plan_days = []
+
+    for index, capacity in enumerate(capacities):
+        left = capacity["minutes"]
+        sessions = []
+        if index >= learning_days:
+            if left:
+                sessions.append({"topic": FULL_REVISION, "minutes": left, "kind": "revise"})
+                left = 0
+        for name in reviews.pop(index, []):
+            if left >= REVIEW_MINUTES:
+                sessions.append({"topic": name, "minutes": REVIEW_MINUTES, "kind": "revise"})
+                left -= REVIEW_MINUTES
+            elif index + 1 < days and name not in reviews.get(index + 1, []):
+                reviews.setdefault(index + 1, []).append(name)  # No time today: next study day
+        while queue and index < learning_days and left >= MIN_SESSION_MINUTES:
+            item = queue[0]
+            minutes = min(item["remaining"], left)
+            if item["remaining"] - minutes < MIN_SESSION_MINUTES:
+                minutes = item["remaining"] if item["remaining"] <= left else left - MIN_SESSION_MINUTES
+                if minutes < MIN_SESSION_MINUTES:
+                    break
+            # Spread subtopics over the sessions proportionally to the time covered
+            subtopics = item["subtopics"]
+            covered_before = item["minutes"] - item["remaining"]
+            first = int(len(subtopics) * covered_before / item["minutes"])
+            last = int(round(len(subtopics) * (covered_before + minutes) / item["minutes"]))
+            sessions.append({"topic": item["name"], "minutes": minutes, "kind": "learn",
+                             "subtopics": subtopics[first:max(last, first + 1)] if subtopics else []})
+            item["remaining"] -= minutes
+            left -= minutes
+            if item["remaining"] <= 0:
+                queue.pop(0)
+                for offset in REVIEW_OFFSETS:
+                    if index + offset < days:
+                        reviews.setdefault(index + offset, []).append(item["name"])
+
+        plan_days.append(_day_entry(first_day + index, capacity, sessions))
+
+    unscheduled = [{"name": item["name"], "subtopics": item["subtopics"], "minutes": item["remaining"]}
+                   for item in queue]
+    return plan_days, unscheduled
+
+
+def _day_entry(day_number, capacity, sessions):
+    learn = [s for s in sessions if s["kind"] == "learn"]
+    revise = [s for s in sessions if s["kind"] == "revise"]
+    if learn:
+        topic = " + ".join(dict.fromkeys(s["topic"] for s in learn))
+    elif revise:
+        topic = FULL_REVISION if revise[0]["topic"] == FULL_REVISION else "Revision"
+    else:
+        topic = "Rest / catch-up"
+    subtopics = [sub for s in learn for sub in s.get("subtopics", [])]
+    subtopics += [f"Revise: {s['topic']}" for s in revise if s["topic"] != FULL_REVISION]
+    return {
+        "day": day_number,
+        "date": capacity["date"],
+        "topic": topic,
+        "subtopics": subtopics,
+        "duration": format_minutes(sum(s["minutes"] for s in sessions)) if sessions else "0 min",
+        "slots": capacity["slots"],
+        "sessions": sessions,
+    }
+
+
+def _work_from_topics(topics, capacities):
+    """Learning minutes per topic: weight-based, scaled down to fit the available time"""
+    demand = [max(int(t.get("weight") or 1), 1) * MINUTES_PER_WEIGHT for t in topics]
+    learning_capacity = sum(c["minutes"] for c in capacities) * LEARNING_SHARE
+    scale = min(1.0, learning_capacity / sum(demand)) if sum(demand) else 1.0
+    return [
+        {"name": t["name"], "subtopics": list(t.get("subtopics") or []),
+         "minutes": max(int(round(d * scale / 5.0)) * 5, MIN_SESSION_MINUTES)}
+        for t, d in zip(topics, demand)
+    ]
+
+
+def _serialize_slots(slots):
+    return {WEEKDAYS[day]: [_format_slot(s, e) for s, e in ranges] for day, ranges in slots.items()}
+
+
+def _deserialize_slots(data):
+    return {WEEKDAYS.index(day): [_parse_slot(r) for r in ranges] for day, ranges in (data or {}).items()}
+
+
+def build_plan(subject: str, topics, slots: dict, days: int = 14, start_date: datetime.date = None) -> dict:
+    """Day-by-day plan for `days` days starting at start_date (default today)"""
+    start_date = start_date or datetime.date.today()
+    capacities = _capacities(slots, days, start_date)
+    plan_days, unscheduled = _schedule(_work_from_topics(topics, capacities), capacities)
+    return {
+        "root": f"{subject} Plan",
+        "days": plan_days,
+        "topics": topics,
+        "timetable": _serialize_slots(slots),
+        "unscheduled": unscheduled,
+    }
+
+
+def _missed_entry(entry):
+    """A past day the student missed: its learning moved to the new plan, marked as missed"""
+    sessions = [s for s in entry.get("sessions", []) if s["kind"] != "learn"]
+    capacity = {"date": entry.get("date"), "slots": entry.get("slots", [])}
+    return {**_day_entry(entry["day"], capacity, sessions), "topic": MISSED_DAY, "missed": True}
+
+
+def replan(plan: dict, from_day: int, missed_days=(), days: int = None, start_date: datetime.date = None) -> dict:
+    """
+    Re-plan from `from_day` onward: learning from missed days and from all days
+    not reached yet is scheduled again, from start_date (default today) over
+    `days` days (default: the days the old plan had left). Missed days before
+    from_day stay in the plan, marked "missed" and without their learning.
+    No model call.
+    """
+    old_days = plan.get("days") or []
+    missed = set(missed_days)
+    pending = {}
+    for entry in old_days:
+        if entry["day"] < from_day and entry["day"] not in missed:
+            continue
+        for session in entry.get("sessions", []):
+            if session["kind"] != "learn":
+                continue
+            item = pending.setdefault(session["topic"], {"name": session["topic"], "subtopics": [], "minutes": 0})
+            item["minutes"] += session["minutes"]
+            item["subtopics"].extend(s for s in session.get("subtopics", []) if s not in item["subtopics"])
+    work = list(pending.values())
+    for item in plan.get("unscheduled") or []:
+        if item["name"] in pending:
+            pending[item["name"]]["minutes"] += item["minutes"]
+        else:
+            work.append(dict(item))
+
+    days = days or max(len(old_days) - from_day + 1, 1)
+    slots = _deserialize_slots(plan.get("timetable"))
+    capacities = _capacities(slots, days, start_date or datetime.date.today())
+    plan_days, unscheduled = _schedule(work, capacities, first_day=from_day)
+    kept = [_missed_entry(entry) if entry["day"] in missed else entry
+            for entry in old_days if entry["day"] < from_day]
+    return {**plan, "days": kept + plan_days, "unscheduled": unscheduled}
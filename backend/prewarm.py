@@ -0,0 +1,157 @@
+"""
+Fills the result cache with topic quizzes ahead of time (e.g. overnight before
+exam weeks), so /generate-quiz answers the popular topics from the cache when
+quota is scarce.
+
+    python prewarm.py syllabus.txt
+    python prewarm.py syllabus.txt --difficulties easy medium hard --rate 6 --window 01:00-06:00
+
+The syllabus file has one topic per line. "Topic | hard" sets the difficulty
+for that line; blank lines and # comments are skipped. Topics already cached
+cost nothing and are skipped. Generation runs in this process against the
+server's data directory (ENWISE_DATA_DIR), at most --rate generations a minute;
+run it with SHARED_STATE=1 to also share the server's quota buckets.
+"""
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("prewarm")
+
+MAX_ATTEMPTS = 3  # Per topic, when the model is out of quota
+
+
+def read_topics(path, difficulties):
+    """[(topic, difficulty)] from a syllabus file ("-" = stdin)"""
+    handle = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with handle:
+        items = []
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            topic, _, level = line.partition("|")
+            for difficulty in ([level.strip()] if level.strip() else difficulties):
+                items.append((topic.strip(), difficulty))
+    return items
+
+
+def parse_window(value):
+    """"HH:MM-HH:MM" -> (start, end) minutes after midnight"""
+    try:
+        start, end = (datetime.strptime(part.strip(), "%H:%M") for part in value.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("window must look like 01:00-06:00")
+    return start.hour * 60 + start.minute, end.hour * 60 + end.minute
+
+
+def in_window(window, now=None) -> bool:
+    if window is None:
+        return True
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    start, end = window
+    return start <= minute < end if start <= end else (minute >= start or minute < end)
+
+
+def seconds_until_window(window, now=None) -> float:
+    now = now or datetime.now()
+    opens = now.replace(hour=window[0] // 60, minute=window[0] % 60, second=0, microsecond=0)
+    if opens <= now:
+        opens += timedelta(days=1)
+    return (opens - now).total_seconds()
+
+
+async def prewarm(main, items, num_questions, rate, concurrency, window, refresh):
+    stats = {"generated": 0, "cached": 0, "failed": 0, "not_started": 0}
+    interval = 60.0 / rate if rate > 0 else 0.0
+    pacing = asyncio.Lock()
+    next_start = [time.monotonic()]
+    slots = asyncio.Semaphore(concurrency)
+    main.client_id_var.set("prewarm")  # Fair share against other clients of the scheduler
+    main.endpoint_var.set("prewarm")
+
+    async def paced_start():
+        async with pacing:
+            delay = next_start[0] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_start[0] = time.monotonic() + interval
+
+    async def warm(topic, difficulty):
+        async with slots:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                if not in_window(window):
+                    stats["not_started"] += 1
+                    return
+                await paced_start()
+                try:
+                    await main.topic_quiz_for(topic, difficulty, num_questions, no_cache=refresh)
+                    stats["generated"] += 1
+                    logger.info(f"✅ {topic} ({difficulty})")
+                    return
+                except Exception as e:
+                    limited = main.rate_limit_error(e)
+                    if limited is None or attempt == MAX_ATTEMPTS:
+                        stats["failed"] += 1
+                        logger.error(f"❌ {topic} ({difficulty}): {getattr(e, 'detail', e)}")
+                        return
+                    retry_after = float(limited.headers["Retry-After"])
+                    logger.warning(f"⏳ Out of quota, retrying {topic} in {retry_after:.0f}s")
+                    await asyncio.sleep(retry_after)
+
+    todo = []
+    seen = set()
+    for topic, difficulty in items:
+        try:
+            key = main.topic_quiz_key(topic, difficulty, num_questions)
+        except main.HTTPException as e:
+            logger.error(f"❌ {topic}: {e.detail}")
+            stats["failed"] += 1
+            continue
+        if key in seen:  # Same topic written differently
+            continue
+        seen.add(key)
+        if not refresh and main.result_cache.get(key):
+            stats["cached"] += 1
+        else:
+            todo.append((topic, difficulty))
+    logger.info(f"🔥 {len(todo)} quizzes to generate, {stats['cached']} already cached")
+
+    if todo and not in_window(window):
+        wait = seconds_until_window(window)
+        logger.info(f"🌙 Waiting {wait / 3600:.1f}h for the off-peak window")
+        await asyncio.sleep(wait)
+    await asyncio.gather(*(warm(topic, difficulty) for topic, difficulty in todo))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate topic quizzes into the result cache")
+    parser.add_argument("syllabus", help="File with one topic per line (- for stdin)")
+    parser.add_argument("--difficulties", nargs="+", default=["medium"],
+                        help="Difficulties to generate for topics without their own (default: medium)")
+    parser.add_argument("--num-questions", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=6.0, help="Maximum generations per minute")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--window", type=parse_window, default=None,
+                        help="Only start generations between these local times, e.g. 01:00-06:00")
+    parser.add_argument("--refresh", action="store_true", help="Regenerate topics that are already cached")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    import main as backend  # After argument parsing: --help stays instant
+
+    items = read_topics(args.syllabus, args.difficulties)
+    started = time.perf_counter()
+    stats = asyncio.run(prewarm(backend, items, args.num_questions, args.rate, max(args.concurrency, 1),
+                                args.window, args.refresh))
+    logger.info(f"🏁 Prewarm done in {time.perf_counter() - started:.1f}s: {stats}")
+    sys.exit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
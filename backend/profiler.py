@@ -0,0 +1,70 @@
+import sys
+import time
+import threading
+import traceback
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Low-overhead sampling profiler for a running server: a background thread
+    snapshots the target thread's stack every `interval` seconds and counts
+    collapsed stacks ("file:func;file:func ..." as used by flame graph tools).
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self._samples = Counter()
+        self._target_thread_id = None
+        self.interval = 0.01
+        self.started_at = None
+        self.sample_count = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01, target_thread_id: int = None):
+        if self.running:
+            return False
+        self.interval = max(interval, 0.001)
+        self._target_thread_id = target_thread_id or threading.main_thread().ident
+        self._samples = Counter()
+        self.sample_count = 0
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            collapsed = ";".join(f"{entry.filename.rsplit('/', 1)[-1]}:{entry.name}" for entry in stack)
+            self._samples[collapsed] += 1
+            self.sample_count += 1
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def report(self, top: int = 30) -> dict:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.sample_count,
+            "duration": round(time.time() - self.started_at, 3) if self.started_at else 0.0,
+            "top_stacks": [
+                {"stack": stack, "samples": count} for stack, count in self._samples.most_common(top)
+            ],
+        }
+
+    def collapsed(self) -> str:
+        """All samples in collapsed-stack text format"""
+        return "\n".join(f"{stack} {count}" for stack, count in self._samples.most_common())
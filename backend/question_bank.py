@@ -0,0 +1,249 @@
+"""
+Persistent bank of validated quiz questions (SQLite + FTS5), so questions we
+already paid for can be served again instead of being generated anew.
+
+Questions are keyed by subject, chapter, kind ("prerequisite" for offline
+packs, "pyq" for PYQ practice) and topics, and are full-text indexed. A
+MinHash signature of each question with LSH banding keeps paraphrases of a
+question already in the bank out of it. Which questions were served to which
+client is recorded, so a client is only drawn questions it has not seen.
+Where SQLite was built without FTS5, term search falls back to substring
+matching on the stored questions.
+
+    bank.add(result["quiz"], "Physics", chapter="Optics", kind="prerequisite")
+    rows = bank.draw("Physics", 5, client_id, kind="prerequisite", chapter="Optics")
+"""
+import re
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from shared_state import connect
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 64
+BANDS = 16  # 16 bands of 4 rows: pairs above ~0.6 Jaccard almost always share a bucket
+_ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(text, topics)"
+
+
+def _norm(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def shingles(text: str, size: int = 5):
+    """Character n-grams of the text with case and punctuation dropped (whole text if shorter)"""
+    text = " ".join(_WORD_RE.findall(text.lower()))
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash(text: str):
+    """NUM_PERM-value MinHash signature of the text's shingles"""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+              for s in shingles(text)]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(sig_a, sig_b) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _buckets(signature):
+    return [
+        (band, hashlib.blake2b(repr(signature[band * _ROWS:(band + 1) * _ROWS]).encode(), digest_size=8).hexdigest())
+        for band in range(BANDS)
+    ]
+
+
+def _question_text(question: dict) -> str:
+    """What two questions must share to count as the same: the question and its answer"""
+    return f"{question.get('q', '')} {question.get('a', '')}"
+
+
+def _match_query(terms) -> str:
+    """FTS5 query matching any of the terms"""
+    quoted = ['"' + term.replace('"', "") + '"' for term in dict.fromkeys(terms) if term]
+    return " OR ".join(quoted)
+
+
+class QuestionBank:
+    def __init__(self, db_path: str, duplicate_threshold: float = 0.7, served_ttl_seconds: float = 30 * 24 * 3600):
+        self.duplicate_threshold = duplicate_threshold
+        self.served_ttl_seconds = served_ttl_seconds
+        self._lock = threading.Lock()
+        self.stats = {"added": 0, "duplicates": 0, "drawn": 0}
+
+        self._db = connect(db_path)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS questions ("
+            " id INTEGER PRIMARY KEY,"
+            " subject TEXT NOT NULL,"
+            " chapter TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " topics TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " signature TEXT NOT NULL,"
+            " created REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_questions_chapter ON questions(subject, kind, chapter);"
+            "CREATE TABLE IF NOT EXISTS question_buckets ("
+            " band INTEGER NOT NULL,"
+            " bucket TEXT NOT NULL,"
+            " question_id INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_question_buckets ON question_buckets(band, bucket);"
+            "CREATE TABLE IF NOT EXISTS served ("
+            " client TEXT NOT NULL,"
+            " question_id INTEGER NOT NULL,"
+            " served_at REAL NOT NULL,"
+            " PRIMARY KEY (client, question_id));"
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " subject TEXT NOT NULL,"
+            " chapter TEXT NOT NULL,"
+            " summary TEXT NOT NULL,"
+            " PRIMARY KEY (subject, chapter));"
+        )
+        try:
+            self._db.execute(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError as e:  # SQLite built without FTS5
+            logger.warning(f"⚠️ Question bank full-text index unavailable ({e}); searching by substring")
+            self.fts = False
+        self._db.execute("DELETE FROM served WHERE served_at < ?", (time.time() - served_ttl_seconds,))
+        self._db.commit()
+
+    # --- adding ---
+
+    def _find_duplicate(self, subject, signature):
+        buckets = _buckets(signature)
+        placeholders = ", ".join("(?, ?)" for _ in buckets)
+        rows = self._db.execute(
+            "SELECT q.id, q.signature FROM questions q WHERE q.subject = ? AND q.id IN ("
+            f" SELECT question_id FROM question_buckets WHERE (band, bucket) IN (VALUES {placeholders}))",
+            (subject, *[value for bucket in buckets for value in bucket]),
+        ).fetchall()
+        for question_id, other in rows:
+            if similarity(signature, json.loads(other)) >= self.duplicate_threshold:
+                return question_id
+        return None
+
+    def add(self, questions, subject: str, chapter: str = "", kind: str = "quiz", topics=()):
+        """
+        Store validated questions, skipping near-duplicates of ones already in
+        the bank for this subject. Returns the bank id of each question (the
+        existing question's id for a duplicate).
+        """
+        subject, chapter = _norm(subject), _norm(chapter)
+        topics = [t for t in (topics or []) if t]
+        ids = []
+        now = time.time()
+        with self._lock:
+            for question in questions:
+                text = _question_text(question)
+                signature = minhash(text)
+                duplicate = self._find_duplicate(subject, signature)
+                if duplicate is not None:
+                    ids.append(duplicate)
+                    self.stats["duplicates"] += 1
+                    continue
+                cursor = self._db.execute(
+                    "INSERT INTO questions (subject, chapter, kind, topics, question, signature, created)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (subject, chapter, kind, json.dumps(topics, ensure_ascii=False),
+                     json.dumps(question, ensure_ascii=False), json.dumps(signature), now),
+                )
+                question_id = cursor.lastrowid
+                if self.fts:
+                    self._db.execute("INSERT INTO questions_fts (rowid, text, topics) VALUES (?, ?, ?)",
+                                     (question_id, f"{chapter} {text}", " ".join(topics)))
+                self._db.executemany(
+                    "INSERT INTO question_buckets (band, bucket, question_id) VALUES (?, ?, ?)",
+                    [(band, bucket, question_id) for band, bucket in _buckets(signature)],
+                )
+                ids.append(question_id)
+                self.stats["added"] += 1
+            self._db.commit()
+        return ids
+
+    def set_summary(self, subject: str, chapter: str, summary):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO summaries (subject, chapter, summary) VALUES (?, ?, ?)",
+                             (_norm(subject), _norm(chapter), json.dumps(summary, ensure_ascii=False)))
+            self._db.commit()
+
+    def summary_for(self, subject: str, chapter: str):
+        with self._lock:
+            row = self._db.execute("SELECT summary FROM summaries WHERE subject = ? AND chapter = ?",
+                                   (_norm(subject), _norm(chapter))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # --- serving ---
+
+    def draw(self, subject: str, count: int, client: str, kind: str = "quiz", chapter: str = "", terms=()):
+        """
+        Up to `count` questions of this kind the client has not been served:
+        the chapter's own questions first, then the best full-text matches for
+        `terms` within the subject. Returned rows ({"id", "question", "topics"})
+        are marked as served to the client.
+        """
+        subject, chapter = _norm(subject), _norm(chapter)
+        not_served = "q.id NOT IN (SELECT question_id FROM served WHERE client = ?)"
+        with self._lock:
+            rows = []
+            if chapter:
+                rows = self._db.execute(
+                    f"SELECT q.id, q.question, q.topics FROM questions q"
+                    f" WHERE q.subject = ? AND q.kind = ? AND q.chapter = ? AND {not_served}"
+                    f" ORDER BY RANDOM() LIMIT ?",
+                    (subject, kind, chapter, client, count),
+                ).fetchall()
+            terms = [term for term in dict.fromkeys(terms) if term]
+            if len(rows) < count and terms:
+                taken = [row[0] for row in rows]
+                if self.fts:
+                    source, match, order = ("questions_fts f JOIN questions q ON q.id = f.rowid",
+                                            "questions_fts MATCH ?", "bm25(questions_fts)")
+                    match_params, order_params = [_match_query(terms)], []
+                else:
+                    # Most terms found first; the chapter, question JSON and topics stand in for the index
+                    found = " + ".join("(instr(lower(q.chapter || ' ' || q.question || ' ' || q.topics), ?) > 0)"
+                                       for _ in terms)
+                    source, match, order = "questions q", f"{found} > 0", f"{found} DESC"
+                    match_params = order_params = [term.lower() for term in terms]
+                rows += self._db.execute(
+                    f"SELECT q.id, q.question, q.topics FROM {source}"
+                    f" WHERE {match} AND q.subject = ? AND q.kind = ? AND {not_served}"
+                    f" AND q.id NOT IN ({', '.join('?' * len(taken))})"
+                    f" ORDER BY {order} LIMIT ?",
+                    (*match_params, subject, kind, client, *taken, *order_params, count - len(rows)),
+                ).fetchall()
+            self._mark_served(client, [row[0] for row in rows])
+            self._db.commit()
+        self.stats["drawn"] += len(rows)
+        return [{"id": question_id, "question": json.loads(question), "topics": json.loads(topics)}
+                for question_id, question, topics in rows]
+
+    def _mark_served(self, client, ids):
+        now = time.time()
+        self._db.executemany("INSERT OR REPLACE INTO served (client, question_id, served_at) VALUES (?, ?, ?)",
+                             [(client, question_id, now) for question_id in ids])
+
+    def mark_served(self, client: str, ids):
+        with self._lock:
+            self._mark_served(client, ids)
+            self._db.commit()
+
+    def summary(self) -> dict:
+        with self._lock:
+            (questions,) = self._db.execute("SELECT COUNT(*) FROM questions").fetchone()
+        return {"questions": questions, **self.stats}
@@ -0,0 +1,154 @@
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from shared_state import connect
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data: bytes) -> str:
+    """Stable hash of uploaded file bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(endpoint: str, file_hash: str, prompt_version: str, **params) -> str:
+    """Key = endpoint + file hash + request parameters + prompt template version"""
+    payload = json.dumps(
+        {"endpoint": endpoint, "file": file_hash, "version": prompt_version, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache for generated results:
+    - tier 1: in-process LRU bounded by entry count
+    - tier 2: SQLite file with TTL and oldest-first eviction
+    Values must be JSON-serialisable. Disk hits don't write: their access
+    times are kept in memory and written in one batch by the next set(), or
+    by a hit once touch_interval seconds have passed since the last batch.
+    """
+
+    def __init__(self, db_path: str, max_memory_entries: int = 256,
+                 max_disk_entries: int = 5000, ttl_seconds: float = 7 * 24 * 3600,
+                 touch_interval: float = 60.0):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.touch_interval = touch_interval
+        self._memory = OrderedDict()  # key -> (stored_at, value)
+        self._touched = {}  # key -> accessed_at not written yet
+        self._last_touch_flush = time.time()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        self._db = connect(db_path)  # WAL: worker processes share the disk tier
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed_at)")
+        self._db.commit()
+
+    def _remember(self, key, stored_at, value):
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT value, stored_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            value_json, stored_at = row
+            if now - stored_at >= self.ttl_seconds:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._db.commit()
+                self.stats["misses"] += 1
+                return None
+
+            self._touched[key] = now
+            if now - self._last_touch_flush >= self.touch_interval:
+                self._flush_touches(now)
+                self._db.commit()
+            value = json.loads(value_json)
+            self._remember(key, stored_at, value)
+            self.stats["disk_hits"] += 1
+            return value
+
+    def set(self, key: str, value):
+        now = time.time()
+        value_json = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, now, value)
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value_json, now, now),
+            )
+            self._touched.pop(key, None)
+            self.stats["writes"] += 1
+            self._flush_touches(now)  # Before eviction, so it sees what was used
+            self._evict(now)
+            self._db.commit()
+
+    def flush(self):
+        """Write the access times of disk hits not written yet (e.g. on shutdown)"""
+        with self._lock:
+            self._flush_touches(time.time())
+            self._db.commit()
+
+    def _flush_touches(self, now):
+        if self._touched:
+            self._db.executemany("UPDATE results SET accessed_at = ? WHERE key = ?",
+                                 [(accessed_at, key) for key, accessed_at in self._touched.items()])
+            self._touched.clear()
+        self._last_touch_flush = now
+
+    def _evict(self, now):
+        cur = self._db.execute("DELETE FROM results WHERE stored_at < ?", (now - self.ttl_seconds,))
+        removed = cur.rowcount
+        (count,) = self._db.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count > self.max_disk_entries:
+            cur = self._db.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self.max_disk_entries,),
+            )
+            removed += cur.rowcount
+        if removed:
+            self.stats["evictions"] += removed
+            logger.info(f"🧹 Result cache evicted {removed} entries")
+
+    def summary(self) -> dict:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
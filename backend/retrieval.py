@@ -0,0 +1,132 @@
+import re
+import math
+import threading
+from collections import Counter, OrderedDict
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Small English stopword list; enough to keep "the"/"of" from dominating short queries
+STOPWORDS = frozenset("""
+a an and are as at be been but by can chapter do does for from has have how i in into is it its
+of on or our so such than that the their them then there these they this to was we were what
+when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def chunk_text(text: str, chunk_chars: int = 800):
+    """Split text into chunks of about chunk_chars, breaking on line boundaries where possible"""
+    chunks = []
+    current = []
+    size = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        while len(line) > chunk_chars:  # Hard-split very long lines
+            cut = line.rfind(" ", 0, chunk_chars)
+            cut = cut if cut > 0 else chunk_chars
+            if current:
+                chunks.append(" ".join(current))
+                current, size = [], 0
+            chunks.append(line[:cut])
+            line = line[cut:].strip()
+        if size + len(line) > chunk_chars and current:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class Bm25Index:
+    """Okapi BM25 over a list of text chunks (pure Python, built once per document)"""
+
+    def __init__(self, chunks, k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> [(chunk index, term frequency)]
+        self.lengths = []
+        for i, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((i, tf))
+        n = len(chunks)
+        self.avg_length = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def scores(self, query: str):
+        scores = [0.0] * len(self.chunks)
+        if not self.avg_length:
+            return scores
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def select(self, query: str, max_chars: int, separator: str = "\n...\n"):
+        """
+        Best-matching chunks for the query that fit in max_chars, returned in
+        document order. Returns None when nothing in the text matches the query.
+        """
+        scores = self.scores(query)
+        ranked = sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: -scores[i])
+        if not ranked:
+            return None
+        picked = []
+        used = 0
+        for i in ranked:
+            cost = len(self.chunks[i]) + (len(separator) if picked else 0)
+            if used + cost > max_chars:
+                continue
+            picked.append(i)
+            used += cost
+        if not picked:  # Top chunk alone is over budget: send its head
+            return self.chunks[ranked[0]][:max_chars]
+        return separator.join(self.chunks[i] for i in sorted(picked))
+
+
+class ContextSelector:
+    """Keeps one BM25 index per document so repeated queries don't re-chunk the text"""
+
+    def __init__(self, chunk_chars: int = 800, max_documents: int = 32):
+        self.chunk_chars = chunk_chars
+        self.max_documents = max_documents
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index_for(self, doc_key: str, text: str, chunk_chars: int = None) -> Bm25Index:
+        chunk_chars = chunk_chars or self.chunk_chars
+        key = (doc_key, chunk_chars)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = Bm25Index(chunk_text(text, chunk_chars))
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_documents:
+                self._indexes.popitem(last=False)
+        return index
+
+    def select(self, doc_key: str, text: str, query: str, max_chars: int, chunk_chars: int = None) -> str:
+        """Top-ranked text for the query within max_chars; falls back to the start of the text"""
+        if len(text) <= max_chars:
+            return text
+        selected = self.index_for(doc_key, text, chunk_chars).select(query, max_chars)
+        return selected if selected is not None else text[:max_chars]
@@ -0,0 +1,266 @@
+import time
+import math
+import heapq
+import asyncio
+import ipaddress
+import itertools
+import contextvars
+from collections import deque
+
+# Lower number = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Who is asking; set per request by ClientIdMiddleware: "ip" or "ip/X-Client-ID"
+client_id_var = contextvars.ContextVar("client_id", default="anonymous")
+
+
+def fairness_key(client: str) -> str:
+    """Address part of a client id: a caller can't get a fresh fair share by changing its header"""
+    return client.split("/", 1)[0]
+
+
+class Overloaded(Exception):
+    """Work was shed: the queue wait would exceed the allowed maximum"""
+
+    def __init__(self, retry_after: float, reason: str = "Gemini quota is busy"):
+        self.retry_after = max(retry_after, 1.0)
+        super().__init__(f"429 {reason}, retry in {math.ceil(self.retry_after)}s")
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "client", "candidates", "tokens", "future")
+
+    def __init__(self, priority, seq, client, candidates, tokens, future):
+        self.priority = priority
+        self.seq = seq
+        self.client = client
+        self.candidates = candidates
+        self.tokens = tokens
+        self.future = future
+
+
+class QuotaScheduler:
+    """
+    Central admission control in front of the Gemini calls.
+
+    - each model has an RPM bucket and a TPM bucket sized from its limits
+    - callers wait in one queue ordered by priority, then by how many grants
+      their client received recently (fairness), then by arrival
+    - the head of the queue gets the first of its candidate models with
+      room in both buckets; nobody overtakes a blocked head
+    - if the expected wait exceeds max_wait the request is shed with an
+      Overloaded carrying a Retry-After estimate
+
+    bucket_factory(name, rate_per_second, capacity) can supply buckets kept
+    outside the process (shared_state.SharedState.bucket), so that several
+    worker processes draw on the same quota. The queue itself stays local.
+    """
+
+    def __init__(self, limits: dict, default_rpm: float, default_tpm: float, fairness_window: float = 60.0,
+                 bucket_factory=None):
+        self._buckets = {}
+        self._bucket_factory = bucket_factory or (lambda name, rate, capacity: TokenBucket(rate, capacity))
+        self._limits = limits
+        self._default_rpm = default_rpm
+        self._default_tpm = default_tpm
+        self._waiters = []
+        self._seq = itertools.count()
+        self._recent_grants = {}  # fairness_key(client) -> deque of grant times
+        self._fairness_window = fairness_window
+        self._timer = None
+        self.stats = {"granted": 0, "shed": 0, "timed_out": 0, "queued_now": 0}
+
+    def _model_buckets(self, model):
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            limits = self._limits.get(model, {})
+            rpm = float(limits.get("rpm", self._default_rpm))
+            tpm = float(limits.get("tpm", self._default_tpm))
+            buckets = (self._bucket_factory(f"{model}:rpm", rpm / 60.0, max(rpm, 1.0)),
+                       self._bucket_factory(f"{model}:tpm", tpm / 60.0, max(tpm, 1.0)))
+            self._buckets[model] = buckets
+        return buckets
+
+    def _wait_for_model(self, model, tokens, now):
+        requests, token_bucket = self._model_buckets(model)
+        return max(requests.wait_time(1, now), token_bucket.wait_time(tokens, now))
+
+    def _recent(self, client, now):
+        grants = self._recent_grants.get(client)
+        if not grants:
+            return 0
+        while grants and now - grants[0] > self._fairness_window:
+            grants.popleft()
+        return len(grants)
+
+    def _order_key(self, waiter, now):
+        return (waiter.priority, self._recent(waiter.client, now), waiter.seq)
+
+    def estimate_wait(self, candidates, tokens, priority) -> float:
+        """Rough queue wait for a new request: time for its own model plus everyone ahead of it"""
+        now = time.monotonic()
+        own = min((self._wait_for_model(m, tokens, now) for m in candidates), default=math.inf)
+        ahead = sum(1 for w in self._waiters if w.priority <= priority)
+        if not ahead:
+            return own
+        rate = sum(self._model_buckets(m)[0].rate for m in candidates)  # requests per second
+        return own + (ahead / rate if rate > 0 else math.inf)
+
+    async def acquire(self, candidates, tokens: int, priority: int = PRIORITY_BULK,
+                      client: str = None, max_wait: float = 30.0) -> str:
+        """Wait for quota and return the model to call (first usable of `candidates`)"""
+        if not candidates:
+            raise ValueError("No candidate models")
+        client = fairness_key(client or client_id_var.get())
+        expected = self.estimate_wait(candidates, tokens, priority)
+        if expected > max_wait:
+            self.stats["shed"] += 1
+            raise Overloaded(expected)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(priority, next(self._seq), client, list(candidates), tokens, future)
+        self._waiters.append(waiter)
+        self.stats["queued_now"] = len(self._waiters)
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=max_wait)
+        except asyncio.TimeoutError:
+            self.stats["timed_out"] += 1
+            raise Overloaded(self.estimate_wait(candidates, tokens, priority))
+        finally:
+            if not future.done():
+                future.cancel()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self.stats["queued_now"] = len(self._waiters)
+                self._dispatch()
+
+    def try_acquire(self, candidates, tokens: int, priority: int = PRIORITY_BULK, client: str = None):
+        """Take quota only if a candidate has room right now and nobody is queued ahead, else None"""
+        now = time.monotonic()
+        if any(w.priority <= priority for w in self._waiters):
+            return None
+        for model in candidates:
+            if self._wait_for_model(model, tokens, now) == 0:
+                requests, token_bucket = self._model_buckets(model)
+                requests.take(1, now)
+                token_bucket.take(tokens, now)
+                self._recent_grants.setdefault(fairness_key(client or client_id_var.get()), deque()).append(now)
+                self.stats["granted"] += 1
+                return model
+        return None
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        heap = [(self._order_key(w, now), w.seq, w) for w in self._waiters if not w.future.done()]
+        heapq.heapify(heap)
+        while heap:
+            _, _, waiter = heapq.heappop(heap)
+            waits = [(self._wait_for_model(m, waiter.tokens, now), i, m) for i, m in enumerate(waiter.candidates)]
+            wait, _, model = min(waits)
+            if wait > 0:
+                # Head is blocked: wake up when its best model has room again
+                loop = asyncio.get_running_loop()
+                self._timer = loop.call_later(min(wait, 60.0) + 0.001, self._dispatch)
+                break
+            requests, token_bucket = self._model_buckets(model)
+            requests.take(1, now)
+            token_bucket.take(waiter.tokens, now)
+            self._recent_grants.setdefault(waiter.client, deque()).append(now)
+            self._waiters.remove(waiter)
+            self.stats["granted"] += 1
+            waiter.future.set_result(model)
+        self.stats["queued_now"] = len(self._waiters)
+
+    def snapshot(self):
+        now = time.monotonic()
+        models = {}
+        for model, (requests, token_bucket) in self._buckets.items():
+            requests._refill(now)
+            token_bucket._refill(now)
+            models[model] = {
+                "requests_available": round(requests.tokens, 2),
+                "tokens_available": round(token_bucket.tokens),
+            }
+        return {**self.stats, "buckets": models}
+
+
+def _ip(text: str):
+    try:
+        return ipaddress.ip_address(text.strip())
+    except ValueError:
+        return None
+
+
+class ClientIdMiddleware:
+    """
+    ASGI middleware: identify the caller by IP address, with its X-Client-ID
+    header (a device, for the question bank) as a sub-key under the IP.
+    Quota fairness only uses the IP (fairness_key).
+
+    When the peer is one of `trusted_proxies` (addresses or networks, e.g. a
+    reverse proxy), the IP is the nearest untrusted address in its
+    X-Forwarded-For (or X-Real-IP) header; otherwise it is the peer's own.
+    """
+
+    def __init__(self, app, trusted_proxies=()):
+        self.app = app
+        self.trusted_proxies = [ipaddress.ip_network(proxy.strip(), strict=False)
+                                for proxy in trusted_proxies if proxy.strip()]
+
+    def _trusted(self, address) -> bool:
+        return any(address in network for network in self.trusted_proxies)
+
+    def _client_ip(self, headers, peer: str) -> str:
+        address = _ip(peer)
+        if address is None or not self._trusted(address):
+            return peer
+        forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1")
+        hops = [hop for hop in forwarded.split(",") if hop.strip()] \
+            or [headers.get(b"x-real-ip", b"").decode("latin-1")]
+        client = peer
+        for hop in reversed(hops):  # Each proxy appends the address it got the request from
+            address = _ip(hop)
+            if address is None:
+                break
+            client = str(address)
+            if not self._trusted(address):
+                break
+        return client
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope.get("headers") or [])
+            header = headers.get(b"x-client-id", b"").decode("latin-1")[:64]
+            client = scope.get("client")
+            peer = self._client_ip(headers, client[0]) if client else "anonymous"
+            client_id_var.set(f"{peer}/{header}" if header else peer)
+        await self.app(scope, receive, send)
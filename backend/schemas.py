@@ -0,0 +1,161 @@
+"""
+Response models for the JSON endpoints, plus a local repair pass so a slightly
+malformed generation (code fences, trailing commas, output cut off mid-array,
+missing optional fields) is fixed here instead of paying for another call.
+
+    result, repaired = parse_structured(response_text, OfflinePack)  # validated dict
+"""
+import re
+import json
+from typing import List, get_args, get_origin
+
+from pydantic import BaseModel, Field, ValidationError
+
+
+class StructuredOutputError(ValueError):
+    """The model's answer could not be repaired into the expected schema"""
+
+
+# --- RESPONSE MODELS ---
+
+class QuizQuestion(BaseModel):
+    q: str
+    options: List[str]
+    a: str
+    explanation: str = ""
+
+
+class OfflinePack(BaseModel):
+    summary: List[str] = []
+    quiz: List[QuizQuestion] = Field(min_length=1)
+
+
+class PyqQuiz(BaseModel):
+    topics_found: List[str] = []
+    difficulty: str = "Medium"
+    quiz: List[QuizQuestion] = Field(min_length=1)
+
+
+class TopicQuiz(BaseModel):
+    quiz: List[QuizQuestion] = Field(min_length=1)
+
+
+class SyllabusTopic(BaseModel):
+    name: str
+    weight: int = 1
+    subtopics: List[str] = []
+
+
+class SyllabusTopics(BaseModel):
+    topics: List[SyllabusTopic] = Field(min_length=1)
+
+
+# --- REPAIR ---
+
+_DANGLING_KEY_RE = re.compile(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort fix-up of a JSON object embedded in model output: drops code
+    fences and surrounding prose, trailing commas, and closes strings, arrays
+    and objects left open by a truncated answer (dropping a dangling key).
+    """
+    text = text.strip()
+    if "```json" in text:
+        text = text.split("```json", 1)[1]
+    elif text.startswith("```"):
+        text = text[3:]
+    text = text.split("```", 1)[0]
+    start = text.find("{")
+    if start == -1:
+        return text.strip()
+
+    out = []
+    stack = []
+    in_string = escaped = False
+    for ch in text[start:]:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break  # End of the top-level object; ignore trailing prose
+            continue
+        out.append(ch)
+
+    if in_string:
+        out.append('"')
+    repaired = "".join(out).rstrip()
+    if stack:
+        # Truncated: drop a half-written "key": or trailing comma, then close
+        if stack[-1] == "}":
+            repaired = _DANGLING_KEY_RE.sub(lambda m: m.group(1), repaired).rstrip()
+        repaired = repaired.rstrip(",").rstrip().rstrip(":").rstrip()
+        repaired += "".join(reversed(stack))
+    return repaired
+
+
+def _strip_trailing_comma(out):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _drop_invalid_items(data: dict, schema) -> dict:
+    """Remove list entries that don't validate (e.g. a question cut off mid-way)"""
+    cleaned = dict(data)
+    for name, field in schema.model_fields.items():
+        if get_origin(field.annotation) not in (list, List):
+            continue
+        (item_type,) = get_args(field.annotation) or (None,)
+        if not (isinstance(item_type, type) and issubclass(item_type, BaseModel)):
+            continue
+        items = cleaned.get(name)
+        if isinstance(items, list):
+            kept = []
+            for item in items:
+                try:
+                    kept.append(item_type.model_validate(item))
+                except ValidationError:
+                    pass
+            cleaned[name] = kept
+    return cleaned
+
+
+def parse_structured(text: str, schema):
+    """
+    Parse and validate `text` against `schema`, repairing locally if needed.
+    Returns (dict, repaired: bool). Raises StructuredOutputError when the
+    answer is beyond repair and a re-generation is the only option.
+    """
+    try:
+        return schema.model_validate_json(text.strip()).model_dump(), False
+    except ValidationError:
+        pass
+
+    try:
+        data = json.loads(repair_json(text or ""))
+    except ValueError as e:
+        raise StructuredOutputError(f"Unparseable JSON from model: {e}")
+    if not isinstance(data, dict):
+        raise StructuredOutputError(f"Expected a JSON object, got {type(data).__name__}")
+    try:
+        return schema.model_validate(_drop_invalid_items(data, schema)).model_dump(), True
+    except ValidationError as e:
+        raise StructuredOutputError(f"Answer does not match {schema.__name__}: {e.error_count()} errors")
@@ -0,0 +1,135 @@
+"""
+Runs the backend as several worker processes on one port, to use every core.
+
+    python serve.py --workers 4
+    python serve.py --workers 4 --max-requests 5000 --port 8000
+
+The workers share one listening socket. They also share the Gemini quota
+buckets, model cooldowns, chat sessions, result cache and jobs through SQLite
+files in the data directory (see main.py), so N workers do not mean N times
+the 429s.
+
+Workers are recycled: each one exits gracefully (finishing in-flight requests)
+after about --max-requests requests, with jitter so they don't all restart at
+once, and the supervisor starts a replacement. A worker that crashes is
+replaced the same way. Ctrl+C or SIGTERM stops all workers gracefully.
+"""
+import os
+import sys
+import time
+import random
+import signal
+import logging
+import argparse
+import multiprocessing
+
+import uvicorn
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("serve")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESTART_BACKOFF_SECONDS = 1.0  # Minimum time between two starts of the same worker slot
+
+
+def run_worker(sockets, host, port, max_requests, graceful_timeout):
+    """Entry point of a worker process: serve main:app on the inherited socket"""
+    sys.path.insert(0, SCRIPT_DIR)
+    config = uvicorn.Config(
+        "main:app",
+        host=host,
+        port=port,
+        limit_max_requests=max_requests or None,
+        timeout_graceful_shutdown=graceful_timeout,
+    )
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class Supervisor:
+    def __init__(self, workers, host, port, max_requests, max_requests_jitter, graceful_timeout):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.config = uvicorn.Config("main:app", host=host, port=port)
+        self.sockets = []
+        self.slots = []  # [(process, started_at)]
+        self.stopping = False
+        self.restarts = 0
+
+    def _start(self, slot):
+        max_requests = self.max_requests
+        if max_requests:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.sockets, self.host, self.port, max_requests, self.graceful_timeout),
+            name=f"worker-{slot}",
+        )
+        process.start()
+        logger.info(f"👷 Worker {slot} started (pid {process.pid}, recycles after {max_requests or '∞'} requests)")
+        return process, time.monotonic()
+
+    def _stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        # Children read this on import: more than one worker switches on the shared state
+        os.environ["WORKERS"] = str(self.workers)
+        self.sockets = [self.config.bind_socket()]
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        self.slots = [self._start(slot) for slot in range(self.workers)]
+        logger.info(f"🚀 Serving on http://{self.host}:{self.port} with {self.workers} workers")
+        try:
+            while not self.stopping:
+                time.sleep(0.5)
+                for slot, (process, started_at) in enumerate(self.slots):
+                    if process.is_alive() or self.stopping:
+                        continue
+                    if time.monotonic() - started_at < RESTART_BACKOFF_SECONDS:
+                        continue  # Crashing on start: don't spin
+                    logger.info(f"♻️ Worker {slot} (pid {process.pid}) exited with {process.exitcode}, replacing it")
+                    self.restarts += 1
+                    self.slots[slot] = self._start(slot)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        logger.info("🛑 Stopping workers")
+        for process, _ in self.slots:
+            if process.is_alive():
+                process.terminate()  # SIGTERM: uvicorn finishes in-flight requests
+        deadline = time.monotonic() + (self.graceful_timeout or 30) + 5
+        for process, _ in self.slots:
+            process.join(max(deadline - time.monotonic(), 0.1))
+            if process.is_alive():
+                logger.warning(f"⚠️ Worker pid {process.pid} did not stop in time, killing it")
+                process.kill()
+                process.join()
+        for sock in self.sockets:
+            sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend with several worker processes")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("WORKER_MAX_REQUESTS", "0")),
+                        help="Recycle a worker after this many requests (0 = never)")
+    parser.add_argument("--max-requests-jitter", type=int,
+                        default=int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "0")),
+                        help="Random extra requests per worker, so workers don't recycle together")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30")),
+                        help="Seconds a stopping worker gets to finish in-flight requests")
+    args = parser.parse_args()
+    jitter = args.max_requests_jitter or args.max_requests // 10
+    Supervisor(max(args.workers, 1), args.host, args.port, args.max_requests, jitter, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    main()
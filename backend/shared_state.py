@@ -0,0 +1,112 @@
+"""
+State shared by the worker processes of one server (see serve.py), kept in a
+local SQLite file in WAL mode: no external service, and every process on the
+box sees the same quota buckets and model cooldowns.
+
+Times are stored as wall-clock seconds because monotonic clocks are not
+guaranteed to agree between processes.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """SQLite connection that tolerates other processes using the same file"""
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    db = sqlite3.connect(db_path, check_same_thread=False, timeout=10.0)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class SharedState:
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._db = connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " name TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cooldowns ("
+            " model TEXT PRIMARY KEY,"
+            " until REAL NOT NULL,"
+            " strikes INTEGER NOT NULL)"
+        )
+        self._db.commit()
+
+    # --- token buckets ---
+
+    def bucket_tokens(self, name: str, rate: float, capacity: float) -> float:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return capacity
+        tokens, updated = row
+        return min(capacity, tokens + max(now - updated, 0.0) * rate)
+
+    def bucket_take(self, name: str, rate: float, capacity: float, amount: float):
+        """Refill and take in one statement, so concurrent takers never lose an update"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET"
+                " tokens = MIN(?, tokens + MAX(? - updated, 0) * ?) - ?, updated = ?",
+                (name, capacity - amount, now, capacity, now, rate, amount, now),
+            )
+            self._db.commit()
+
+    def bucket(self, name: str, rate_per_second: float, capacity: float) -> "SharedTokenBucket":
+        return SharedTokenBucket(self, name, rate_per_second, capacity)
+
+    # --- model cooldowns ---
+
+    def set_cooldown(self, model: str, seconds: float, strikes: int):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cooldowns (model, until, strikes) VALUES (?, ?, ?)",
+                (model, time.time() + seconds, strikes),
+            )
+            self._db.commit()
+
+    def clear_cooldown(self, model: str):
+        with self._lock:
+            self._db.execute("DELETE FROM cooldowns WHERE model = ?", (model,))
+            self._db.commit()
+
+    def cooldowns(self) -> dict:
+        """model -> (seconds of cooldown remaining, negative once over; quota strikes)"""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute("SELECT model, until, strikes FROM cooldowns").fetchall()
+        return {model: (until - now, strikes) for model, until, strikes in rows}
+
+
+class SharedTokenBucket:
+    """scheduler.TokenBucket with its level in SharedState; `now` arguments are ignored"""
+
+    def __init__(self, state: SharedState, name: str, rate_per_second: float, capacity: float):
+        self.state = state
+        self.name = name
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+
+    def _refill(self, now=None):
+        self.tokens = self.state.bucket_tokens(self.name, self.rate, self.capacity)
+
+    def wait_time(self, amount, now=None) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount, now=None):
+        self.state.bucket_take(self.name, self.rate, self.capacity, min(amount, self.capacity))
@@ -0,0 +1,61 @@
+import asyncio
+import hashlib
+import json
+
+
+def request_key(*parts, **params) -> str:
+    """Normalised key for coalescing: case- and whitespace-insensitive for text parts"""
+    normalised = [" ".join(str(p).lower().split()) for p in parts]
+    payload = json.dumps({"parts": normalised, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical work: the first caller for a key starts the
+    generation, later callers with the same key await the same task.
+
+    Results and errors are only shared with callers that were waiting while the
+    task ran; the key is forgotten as soon as it finishes, so a failure is never
+    handed to later requests. The task is cancelled only when every waiter has
+    gone away (e.g. all clients disconnected).
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.stats = {"leaders": 0, "followers": 0, "in_flight": 0}
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        self.stats["in_flight"] = len(self._flights)
+        if not flight.task.cancelled():
+            flight.task.exception()  # Mark as retrieved even if every waiter left
+
+    async def run(self, key: str, factory):
+        """Await factory() once per key among concurrent callers"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._forget(key, flight))
+            self.stats["leaders"] += 1
+            self.stats["in_flight"] = len(self._flights)
+        else:
+            self.stats["followers"] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
@@ -0,0 +1,88 @@
+"""Offline pack store: versions, delta sync and eviction (pack_store.py)"""
+import gzip
+import json
+
+import pack_store
+from pack_store import PackStore, make_pack_id
+
+PACK = {"summary": ["Light bends"], "quiz": [{"q": "Q1", "options": ["a", "b"], "a": "a"}]}
+
+
+def store(tmp_path, **kwargs):
+    return PackStore(str(tmp_path / "packs.sqlite3"), "3", **kwargs)
+
+
+class Clock:
+    """Stands in for time.time in pack_store, so access order doesn't depend on clock resolution"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+def test_put_stores_body_and_gzip(tmp_path):
+    packs = store(tmp_path)
+    pack_id = make_pack_id("doc", "Physics", "Optics")
+    entry = packs.put(pack_id, "Physics", "Optics", PACK)
+    body = json.loads(entry["body"])
+    assert body["pack_id"] == pack_id and body["version"] == entry["version"]
+    assert entry["etag"] == f'"{entry["version"]}"'
+    assert gzip.decompress(entry["gzip"]) == entry["body"]
+    assert packs.get(pack_id)["version"] == entry["version"]
+    assert packs.get("unknown") is None
+
+
+def test_version_follows_content_and_prompt_version(tmp_path):
+    packs = store(tmp_path)
+    first = packs.put("p1", "Physics", "Optics", PACK)
+    assert packs.put("p1", "Physics", "Optics", dict(PACK))["version"] == first["version"]
+    assert packs.stats == {"writes": 1, "unchanged": 1, "evictions": 0}
+    assert packs.put("p1", "Physics", "Optics", {**PACK, "summary": ["New"]})["version"] != first["version"]
+    assert PackStore(str(tmp_path / "other.sqlite3"), "4").put("p1", "Physics", "Optics", PACK)["version"] \
+        != first["version"]
+
+
+def test_changed_returns_only_what_the_client_lacks(tmp_path):
+    packs = store(tmp_path)
+    current = packs.put("same", "Physics", "Optics", PACK)["version"]
+    packs.put("stale", "Physics", "Waves", PACK)
+    changed, missing, unchanged = packs.changed({"same": current, "stale": "old-version", "gone": "v"})
+    assert [json.loads(body)["pack_id"] for body in changed] == ["stale"]
+    assert missing == ["gone"]
+    assert unchanged == 1
+
+
+def test_least_recently_used_packs_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(pack_store.time, "time", Clock())
+    packs = store(tmp_path, max_packs=2)
+    packs.put("a", "Physics", "A", PACK)
+    packs.put("b", "Physics", "B", PACK)
+    packs.get("a")  # Used again: "b" is now the oldest
+    packs.put("c", "Physics", "C", PACK)
+    assert packs.get("b") is None
+    assert packs.get("a") is not None and packs.get("c") is not None
+    assert packs.summary()["packs"] == 2
+
+
+def test_packs_expire(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pack_store.time, "time", clock)
+    packs = store(tmp_path, ttl_seconds=3600)
+    packs.put("a", "Physics", "A", PACK)
+    clock.now += 7200
+    packs.put("b", "Physics", "B", PACK)
+    assert packs.get("a") is None
+    assert packs.stats["evictions"] == 1
+
+
+def test_expired_packs_are_missing_before_the_next_write(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pack_store.time, "time", clock)
+    packs = store(tmp_path, ttl_seconds=3600)
+    version = packs.put("a", "Physics", "A", PACK)["version"]
+    clock.now += 7200  # No put since: nothing has evicted the row
+    assert packs.get("a") is None
+    assert packs.changed({"a": version}) == ([], ["a"], 0)
@@ -0,0 +1,112 @@
+"""Local study planner: timetable parsing, scheduling and re-planning (planner.py)"""
+import datetime
+
+from planner import (DEFAULT_DAILY_MINUTES, DEFAULT_STUDY_WINDOW, FULL_REVISION, MIN_SESSION_MINUTES, MISSED_DAY,
+                     build_plan, parse_timetable, replan, _capacities, _schedule)
+
+MONDAY = datetime.date(2026, 1, 5)
+TOPICS = [{"name": f"Topic {i}", "weight": 2, "subtopics": [f"Part {i}.{j}" for j in range(3)]} for i in range(1, 7)]
+
+
+def hours(start, end):
+    return (start * 60, end * 60)
+
+
+# --- parse_timetable ---
+
+def test_free_lines_become_slots_on_their_days():
+    slots = parse_timetable("Mon 5-7pm free\nSat 10am-1pm study")
+    assert slots[0] == [hours(17, 19)]
+    assert slots[5] == [hours(10, 13)]
+    assert slots[2] == []
+
+
+def test_bare_ranges():
+    slots = parse_timetable("Daily 5-7\nSun 12-2")
+    assert slots[1] == [hours(17, 19)]  # Bare evening hours
+    assert slots[6] == [hours(12, 14), hours(17, 19)]  # "12-2" is 12:00-14:00, not dropped
+
+
+def test_busy_lines_are_cut_out_of_the_evening_window():
+    slots = parse_timetable("Weekdays tuition 6-7pm")
+    assert slots[0] == [(DEFAULT_STUDY_WINDOW[0], 18 * 60), (19 * 60, DEFAULT_STUDY_WINDOW[1])]
+    assert slots[6] == [DEFAULT_STUDY_WINDOW]
+
+
+def test_busy_time_inside_a_free_slot_is_removed():
+    slots = parse_timetable("Sat 9am-5pm free\nSat lunch 1-2pm")
+    assert slots[5] == [hours(9, 13), hours(14, 17)]
+
+
+def test_no_timetable_gives_a_default_daily_slot():
+    slots = parse_timetable("")
+    start = DEFAULT_STUDY_WINDOW[0]
+    assert all(ranges == [(start, start + DEFAULT_DAILY_MINUTES)] for ranges in slots.values())
+
+
+# --- _schedule ---
+
+def work(minutes):
+    return [{"name": f"Topic {i}", "subtopics": [], "minutes": m} for i, m in enumerate(minutes, 1)]
+
+
+def test_schedule_fills_exactly_the_requested_days():
+    capacities = _capacities(parse_timetable("Daily 5-7pm free"), 10, MONDAY)
+    plan_days, unscheduled = _schedule(work([120, 90, 60]), capacities, first_day=3)
+    assert [day["day"] for day in plan_days] == list(range(3, 13))
+    assert [day["date"] for day in plan_days] == [c["date"] for c in capacities]
+    assert unscheduled == []
+
+
+def test_schedule_never_exceeds_a_days_capacity():
+    capacities = _capacities(parse_timetable("Weekdays 5-6pm free\nSat 10am-1pm free"), 14, MONDAY)
+    plan_days, _ = _schedule(work([200, 150, 100, 80]), capacities)
+    for day, capacity in zip(plan_days, capacities):
+        assert sum(s["minutes"] for s in day["sessions"]) <= capacity["minutes"]
+        assert all(s["minutes"] >= MIN_SESSION_MINUTES for s in day["sessions"] if s["kind"] == "learn")
+    assert [s["kind"] for s in plan_days[6]["sessions"]] == []  # Sunday has no slot
+
+
+def test_last_day_is_kept_for_full_revision_and_reviews_follow():
+    capacities = _capacities(parse_timetable("Daily 5-7pm free"), 8, MONDAY)
+    plan_days, _ = _schedule(work([120]), capacities)
+    assert plan_days[-1]["topic"] == FULL_REVISION
+    assert all(s["kind"] == "revise" for s in plan_days[-1]["sessions"])
+    assert plan_days[1]["subtopics"] == ["Revise: Topic 1"]  # Finished on day 1, reviewed a day later
+
+
+def test_work_beyond_the_plan_is_reported_unscheduled():
+    capacities = _capacities(parse_timetable("Daily 5-6pm free"), 2, MONDAY)
+    _, unscheduled = _schedule(work([60, 60, 60]), capacities)
+    assert sum(item["minutes"] for item in unscheduled) > 0
+
+
+# --- replan ---
+
+def learned(days):
+    return [s["topic"] for day in days for s in day["sessions"] if s["kind"] == "learn"]
+
+
+def test_replan_moves_missed_learning_without_duplicates():
+    plan = build_plan("Physics", TOPICS, parse_timetable("Daily 5-7pm free"), days=10, start_date=MONDAY)
+    missed_topics = set(learned(plan["days"][:1]))
+    new = replan(plan, from_day=3, missed_days=[1], start_date=MONDAY + datetime.timedelta(days=2))
+
+    assert [day["day"] for day in new["days"]] == list(range(1, 11))
+    missed = new["days"][0]
+    assert missed["missed"] and learned([missed]) == []
+    assert missed["topic"] == MISSED_DAY
+    assert new["days"][1] == plan["days"][1]  # Day 2 was done: kept as it was
+    assert missed_topics <= set(learned(new["days"][2:]))  # Learned again after from_day
+
+
+def test_replan_keeps_the_total_learning_time():
+    plan = build_plan("Physics", TOPICS[:3], parse_timetable("Daily 5-8pm free"), days=12, start_date=MONDAY)
+    new = replan(plan, from_day=4, missed_days=[2, 3], start_date=MONDAY + datetime.timedelta(days=3))
+
+    def minutes(days):
+        return sum(s["minutes"] for day in days for s in day["sessions"] if s["kind"] == "learn")
+
+    done = minutes(plan["days"][:1])
+    assert done + minutes(new["days"][3:]) + sum(i["minutes"] for i in new["unscheduled"]) \
+        == minutes(plan["days"]) + sum(i["minutes"] for i in plan["unscheduled"])
@@ -0,0 +1,66 @@
+"""Question bank: near-duplicate detection, serving and search (question_bank.py)"""
+import question_bank
+from question_bank import QuestionBank
+
+CURRENT = {"q": "Which SI unit is used to measure electric current?", "options": ["Volt", "Ampere"], "a": "Ampere"}
+REWORDED = {"q": "which SI unit is used to measure the electric current", "options": ["Ampere", "Ohm"], "a": "Ampere"}
+LENS = {"q": "What kind of image does a convex lens form of a distant object?", "options": ["Real", "Virtual"],
+        "a": "Real"}
+MIRROR = {"q": "What is the focal length of a plane mirror?", "options": ["Zero", "Infinite"], "a": "Infinite"}
+
+
+def bank(tmp_path):
+    return QuestionBank(str(tmp_path / "bank.sqlite3"))
+
+
+def drawn(rows):
+    return [row["question"]["q"] for row in rows]
+
+
+def test_reworded_duplicate_is_rejected(tmp_path):
+    questions = bank(tmp_path)
+    first = questions.add([CURRENT, LENS], "Physics", chapter="Electricity")
+    again = questions.add([REWORDED], "physics", chapter="Magnetism")
+    assert again == first[:1]  # The existing question's id
+    assert questions.stats["duplicates"] == 1
+    assert questions.summary()["questions"] == 2
+
+    other_subject = questions.add([REWORDED], "Chemistry")
+    assert other_subject[0] not in first
+
+
+def test_drawn_questions_are_not_served_again(tmp_path):
+    questions = bank(tmp_path)
+    questions.add([CURRENT, LENS, MIRROR], "Physics", chapter="Mixed", kind="prerequisite")
+    first = questions.draw("Physics", 2, "client-1", kind="prerequisite", chapter="Mixed")
+    second = questions.draw("Physics", 2, "client-1", kind="prerequisite", chapter="Mixed")
+    assert len(first) == 2 and len(second) == 1
+    assert not set(drawn(first)) & set(drawn(second))
+    assert questions.draw("Physics", 2, "client-1", kind="prerequisite", chapter="Mixed") == []
+    assert len(questions.draw("Physics", 3, "client-2", kind="prerequisite", chapter="Mixed")) == 3
+    assert questions.draw("Physics", 3, "client-1", kind="pyq", chapter="Mixed") == []  # Other kind
+
+
+def check_term_search(questions):
+    questions.add([CURRENT], "Physics", kind="pyq", topics=["Electricity"])
+    questions.add([LENS, MIRROR], "Physics", chapter="Optics", kind="pyq", topics=["Light"])
+    assert drawn(questions.draw("Physics", 1, "client-1", kind="pyq", terms=["lens", "current"])) \
+        in ([LENS["q"]], [CURRENT["q"]])
+    rows = questions.draw("Physics", 5, "client-2", kind="pyq", terms=["mirror", "optics"])
+    assert drawn(rows)[0] == MIRROR["q"]  # Matches both terms
+    assert set(drawn(rows)) == {MIRROR["q"], LENS["q"]}
+    assert questions.draw("Physics", 5, "client-3", kind="pyq", terms=["entropy"]) == []
+
+
+def test_term_search(tmp_path):
+    questions = bank(tmp_path)
+    assert questions.fts
+    check_term_search(questions)
+
+
+def test_term_search_without_fts5(tmp_path, monkeypatch):
+    monkeypatch.setattr(question_bank, "FTS_SCHEMA",
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING no_such_module(text, topics)")
+    questions = bank(tmp_path)
+    assert not questions.fts
+    check_term_search(questions)
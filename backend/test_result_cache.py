@@ -0,0 +1,64 @@
+"""Two-tier result cache: disk hits and their batched access times (result_cache.py)"""
+import result_cache
+from result_cache import ResultCache
+
+
+class Clock:
+    """Stands in for time.time in result_cache"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def accessed_at(cache, key):
+    return cache._db.execute("SELECT accessed_at FROM results WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_disk_hits_do_not_write_until_a_batch_is_due(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, "time", clock)
+    path = str(tmp_path / "cache.sqlite3")
+    ResultCache(path).set("a", {"answer": 1})
+
+    cache = ResultCache(path, touch_interval=60)  # Cold memory tier: hits come from disk
+    clock.now += 10
+    assert cache.get("a") == {"answer": 1}
+    assert cache.stats["disk_hits"] == 1
+    assert accessed_at(cache, "a") == 1_000_000.0
+
+    cache._memory.clear()
+    clock.now += 60
+    cache.get("a")  # A minute since the last batch: written now
+    assert accessed_at(cache, "a") == clock.now
+
+
+def test_set_writes_pending_access_times_before_evicting(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, "time", clock)
+    path = str(tmp_path / "cache.sqlite3")
+    writer = ResultCache(path)
+    writer.set("old", 1)
+    clock.now += 1
+    writer.set("newer", 2)
+
+    cache = ResultCache(path, max_memory_entries=0, max_disk_entries=2, touch_interval=3600)
+    clock.now += 1
+    assert cache.get("old") == 1  # Now the most recently used
+    clock.now += 1
+    cache.set("third", 3)
+    assert cache.get("newer") is None
+    assert cache.get("old") == 1 and cache.get("third") == 3
+
+
+def test_flush_writes_pending_access_times(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, "time", clock)
+    cache = ResultCache(str(tmp_path / "cache.sqlite3"), max_memory_entries=0, touch_interval=3600)
+    cache.set("a", 1)
+    clock.now += 5
+    cache.get("a")
+    cache.flush()
+    assert accessed_at(cache, "a") == clock.now
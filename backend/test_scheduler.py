@@ -0,0 +1,107 @@
+"""Quota admission control: priority, fairness and shedding (scheduler.py)"""
+import asyncio
+
+import pytest
+
+from scheduler import (PRIORITY_BULK, PRIORITY_INTERACTIVE, ClientIdMiddleware, Overloaded, QuotaScheduler,
+                       client_id_var, fairness_key)
+
+MODEL = "model-a"
+
+
+def drained_scheduler(rpm, heavy_client, heavy_grants):
+    """Scheduler whose single model has no requests left, the last ones granted to `heavy_client`"""
+    scheduler = QuotaScheduler({MODEL: {"rpm": rpm, "tpm": 10_000_000}}, default_rpm=rpm, default_tpm=10_000_000)
+    for _ in range(heavy_grants):
+        assert scheduler.try_acquire([MODEL], 10, client=heavy_client) == MODEL
+    assert scheduler.try_acquire([MODEL], 10, client=heavy_client) is None
+    return scheduler
+
+
+async def served_order(scheduler, requests):
+    """Queue (label, priority, client) requests in order; labels in the order they were granted"""
+    order = []
+
+    async def ask(label, priority, client):
+        await scheduler.acquire([MODEL], 10, priority, client=client)
+        order.append(label)
+
+    tasks = []
+    for label, priority, client in requests:
+        tasks.append(asyncio.ensure_future(ask(label, priority, client)))
+        await asyncio.sleep(0)  # Arrive in this order
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_fairness_key_ignores_the_client_header():
+    assert fairness_key("10.0.0.1/device-1") == fairness_key("10.0.0.1/device-2") == "10.0.0.1"
+    assert fairness_key("10.0.0.1") == "10.0.0.1"
+
+
+def client_id(peer, headers=(), trusted_proxies=()):
+    """Client id ClientIdMiddleware sets for a request from `peer` with these headers"""
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(client_id_var.get())
+
+    scope = {"type": "http", "client": (peer, 50000),
+             "headers": [(name.encode(), value.encode()) for name, value in headers]}
+    asyncio.run(ClientIdMiddleware(app, trusted_proxies=trusted_proxies)(scope, None, None))
+    return seen[0]
+
+
+def test_client_id_is_the_peer_address_by_default():
+    assert client_id("203.0.113.7", [("x-client-id", "device-1")]) == "203.0.113.7/device-1"
+    assert client_id("203.0.113.7", [("x-forwarded-for", "198.51.100.1")]) == "203.0.113.7"  # Not a proxy
+
+
+def test_client_behind_a_trusted_proxy_is_keyed_on_its_forwarded_address():
+    proxies = ["10.0.0.0/8", "192.0.2.1"]
+    assert client_id("10.0.0.2", [("x-forwarded-for", "198.51.100.1")], proxies) == "198.51.100.1"
+    assert client_id("10.0.0.2", [("x-real-ip", "198.51.100.2")], proxies) == "198.51.100.2"
+    # Spoofed entries left of the nearest untrusted address are ignored; trusted hops are skipped
+    assert client_id("10.0.0.2", [("x-forwarded-for", "1.2.3.4, 198.51.100.1, 192.0.2.1")], proxies) \
+        == "198.51.100.1"
+    assert client_id("10.0.0.2", [("x-forwarded-for", "not-an-ip")], proxies) == "10.0.0.2"
+    assert client_id("10.0.0.2", [], proxies) == "10.0.0.2"
+
+
+def test_least_served_client_goes_first():
+    scheduler = drained_scheduler(600, "10.0.0.1", 600)  # 10 requests a second once drained
+    order = asyncio.run(served_order(scheduler, [
+        ("heavy", PRIORITY_BULK, "10.0.0.1"),
+        ("light", PRIORITY_BULK, "10.0.0.2"),
+    ]))
+    assert order == ["light", "heavy"]
+
+
+def test_new_client_header_does_not_buy_a_fresh_share():
+    scheduler = drained_scheduler(600, "10.0.0.1/device-1", 600)
+    order = asyncio.run(served_order(scheduler, [
+        ("rotated", PRIORITY_BULK, "10.0.0.1/device-2"),
+        ("light", PRIORITY_BULK, "10.0.0.2/device-1"),
+    ]))
+    assert order == ["light", "rotated"]
+
+
+def test_interactive_requests_overtake_bulk():
+    scheduler = drained_scheduler(600, "10.0.0.9", 600)
+    order = asyncio.run(served_order(scheduler, [
+        ("bulk", PRIORITY_BULK, "10.0.0.1"),
+        ("interactive", PRIORITY_INTERACTIVE, "10.0.0.9"),
+    ]))
+    assert order == ["interactive", "bulk"]
+
+
+def test_request_is_shed_when_the_wait_is_too_long():
+    scheduler = drained_scheduler(6, "10.0.0.1", 6)  # Next request in 10 seconds
+
+    async def ask():
+        await scheduler.acquire([MODEL], 10, PRIORITY_BULK, client="10.0.0.2", max_wait=1.0)
+
+    with pytest.raises(Overloaded) as shed:
+        asyncio.run(ask())
+    assert shed.value.retry_after > 1.0
+    assert scheduler.stats["shed"] == 1
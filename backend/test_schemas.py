@@ -0,0 +1,41 @@
+"""Local repair and validation of the model's JSON answers (schemas.py)"""
+import json
+
+import pytest
+
+from schemas import OfflinePack, PyqQuiz, StructuredOutputError, parse_structured, repair_json
+
+QUESTION = {"q": "What is refraction?", "options": ["Bending", "Reflection"], "a": "Bending"}
+
+
+def test_valid_answer_is_not_repaired():
+    result, repaired = parse_structured(json.dumps({"summary": ["Light bends"], "quiz": [QUESTION]}), OfflinePack)
+    assert not repaired
+    assert result["quiz"][0]["q"] == "What is refraction?"
+    assert result["quiz"][0]["explanation"] == ""
+
+
+def test_repair_strips_fences_prose_and_trailing_commas():
+    text = 'Here you go:\n```json\n{"summary": ["a", "b",], "quiz": [{"q": "Q", "options": ["x"], "a": "x",},],}\n```'
+    assert json.loads(repair_json(text)) == {"summary": ["a", "b"], "quiz": [{"q": "Q", "options": ["x"], "a": "x"}]}
+
+
+def test_repair_closes_a_truncated_answer():
+    text = '{"summary": ["Light bends"], "quiz": [{"q": "Q1", "options": ["x", "y"], "a": "x"}, {"q": "Q2", "opt'
+    data = json.loads(repair_json(text))
+    assert data["summary"] == ["Light bends"]
+    assert data["quiz"][0]["q"] == "Q1"
+
+
+def test_truncated_question_is_dropped():
+    text = json.dumps({"quiz": [QUESTION]})[:-2] + ', {"q": "Cut off", "options": ["a"'
+    result, repaired = parse_structured(text, PyqQuiz)
+    assert repaired
+    assert [q["q"] for q in result["quiz"]] == ["What is refraction?"]
+    assert result["difficulty"] == "Medium"
+
+
+@pytest.mark.parametrize("text", ["", "no json here", "[1, 2, 3]", '{"summary": ["only a summary"]}'])
+def test_answer_beyond_repair_raises(text):
+    with pytest.raises(StructuredOutputError):
+        parse_structured(text, OfflinePack)
@@ -0,0 +1,140 @@
+"""
+Cold-start regression test for the backend.
+
+Starts the app in a fresh interpreter and checks that:
+- `import main` stays under the time budget and loads none of the heavy
+  modules (google.genai, numpy, fitz): they belong to the warm-up
+- without GEMINI_API_KEY the app still boots in degraded mode: /health is
+  up, /ready reports "degraded", AI-only endpoints answer 503 and offline
+  packs fall back to the local quiz
+- with a key, the warm-up creates the Gemini client and /ready turns 200
+
+No network is used (the dummy key is never sent anywhere).
+
+    python -m pytest -q test_startup.py
+    STARTUP_BUDGET_SECONDS=0.8 STARTUP_RUNS=5 python -m pytest -q test_startup.py
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+import pytest
+
+pytest.importorskip("httpx")  # fastapi.testclient
+pytest.importorskip("fitz")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ("google.genai", "numpy", "fitz")
+BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "1.5"))  # For `import main`, best of STARTUP_RUNS
+RUNS = int(os.getenv("STARTUP_RUNS", "3"))
+
+# Runs in the fresh interpreter; prints one JSON line of measurements
+CHILD = r"""
+import sys, time, json
+started = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - started
+heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+
+from fastapi.testclient import TestClient
+out = {"import_seconds": import_seconds, "heavy_at_import": heavy}
+with TestClient(main.app) as http:
+    out["health"] = http.get("/health").status_code
+    deadline = time.perf_counter() + 60
+    while True:
+        ready = http.get("/ready")
+        if ready.status_code == 200 or time.perf_counter() > deadline:
+            break
+        time.sleep(0.05)
+    out["ready_status"] = ready.status_code
+    out["ready"] = ready.json()
+    out["genai_loaded"] = "google.genai" in sys.modules
+    if CHECK_ENDPOINTS:
+        import fitz
+        doc = fitz.open()
+        text = (
+            "Entropy is a measure of the disorder of a thermodynamic system and increases in spontaneous processes. "
+            "Enthalpy is the heat content of a system at constant pressure and is written as H. "
+            "The first law of thermodynamics states that energy is conserved when heat and work are exchanged. "
+            "The second law of thermodynamics states that heat flows from hot bodies to cold bodies on its own. "
+            "A heat engine converts thermal energy into mechanical work and always rejects some heat to a sink. "
+            "The efficiency of a Carnot engine depends only on the temperatures of the hot and cold reservoirs. "
+            "An isothermal process keeps the temperature of the gas constant while its volume and pressure change. "
+            "An adiabatic process exchanges no heat with the surroundings, so the work changes the internal energy. "
+            "Specific heat capacity is the heat needed to raise the temperature of one kilogram by one kelvin. "
+            "Internal energy of an ideal gas depends only on its temperature and not on its volume or pressure. "
+            "A refrigerator uses work to move heat from a cold reservoir to a hot reservoir against its natural flow. "
+            "Thermal equilibrium is reached when two bodies in contact stop exchanging heat and share one temperature. "
+        )
+        doc.new_page().insert_textbox(fitz.Rect(40, 40, 560, 800), text, fontsize=10)
+        pdf = doc.tobytes()
+        files = {"file": ("notes.pdf", pdf, "application/pdf")}
+        pyq = http.post("/generate-pyq-quiz", data={"subject": "Physics"}, files=files)
+        out["pyq_status"] = pyq.status_code
+        pack = http.post("/generate-offline-pack", data={"subject": "Physics", "chapter": "Thermodynamics"},
+                         files=files)
+        out["pack_status"] = pack.status_code
+        out["pack_cache"] = pack.headers.get("X-Cache")
+print(json.dumps(out))
+"""
+
+
+def run_child(api_key: str, check_endpoints: bool) -> dict:
+    env = dict(os.environ)
+    env["GEMINI_API_KEY"] = api_key  # Empty also keeps .env.local from supplying one
+    env["ENWISE_DATA_DIR"] = tempfile.mkdtemp(prefix="enwise-startup-")
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\nCHECK_ENDPOINTS = {check_endpoints!r}\n{CHILD}"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=SCRIPT_DIR, env=env,
+                          capture_output=True, text=True, timeout=180)
+    assert proc.returncode == 0, f"Child interpreter failed:\n{proc.stderr[-3000:]}"
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope="module")
+def degraded_runs():
+    """Starts without GEMINI_API_KEY; the first run also exercises the endpoints"""
+    return [run_child("", check_endpoints=(i == 0)) for i in range(max(RUNS, 1))]
+
+
+@pytest.fixture(scope="module")
+def degraded(degraded_runs):
+    return degraded_runs[0]
+
+
+@pytest.fixture(scope="module")
+def full():
+    """Starts with a dummy key (never sent anywhere)"""
+    return run_child("startup-test-key", check_endpoints=False)
+
+
+def test_import_is_within_budget(degraded_runs):
+    best = min(run["import_seconds"] for run in degraded_runs)
+    assert best <= BUDGET_SECONDS, f"import main: {best:.3f}s (best of {len(degraded_runs)})"
+
+
+def test_no_heavy_modules_at_import(degraded, full):
+    assert degraded["heavy_at_import"] == []
+    assert full["heavy_at_import"] == []
+
+
+def test_degraded_start_is_up_and_ready(degraded):
+    assert degraded["health"] == 200
+    assert degraded["ready_status"] == 200
+    assert degraded["ready"]["mode"] == "degraded"
+
+
+def test_degraded_start_answers_503_for_ai_endpoints(degraded):
+    assert degraded["pyq_status"] == 503
+
+
+def test_degraded_offline_pack_falls_back_to_local_quiz(degraded):
+    assert degraded["pack_status"] == 200
+    assert degraded["pack_cache"] == "LOCAL"
+
+
+def test_full_start_creates_the_client_in_the_warm_up(full):
+    assert full["ready_status"] == 200
+    assert full["ready"]["ai"] == "ready"
+    assert full["genai_loaded"]
@@ -0,0 +1,64 @@
+"""Compaction of extracted PDF page text (text_compaction.py)"""
+from text_compaction import compact_pages
+
+BODY = [
+    "Refraction is the bending of light as it passes from one medium into another medium.",
+    "Snell's law relates the angles of incidence and refraction to the refractive indices.",
+    "A convex lens converges parallel rays of light to a single point called the focus.",
+    "Total internal reflection happens when light meets a boundary beyond the critical angle.",
+    "The power of a lens is the reciprocal of its focal length measured in metres.",
+]
+
+
+def page(number, body):
+    return f"Physics Class 10 | Chapter {number}\n{body}\nMore text about {body.split()[0].lower()} follows here.\n{number}"
+
+
+def test_headers_and_page_numbers_are_removed():
+    pages, stats, boilerplate = compact_pages([page(i + 1, body) for i, body in enumerate(BODY)])
+    assert all("Physics Class 10" not in text for text in pages)
+    assert all(body in text for body, text in zip(BODY, pages))
+    assert stats["header_footer_lines"] == len(BODY)
+    assert stats["page_numbers"] == len(BODY)
+    assert stats["chars_out"] < stats["chars_in"]
+    assert "physics class # | chapter #" in boilerplate
+
+
+def test_headers_found_earlier_are_removed_from_a_small_batch():
+    _, _, boilerplate = compact_pages([page(i + 1, body) for i, body in enumerate(BODY)])
+    pages, stats, _ = compact_pages([page(42, BODY[0])], boilerplate=boilerplate)
+    assert "Physics Class 10" not in pages[0]
+    assert stats["header_footer_lines"] == 1
+
+
+def test_hyphenated_words_are_joined():
+    pages, stats, _ = compact_pages([
+        "The image formed by a concave mirror can be real or vir-\ntual, depending on where the object is placed.",
+        "Light travels in straight lines and its speed in a medium is given by the refrac-",
+        "tive index of that medium compared with the speed of light in vacuum.",
+    ])
+    assert "virtual, depending" in pages[0]
+    assert pages[1].rstrip().endswith("refractive")
+    assert pages[2].startswith("index of that medium")
+    assert stats["hyphenations"] == 2
+
+
+def test_contents_and_copyright_pages_are_dropped():
+    toc = "\n".join(f"{i}. Chapter title number {i} .......... {i * 12}" for i in range(1, 8))
+    copyright_page = "Copyright 2024 Example Press. All rights reserved. ISBN 978-0-00-000000-0"
+    pages, stats, _ = compact_pages([toc, copyright_page, BODY[0]])
+    assert pages[:2] == ["", ""]
+    assert BODY[0] in pages[2]
+    assert stats["pages_dropped"] == 2
+
+
+def test_repeated_paragraphs_are_kept_once():
+    raw = [BODY[0] + "\n" + BODY[1], BODY[1].upper() + "\n" + BODY[2]]
+    pages, stats, _ = compact_pages(raw)
+    assert BODY[1] in pages[0]
+    assert BODY[1].upper() not in pages[1] and BODY[2] in pages[1]
+    assert stats["duplicate_paragraphs"] == 1
+
+    pages, stats, _ = compact_pages(raw, dedupe_paragraphs=False)
+    assert BODY[1].upper() in pages[1]
+    assert "duplicate_paragraphs" not in stats
@@ -0,0 +1,168 @@
+"""
+Compaction of extracted PDF page text, so the characters we send to Gemini
+are content rather than layout noise:
+
+- running headers and footers (lines repeated at the top or bottom of many
+  pages, digits ignored so "Chapter 3 | Optics 41" matches on every page)
+  and bare page numbers are removed
+- words hyphenated across a line break are joined again
+- whitespace runs and blank lines are collapsed
+- table-of-contents pages and near-empty / copyright pages are dropped
+- optionally, repeated paragraphs (same words, ignoring case, digits and
+  punctuation) are kept only once
+
+Page positions are kept: a dropped page becomes "".
+
+    pages, stats, boilerplate = compact_pages(raw_pages)
+    stats["chars_in"], stats["chars_out"]
+"""
+import re
+from collections import Counter
+
+EDGE_LINES = 3  # Lines at the top and at the bottom of a page searched for headers/footers
+MIN_REPEAT_PAGES = 3
+REPEAT_FRACTION = 0.5  # A header must be on at least this share of the pages
+MIN_PAGE_ALNUM = 20  # Pages with less real text than this are dropped
+MIN_PARAGRAPH_KEY = 40  # Shorter paragraphs are never treated as duplicates
+TOC_MIN_LINES = 5
+TOC_FRACTION = 0.6
+BOILERPLATE_PAGE_CHARS = 800
+
+_SPACE_RE = re.compile(r"[ \t\u00a0\u2000-\u200b\u3000]+")
+_PAGE_NUMBER_RE = re.compile(
+    r"^(?:page\s*)?[-–—(\[]?\s*(?:\d{1,4}|[ivxl]{1,6})\s*[-–—)\]]?(?:\s*(?:of|/)\s*\d{1,4})?$",
+    re.IGNORECASE,
+)
+_TOC_LEADER_RE = re.compile(r"^.{2,100}?\s*[.·…_]{3,}\s*\d{1,4}$")  # "Optics ........ 41"
+_TOC_ENTRY_RE = re.compile(r"^(?:[\dIVX]+(?:\.\d+)*\.?\s+)?\D.{1,100}?\s+\d{1,4}$")  # "3.2 Lenses 45"
+_TOC_TITLE_RE = re.compile(r"^(?:table of )?contents$|^index$", re.IGNORECASE)
+_BOILERPLATE_RE = re.compile(
+    r"all rights reserved|intentionally left blank|\bisbn\b|printed in|no part of this (?:book|publication)",
+    re.IGNORECASE,
+)
+_HYPHENATED_RE = re.compile(r"[A-Za-z]-$")
+_KEY_RE = re.compile(r"[\W\d_]+", re.UNICODE)
+
+
+def _edge_key(line: str) -> str:
+    """What a header/footer line has in common across pages: its text with digits masked"""
+    return re.sub(r"\d+", "#", line.lower())
+
+
+def _clean_lines(text: str):
+    lines = (_SPACE_RE.sub(" ", line).strip() for line in (text or "").splitlines())
+    return [line for line in lines if line]
+
+
+def _edges(lines):
+    """Indices of the lines at the top and bottom of a page"""
+    return set(range(min(EDGE_LINES, len(lines)))) | set(range(max(len(lines) - EDGE_LINES, 0), len(lines)))
+
+
+def detect_boilerplate(pages_lines) -> set:
+    """Edge keys of lines repeated at the top or bottom of enough pages to be headers/footers"""
+    pages_lines = [lines for lines in pages_lines if lines]
+    if len(pages_lines) < MIN_REPEAT_PAGES:
+        return set()
+    counts = Counter()
+    for lines in pages_lines:
+        counts.update({_edge_key(lines[i]) for i in _edges(lines)})
+    needed = max(MIN_REPEAT_PAGES, REPEAT_FRACTION * len(pages_lines))
+    return {key for key, count in counts.items() if count >= needed and not _PAGE_NUMBER_RE.match(key)}
+
+
+def _is_toc(lines) -> bool:
+    if len(lines) < TOC_MIN_LINES:
+        return False
+    needed = TOC_FRACTION * len(lines)
+    if sum(1 for line in lines if _TOC_LEADER_RE.match(line)) >= needed:
+        return True
+    # Without dot leaders, lines ending in a number could be a table: only with a "Contents" title
+    titled = any(_TOC_TITLE_RE.match(lines[i]) for i in range(min(EDGE_LINES, len(lines))))
+    return titled and sum(1 for line in lines if _TOC_ENTRY_RE.match(line)) >= needed
+
+
+def _is_boilerplate_page(lines) -> bool:
+    text = " ".join(lines)
+    if sum(ch.isalnum() for ch in text) < MIN_PAGE_ALNUM:
+        return True
+    return len(text) < BOILERPLATE_PAGE_CHARS and bool(_BOILERPLATE_RE.search(text))
+
+
+def _dehyphenate(lines, stats):
+    out = []
+    for line in lines:
+        if out and _HYPHENATED_RE.search(out[-1]) and line[0].islower():
+            out[-1] = out[-1][:-1] + line
+            stats["hyphenations"] += 1
+        else:
+            out.append(line)
+    return out
+
+
+def _paragraphs(lines):
+    """Lines grouped into paragraphs, a paragraph ending at a line with closing punctuation"""
+    paragraph = []
+    for line in lines:
+        paragraph.append(line)
+        if line[-1] in ".!?:":
+            yield paragraph
+            paragraph = []
+    if paragraph:
+        yield paragraph
+
+
+def compact_pages(pages, boilerplate=None, dedupe_paragraphs: bool = True):
+    """
+    Compact a list of page texts. `boilerplate` is a set of header/footer
+    keys already found in other pages of the same document (headers can't be
+    detected in a batch of one or two pages). Returns (pages, stats,
+    boilerplate) where boilerplate includes the keys found in these pages.
+    """
+    stats = Counter(pages=len(pages), chars_in=sum(len(page or "") for page in pages))
+    pages_lines = [_clean_lines(page) for page in pages]
+    boilerplate = set(boilerplate or ()) | detect_boilerplate(pages_lines)
+
+    for lines in pages_lines:
+        edges = _edges(lines)
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edges and _PAGE_NUMBER_RE.match(line):
+                stats["page_numbers"] += 1
+            elif i in edges and _edge_key(line) in boilerplate:
+                stats["header_footer_lines"] += 1
+            else:
+                kept.append(line)
+        lines[:] = kept
+
+    # A word split across the page break goes back onto the page where it starts
+    for lines, following in zip(pages_lines, pages_lines[1:]):
+        if lines and following and _HYPHENATED_RE.search(lines[-1]) and following[0][0].islower():
+            head, _, rest = following[0].partition(" ")
+            lines[-1] = lines[-1][:-1] + head
+            following[0:1] = [rest] if rest else []
+            stats["hyphenations"] += 1
+
+    seen = set()
+    compacted = []
+    for lines in pages_lines:
+        if _is_toc(lines) or _is_boilerplate_page(lines):
+            stats["pages_dropped"] += 1
+            compacted.append("")
+            continue
+        lines = _dehyphenate(lines, stats)
+        if dedupe_paragraphs:
+            kept = []
+            for paragraph in _paragraphs(lines):
+                key = _KEY_RE.sub(" ", " ".join(paragraph).lower()).strip()
+                if len(key) >= MIN_PARAGRAPH_KEY:
+                    if key in seen:
+                        stats["duplicate_paragraphs"] += 1
+                        continue
+                    seen.add(key)
+                kept.extend(paragraph)
+            lines = kept
+        compacted.append("\n".join(lines) + "\n" if lines else "")
+
+    stats["chars_out"] = sum(len(page) for page in compacted)
+    return compacted, dict(stats), boilerplate
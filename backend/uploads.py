@@ -0,0 +1,307 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+from contextlib import aclosing
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b"%PDF-"
+MAGIC_SEARCH_BYTES = 1024  # The PDF header may follow a little leading junk
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(detail)
+
+
+class SpoolFile:
+    """
+    File object of one multipart file part, written straight into the spool
+    directory as the request body arrives: hashed, size-checked and checked
+    for the PDF header on the way, so an upload lands on disk once.
+    """
+
+    def __init__(self, spool):
+        self.max_bytes = spool.max_bytes
+        fd, self.path = tempfile.mkstemp(dir=spool.root_dir, suffix=".part")
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self._head = b""  # Start of the file, until the PDF header check is done
+        self.size = 0
+        self.taken = False  # Published by UploadSpool.adopt: close() leaves it alone
+
+    def _check_header(self):
+        if PDF_MAGIC not in self._head[:MAGIC_SEARCH_BYTES]:
+            raise UploadRejected(415, "Only PDF files are supported.")
+        self._head = None
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadRejected(413, f"PDF is larger than {self.max_bytes // (1024 * 1024)} MB.")
+        if self._head is not None:
+            self._head += data
+            if len(self._head) >= MAGIC_SEARCH_BYTES:
+                self._check_header()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def finish(self):
+        """Blocking: (path, sha256 hex, size) of the complete upload"""
+        if self.size == 0:
+            raise UploadRejected(400, "Uploaded file is empty.")
+        if self._head is not None:
+            self._check_header()
+        self._file.flush()
+        return self.path, self._digest.hexdigest(), self.size
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = 0):
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+        if not self.taken:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class UploadSpool:
+    """
+    Uploaded PDFs streamed to disk in fixed-size chunks, named by content hash.
+
+    Memory per upload stays at one chunk whatever the file size: the bytes are
+    hashed while they are copied, and extraction opens the file by path. Files
+    are reference counted, so concurrent requests with the same PDF share one
+    copy; it is deleted when the last of them releases it.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int, chunk_size: int = 1024 * 1024,
+                 stale_after: float = 3600.0):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._refs = {}
+        os.makedirs(root_dir, exist_ok=True)
+        self._remove_stale(stale_after)
+
+    def _remove_stale(self, older_than):
+        """Leftovers from a previous run that crashed mid-request"""
+        cutoff = time.time() - older_than
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def path_for(self, digest: str) -> str:
+        # Reference counts are per process, so each worker process keeps its own copy
+        return os.path.join(self.root_dir, f"{digest}-{os.getpid()}.pdf")
+
+    def copy_to_disk(self, fileobj):
+        """
+        Blocking: copy a file object to a temp file, hashing and size-checking
+        as it goes. Returns (temp_path, sha256 hex, size). Only for uploads
+        not parsed by SpoolingRoute, whose parts are in the spool already.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, suffix=".part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = fileobj.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if size == 0 and PDF_MAGIC not in chunk[:MAGIC_SEARCH_BYTES]:
+                        raise UploadRejected(415, "Only PDF files are supported.")
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadRejected(413, f"PDF is larger than {self.max_bytes // (1024 * 1024)} MB.")
+                    digest.update(chunk)
+                    out.write(chunk)
+            if size == 0:
+                raise UploadRejected(400, "Uploaded file is empty.")
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest(), size
+
+    @staticmethod
+    def take(spool_file: SpoolFile):
+        """
+        Blocking: same as copy_to_disk for an upload parsed into the spool
+        already, without the copy. Returns (temp_path, sha256 hex, size).
+        """
+        result = spool_file.finish()
+        spool_file._file.close()  # Windows can't rename an open file
+        spool_file.taken = True
+        return result
+
+    def acquire(self, tmp_path: str, digest: str) -> str:
+        """Publish a copied upload under its hash (or drop it if already there)"""
+        path = self.path_for(digest)
+        if self._refs.get(digest):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        self._refs[digest] = self._refs.get(digest, 0) + 1
+        return path
+
+    def release(self, digest: str):
+        count = self._refs.get(digest, 0) - 1
+        if count > 0:
+            self._refs[digest] = count
+            return
+        self._refs.pop(digest, None)
+        try:
+            os.remove(self.path_for(digest))
+        except FileNotFoundError:
+            pass
+
+    @property
+    def in_use(self) -> int:
+        return len(self._refs)
+
+
+class _SpoolingMultiPartParser(MultiPartParser):
+    """Starlette's multipart parser, with file parts written into an UploadSpool"""
+
+    def __init__(self, *args, spool, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spool = spool
+
+    def on_headers_finished(self):
+        super().on_headers_finished()
+        upload = self._current_part.file
+        if upload is not None:
+            self._files_to_close_on_error.pop().close()  # The in-memory spool it made
+            upload.file = SpoolFile(self.spool)
+            self._files_to_close_on_error.append(upload.file)
+
+
+class _SpoolingRequest(Request):
+    spool = None
+
+    async def _get_form(self, *, max_files=1000, max_fields=1000, max_part_size=1024 * 1024):
+        content_type = self.headers.get("content-type", "")
+        if self._form is None and content_type.startswith("multipart/form-data"):
+            try:
+                async with aclosing(self.stream()) as stream:
+                    parser = _SpoolingMultiPartParser(self.headers, stream, max_files=max_files,
+                                                      max_fields=max_fields, max_part_size=max_part_size,
+                                                      spool=self.spool)
+                    self._form = await parser.parse()
+            except MultiPartException as e:
+                raise HTTPException(status_code=400, detail=e.message)
+            except UploadRejected as e:
+                raise HTTPException(status_code=e.status_code, detail=e.detail)
+        return await super()._get_form(max_files=max_files, max_fields=max_fields, max_part_size=max_part_size)
+
+
+def spooling_route(spool: UploadSpool):
+    """
+    APIRoute class (app.router.route_class) whose multipart file parts are
+    written straight into `spool` while the body is parsed, instead of into
+    Starlette's temp files: UploadFile.file is then a SpoolFile.
+    """
+
+    class SpoolingRoute(APIRoute):
+        def get_route_handler(self):
+            handler = super().get_route_handler()
+
+            async def spooling_handler(request: Request):
+                request = _SpoolingRequest(request.scope, request.receive)
+                request.spool = spool
+                return await handler(request)
+
+            return spooling_handler
+
+    return SpoolingRoute
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware: rejects request bodies over their limit with 413, up
+    front from Content-Length when it is sent, otherwise as soon as the
+    streamed body passes it. `route_limits` ({path: bytes}) gives routes a
+    tighter limit than max_bytes, e.g. endpoints taking a single PDF.
+    """
+
+    def __init__(self, app, max_bytes: int, route_limits: dict = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.route_limits = route_limits or {}
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body too large."}'
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.route_limits.get(scope.get("path"), self.max_bytes)
+        length = dict(scope.get("headers") or []).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > max_bytes:
+            logger.warning(f"🚫 Rejected {int(length)} byte request to {scope.get('path')}")
+            await self._reject(send)
+            return
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    too_large = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if too_large:
+                # The framework turned our abort into its own error response: answer 413 instead
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except _BodyTooLarge:
+            if response_started:
+                raise
+            await self._reject(send)
@@ -206,7 +206,7 @@ function displayQuiz(questions) {
     questions.forEach((q, index) => {
         quizHTML += `
             <div class="quiz-question">
-                <p><strong>Q${index + 1}: ${q.text || q.question || 'Question'}</strong></p>
+                <p><strong>Q${index + 1}: ${q.text || q.question || q.q || 'Question'}</strong></p>
                 ${q.options ? `<ul>${q.options.map((opt, optIndex) => `<li><input type="radio" name="q${index}" value="${optIndex}"> ${opt}</li>`).join('')}</ul>` : ''}
             </div>
         `;